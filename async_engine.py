@@ -0,0 +1,128 @@
+import asyncio
+import functools
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+
+
+class TokenBucket(object):
+    """
+        Simple asyncio token bucket: `rate` requests/sec sustained with bursts of up
+            to `burst` requests.
+    """
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+
+class AsyncEngine(object):
+    """
+        Fans out the read-only REST calls for many markets at once. cbpro's clients
+            are blocking so each call runs on a worker thread; the clients' shared
+            requests.Session gets a connection pool big enough for all the workers.
+
+        Coinbase Pro rate limits are per IP (public) and per profile (private):
+            https://docs.pro.coinbase.com/#rate-limits
+    """
+    PUBLIC_RATE = 10
+    PUBLIC_BURST = 15
+    PRIVATE_RATE = 15
+    PRIVATE_BURST = 30
+
+    MAX_RETRIES = 3
+
+    def __init__(self, auth_client, public_client, max_workers=16,
+                 public_rate=PUBLIC_RATE, public_burst=PUBLIC_BURST,
+                 private_rate=PRIVATE_RATE, private_burst=PRIVATE_BURST):
+        self.auth_client = auth_client
+        self.public_client = public_client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.bucket_args = {
+            "public": (public_rate, public_burst),
+            "private": (private_rate, private_burst),
+        }
+
+        for client in [auth_client, public_client]:
+            session = getattr(client, "session", None)
+            if session is not None:
+                adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+
+    async def _call(self, bucket, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.MAX_RETRIES + 1):
+            await bucket.acquire()
+            result = await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+            # cbpro returns the error json rather than raising
+            if isinstance(result, dict) and "rate limit" in result.get("message", "").lower():
+                if attempt < self.MAX_RETRIES:
+                    await asyncio.sleep(2 ** attempt / bucket.rate)
+                    continue
+            return result
+
+    async def _fetch(self, market_names, order_ids):
+        # Buckets must be created inside the running loop
+        public = TokenBucket(*self.bucket_args["public"])
+        private = TokenBucket(*self.bucket_args["private"])
+
+        market_names = list(dict.fromkeys(market_names))
+        order_ids = list(dict.fromkeys(order_ids))
+
+        calls = [self._call(private, self.auth_client.get_accounts)]
+        for market_name in market_names:
+            calls.append(self._call(public, self.public_client.get_product_historic_rates,
+                                    market_name, granularity=60))
+            calls.append(self._call(public, self.public_client.get_product_24hr_stats,
+                                    market_name))
+        for order_id in order_ids:
+            calls.append(self._call(private, self.auth_client.get_order, order_id))
+
+        results = await asyncio.gather(*calls)
+
+        accounts = results[0]
+        market_results = results[1:1 + 2 * len(market_names)]
+        order_results = results[1 + 2 * len(market_names):]
+
+        snapshots = {}
+        orders = dict(zip(order_ids, order_results))
+        for i, market_name in enumerate(market_names):
+            snapshots[market_name] = {
+                "market_data": market_results[2 * i],
+                "stats": market_results[2 * i + 1],
+                "orders": orders,
+            }
+        return snapshots, accounts
+
+    def prefetch(self, market_names, order_ids):
+        """
+            Returns ({market_name: snapshot}, accounts) where each snapshot can be
+                passed as run_strategy(prefetched=...). Accounts are only fetched once
+                for the whole batch.
+        """
+        return asyncio.run(self._fetch(market_names, order_ids))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
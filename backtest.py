@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import itertools
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import numpy as np
+
+from candle_store import CandleStore
+
+
+"""
+    Replays the btfd_bot.py algorithm over cached candles (see candle_store.py):
+
+    * track the high (BUY) or low (SELL) since the last fill
+    * target_price = recent_extreme * (100 + percent_diff) / 100, quantized to quote_increment
+    * only ratchet the order in the favorable direction
+    * a limit order fills when a later candle's low (BUY) or high (SELL) crosses it
+
+    Between fills the target is just a quantized running max/min of the candles, so each
+        stretch between fills is computed with numpy accumulate ops instead of a Python
+        loop per candle.
+"""
+parser = argparse.ArgumentParser(
+    description="""
+        Backtest BTFD / sell-the-pump parameters over cached candles.
+
+        ex:
+            backtest.py BTC-USD ETH-USD BUY 14 USD -p -2 -5 -10
+    """,
+    formatter_class=argparse.RawTextHelpFormatter
+)
+
+parser.add_argument('market_names',
+                    nargs="+",
+                    help="(e.g. BTC-USD, ETH-USD, etc)")
+
+parser.add_argument('order_side',
+                    type=str,
+                    choices=["BUY", "SELL"])
+
+parser.add_argument('amount',
+                    type=Decimal,
+                    help="The quantity to buy or sell in the amount_currency")
+
+parser.add_argument('amount_currency',
+                    help="The currency the amount is denominated in ('QUOTE' or 'BASE' to apply to every market)")
+
+parser.add_argument('-p', '--percent_diffs',
+                    nargs="+",
+                    type=Decimal,
+                    required=True,
+                    dest="percent_diffs",
+                    help="percent_diff values to sweep (e.g. '-2 -5 -10')")
+
+parser.add_argument('-candle_dir',
+                    default="candles",
+                    dest="candle_dir",
+                    help="CandleStore dir (populate it with candle_store.py)")
+
+parser.add_argument('-days',
+                    default=365,
+                    type=float,
+                    dest="days",
+                    help="How many days of candles to replay")
+
+parser.add_argument('-reprice_every',
+                    default=5,
+                    type=int,
+                    dest="reprice_every",
+                    help="Candles between re-pricing the order (e.g. 5 = cron every 5min)")
+
+parser.add_argument('-fee_rate',
+                    default=Decimal("0.005"),
+                    type=Decimal,
+                    dest="fee_rate",
+                    help="Fee as a fraction of the fill value")
+
+parser.add_argument('-quote_increment',
+                    default=None,
+                    type=Decimal,
+                    dest="quote_increment",
+                    help="Override the product's quote_increment (skips the get_products call)")
+
+parser.add_argument('-base_increment',
+                    default=None,
+                    type=Decimal,
+                    dest="base_increment",
+                    help="Override the product's base_increment (skips the get_products call)")
+
+parser.add_argument('-workers',
+                    default=None,
+                    type=int,
+                    dest="workers",
+                    help="Process pool size (default: one per CPU)")
+
+
+
+def _quantize(values, increment):
+    # np.round is round-half-even, same as Decimal.quantize's default
+    return np.round(values / increment) * increment
+
+
+def simulate_fills(lows, highs, percent_diff, quote_increment, reprice_every=1, window=4096):
+    """
+        Returns (fill_indexes, fill_prices). The order is priced from the candles up
+            through candle i and can first fill on candle i+1.
+    """
+    buy = percent_diff < 0
+    factor = (100.0 + percent_diff) / 100.0
+    n = len(lows)
+
+    fill_indexes = []
+    fill_prices = []
+    start = 0
+    size = window
+    while start < n - 1:
+        end = min(n, start + size)
+        if buy:
+            extreme = np.maximum.accumulate(highs[start:end])
+        else:
+            extreme = np.minimum.accumulate(lows[start:end])
+
+        # The order is only re-priced every `reprice_every` candles; the running
+        #   max/min means every re-price is in the favorable direction.
+        offsets = np.arange(end - start)
+        repriced_at = offsets - offsets % reprice_every
+        target = _quantize(extreme[repriced_at] * factor, quote_increment)
+
+        if buy:
+            crossed = lows[start + 1:end] <= target[:-1]
+        else:
+            crossed = highs[start + 1:end] >= target[:-1]
+
+        hits = np.flatnonzero(crossed)
+        if hits.size == 0:
+            if end == n:
+                break
+            # No fill in this window; retry from the same start with a bigger window
+            size *= 2
+            continue
+
+        fill_index = start + 1 + hits[0]
+        fill_indexes.append(fill_index)
+        fill_prices.append(target[hits[0]])
+
+        # The next order's extreme starts from the candles after the fill
+        start = fill_index + 1
+        size = window
+
+    return np.array(fill_indexes, dtype=np.int64), np.array(fill_prices, dtype=np.float64)
+
+
+def run_backtest(candle_dir, market_name, percent_diff, amount, amount_is_quote, quote_increment,
+                 base_increment, fee_rate, since, reprice_every):
+    columns = CandleStore(candle_dir, market_name, granularity=60).columns(since=since)
+    times, lows, highs = columns["time"], columns["low"], columns["high"]
+
+    fill_indexes, prices = simulate_fills(lows, highs, float(percent_diff), float(quote_increment),
+                                          reprice_every=reprice_every)
+
+    if amount_is_quote:
+        sizes = _quantize(float(amount) / prices, float(base_increment))
+    else:
+        sizes = np.full(len(prices), float(_quantize(float(amount), float(base_increment))))
+    values = sizes * prices
+    fees = values * float(fee_rate)
+
+    total_size = sizes.sum()
+    return {
+        "market_name": market_name,
+        "percent_diff": percent_diff,
+        "candles": len(times),
+        "fills": len(prices),
+        "total_size": total_size,
+        "total_value": values.sum(),
+        "total_fees": fees.sum(),
+        "avg_price": values.sum() / total_size if total_size else None,
+        "first_fill": int(times[fill_indexes[0]]) if len(fill_indexes) else None,
+        "last_fill": int(times[fill_indexes[-1]]) if len(fill_indexes) else None,
+        # To compare avg_price against
+        "last_close": float(columns["close"][-1]) if len(times) else None,
+    }
+
+
+def _get_increments(market_names):
+    import cbpro
+    products = {p.get("id"): p for p in cbpro.PublicClient().get_products()}
+    increments = {}
+    for market_name in market_names:
+        product = products.get(market_name)
+        if not product:
+            raise Exception(f"Market {market_name} not found")
+        increments[market_name] = (Decimal(product.get("quote_increment")).normalize(),
+                                   Decimal(product.get("base_increment")).normalize())
+    return increments
+
+
+def _format_ts(ts):
+    if ts is None:
+        return "-"
+    return datetime.datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d %H:%M')
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    started = time.time()
+
+    if args.quote_increment and args.base_increment:
+        increments = {m: (args.quote_increment, args.base_increment) for m in args.market_names}
+    else:
+        increments = _get_increments(args.market_names)
+
+    since = time.time() - args.days * 86400
+    jobs = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for market_name, percent_diff in itertools.product(args.market_names, args.percent_diffs):
+            if args.amount_currency in ["QUOTE", "BASE"]:
+                amount_is_quote = args.amount_currency == "QUOTE"
+            else:
+                amount_is_quote = args.amount_currency == market_name.split("-")[1]
+            quote_increment, base_increment = increments[market_name]
+            jobs.append(executor.submit(
+                run_backtest,
+                args.candle_dir,
+                market_name,
+                percent_diff,
+                args.amount,
+                amount_is_quote,
+                quote_increment,
+                base_increment,
+                args.fee_rate,
+                since,
+                args.reprice_every
+            ))
+        results = [job.result() for job in jobs]
+
+    print("--------------------------------------------------------")
+    print(f"{'market':>10} {'pct':>6} {'fills':>6} {'size':>14} {'value':>14} {'fees':>10} {'avg_price':>14} {'last_close':>12}  first / last fill")
+    for r in results:
+        avg_price = f"{r['avg_price']:.8g}" if r["avg_price"] else "-"
+        last_close = f"{r['last_close']:.8g}" if r["last_close"] else "-"
+        print(f"{r['market_name']:>10} {r['percent_diff']:>6} {r['fills']:>6} {r['total_size']:>14.8f} "
+              f"{r['total_value']:>14.2f} {r['total_fees']:>10.4f} {avg_price:>14} {last_close:>12}  "
+              f"{_format_ts(r['first_fill'])} / {_format_ts(r['last_fill'])}")
+    print("--------------------------------------------------------")
+    print(f"{len(results)} backtests in {time.time() - started:.2f}s")
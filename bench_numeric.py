@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+import argparse
+import random
+import time
+
+from decimal import Decimal
+
+from numeric import MarketNumerics
+
+
+"""
+    Microbenchmark of the per-candle price math: the old Decimal path
+        (Decimal(...).quantize() for every value, float() for the order payload) vs.
+        numeric.MarketNumerics ticks (exact int math, exact payload strings).
+
+    Each step replays one minute candle against a ladder of resting BUY orders
+        (see ladder.py):
+
+        * the candle high (a float, as the candles API returns them) moves the
+            recent extreme
+        * every tier's target price is recomputed and ratcheted up; a tier that
+            moves gets a new size and order payload
+        * the candle low is checked against every resting tier for a fill
+
+    Both paths must produce the same payloads, or the benchmark fails.
+
+    ex:
+        python bench_numeric.py -markets 200 -candles 1000 -tiers 3
+"""
+parser = argparse.ArgumentParser(
+    description="Decimal vs. integer tick price math",
+    formatter_class=argparse.RawTextHelpFormatter
+)
+
+parser.add_argument('-markets', default=100, type=int, dest="markets")
+
+parser.add_argument('-candles', default=1000, type=int, dest="candles",
+                    help="Candles per market")
+
+parser.add_argument('-tiers', default=3, type=int, dest="tiers",
+                    help="Resting orders per market")
+
+parser.add_argument('-runs', default=3, type=int, dest="runs",
+                    help="Best of this many runs is reported")
+
+parser.add_argument('-seed', default=1, type=int, dest="seed")
+
+
+# (quote_increment, base_increment, starting price) like the real product list
+INCREMENTS = [
+    ("0.01000000", "0.00000001", 30000),
+    ("0.01000000", "0.00000001", 2000),
+    ("0.00001000", "0.00000001", 0.06),
+    ("0.00010000", "0.01000000", 0.5),
+    ("0.00100000", "0.00100000", 25),
+    ("0.00000001", "0.00100000", 0.002),
+]
+
+
+
+def generate_markets(num_markets, num_candles, num_tiers, seed):
+    rng = random.Random(seed)
+    markets = []
+    for i in range(num_markets):
+        quote_increment, base_increment, price = INCREMENTS[i % len(INCREMENTS)]
+        candles = []
+        for j in range(num_candles):
+            price *= 1 + rng.gauss(0, 0.002)
+            candles.append((price * (1 + rng.random() * 0.001), price * (1 - rng.random() * 0.001)))
+        first = Decimal(rng.randint(5, 50)) / Decimal("10")
+        markets.append({
+            "quote_increment": quote_increment,
+            "base_increment": base_increment,
+            "percent_diffs": [-first * (tier + 1) for tier in range(num_tiers)],
+            "amount": Decimal(rng.choice(["10", "14.50", "250"])),
+            "candles": candles,
+        })
+    return markets
+
+
+def decimal_path(market):
+    quote_increment = Decimal(market["quote_increment"]).normalize()
+    base_increment = Decimal(market["base_increment"]).normalize()
+    amount = market["amount"]
+    percent_diffs = market["percent_diffs"]
+    resting = [None] * len(percent_diffs)
+    recent_extreme = None
+    payloads = []
+    fills = 0
+    for high, low in market["candles"]:
+        high = Decimal(high).quantize(quote_increment)
+        if recent_extreme is None or high > recent_extreme:
+            recent_extreme = high
+            for tier, percent_diff in enumerate(percent_diffs):
+                target_price = (recent_extreme*(Decimal('100.0') + percent_diff)/Decimal('100.0')).quantize(quote_increment)
+                if resting[tier] is None or target_price > resting[tier]:
+                    resting[tier] = target_price
+                    size = (amount / target_price).quantize(base_increment)
+                    payloads.append((float(target_price), float(size)))
+
+        low = Decimal(low).quantize(quote_increment)
+        for tier, price in enumerate(resting):
+            if low <= price:
+                fills += 1
+    return payloads, fills
+
+
+def tick_path(market):
+    numerics = MarketNumerics(market["quote_increment"], market["base_increment"])
+    amount = market["amount"]
+    percent_diffs = market["percent_diffs"]
+    resting = [None] * len(percent_diffs)
+    recent_extreme = None
+    payloads = []
+    fills = 0
+    for high, low in market["candles"]:
+        high = numerics.price_ticks(high)
+        if recent_extreme is None or high > recent_extreme:
+            recent_extreme = high
+            for tier, percent_diff in enumerate(percent_diffs):
+                target_price = numerics.target_ticks(recent_extreme, percent_diff)
+                if resting[tier] is None or target_price > resting[tier]:
+                    resting[tier] = target_price
+                    size = numerics.size_for_quote(amount, target_price)
+                    payloads.append((numerics.format_price(target_price), numerics.format_size(size)))
+
+        low = numerics.price_ticks(low)
+        for tier, price in enumerate(resting):
+            if low <= price:
+                fills += 1
+    return payloads, fills
+
+
+def best_of(runs, fn, markets):
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        results = [fn(market) for market in markets]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    markets = generate_markets(args.markets, args.candles, args.tiers, args.seed)
+    steps = args.markets * args.candles
+
+    decimal_time, decimal_results = best_of(args.runs, decimal_path, markets)
+    tick_time, tick_results = best_of(args.runs, tick_path, markets)
+
+    # Same prices, sizes, and fills; the tick path's payloads are exact strings instead of floats
+    for (decimal_payloads, decimal_fills), (tick_payloads, tick_fills) in zip(decimal_results, tick_results):
+        if decimal_fills != tick_fills or len(decimal_payloads) != len(tick_payloads):
+            raise Exception(f"Mismatch: {decimal_fills} fills, {len(decimal_payloads)} orders vs. "
+                            f"{tick_fills} fills, {len(tick_payloads)} orders")
+        for (price, size), (price_str, size_str) in zip(decimal_payloads, tick_payloads):
+            if Decimal(repr(price)) != Decimal(price_str) or Decimal(repr(size)) != Decimal(size_str):
+                raise Exception(f"Mismatch: {price} {size} vs. {price_str} {size_str}")
+
+    print("--------------------------------------------------------")
+    print(f"\t markets: {args.markets}, candles: {args.candles}, tiers: {args.tiers} ({steps} steps, best of {args.runs})")
+    print(f"\t Decimal: {decimal_time * 1000:8.1f}ms  {decimal_time / steps * 1e6:6.2f}us/step")
+    print(f"\t ticks:   {tick_time * 1000:8.1f}ms  {tick_time / steps * 1e6:6.2f}us/step")
+    print(f"\t speedup: {decimal_time / tick_time:.2f}x")
+    print("--------------------------------------------------------")
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+
+"""
+    Measures what a "No order changes required" cron run costs from a cold start:
+
+    * interpreter:  `python -c pass` (the floor nothing in the bot can improve)
+    * imports:      `python -c "import btfd_bot"` (everything module-level)
+    * no-op run:    run_strategy against the in-process SimulatedExchange after a
+                    first run has already placed the order, i.e. the common case
+
+    Each sample is a fresh subprocess so nothing is warm in sys.modules. Wall time
+        and child CPU (user+sys) are reported.
+
+    ex:
+        python bench_startup.py -runs 20
+        python bench_startup.py -importtime     (also list the slowest imports)
+"""
+parser = argparse.ArgumentParser(
+    description="Cold-start benchmark for a no-op btfd_bot.py run",
+    formatter_class=argparse.RawTextHelpFormatter
+)
+
+parser.add_argument('-runs', default=10, type=int, dest="runs")
+
+parser.add_argument('-importtime',
+                    action="store_true",
+                    default=False,
+                    dest="importtime",
+                    help="Show the 15 slowest imports (python -X importtime)")
+
+parser.add_argument('--child',
+                    action="store_true",
+                    default=False,
+                    dest="child",
+                    help=argparse.SUPPRESS)
+
+
+
+def run_child():
+    """ One cold process: import the bot, seed an order, then time the no-op run """
+    started = time.perf_counter()
+    import btfd_bot
+    import models
+    from notifications import NotificationBackend, Notifier
+    from simulator import SimulatedExchange, load_candles
+    imported = time.perf_counter()
+
+    models.db.init(":memory:", pragmas=models.PRAGMAS)
+    # Connect first; the ":memory:" db only lives as long as its connection
+    models.db.connect()
+    models.create_tables()
+
+    market_name = "SIM0-USD"
+    exchange = SimulatedExchange(load_candles([market_name], seed=1), seed=1)
+    notifier = Notifier(NotificationBackend(), digest_window=0)
+    kwargs = dict(market_name=market_name, order_side="BUY", amount=btfd_bot.Decimal("10"),
+                  amount_currency="USD", percent_diff=btfd_bot.Decimal("-5.0"))
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        # Places the order...
+        btfd_bot.run_strategy(exchange, exchange, notifier, **kwargs)
+        calls_before = exchange.call_count
+
+        # ...so this one is the typical cron run that has nothing to do
+        noop_started = time.perf_counter()
+        btfd_bot.run_strategy(exchange, exchange, notifier, **kwargs)
+        noop_elapsed = time.perf_counter() - noop_started
+
+    if "No order changes required" not in output.getvalue().split("Retrieved order")[-1]:
+        raise Exception("Second run was not a no-op")
+
+    print(json.dumps({
+        "imports": imported - started,
+        "noop": noop_elapsed,
+        "noop_api_calls": exchange.call_count - calls_before,
+    }))
+
+
+def timed_subprocess(cmd):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            check=True, universal_newlines=True)
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return wall, cpu, result
+
+
+def summarize(label, values):
+    values = sorted(values)
+    print(f"\t {label:<24} p50 {statistics.median(values) * 1000:7.1f}ms"
+          f"   min {values[0] * 1000:7.1f}ms   max {values[-1] * 1000:7.1f}ms")
+
+
+def show_importtime(limit=15):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import btfd_bot"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            check=True, universal_newlines=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        rows.append((int(parts[1]), parts[2].rstrip()))
+    print("Slowest imports (cumulative):")
+    for cumulative, name in sorted(rows, reverse=True)[:limit]:
+        print(f"\t {cumulative / 1000:7.1f}ms {name}")
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if args.child:
+        run_child()
+        sys.exit()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    samples = {"interpreter wall": [], "import wall": [], "import cpu": [],
+               "child wall (seed+no-op)": [], "child cpu (seed+no-op)": [], "no-op run_strategy": []}
+    noop_api_calls = None
+    for i in range(args.runs):
+        wall, cpu, _ = timed_subprocess([sys.executable, "-c", "pass"])
+        samples["interpreter wall"].append(wall)
+
+        wall, cpu, _ = timed_subprocess([sys.executable, "-c", "import btfd_bot"])
+        samples["import wall"].append(wall)
+        samples["import cpu"].append(cpu)
+
+        wall, cpu, result = timed_subprocess([sys.executable, __file__, "--child"])
+        child = json.loads(result.stdout.strip().splitlines()[-1])
+        samples["child wall (seed+no-op)"].append(wall)
+        samples["child cpu (seed+no-op)"].append(cpu)
+        samples["no-op run_strategy"].append(child["noop"])
+        noop_api_calls = child["noop_api_calls"]
+
+    print("--------------------------------------------------------")
+    print(f"\t runs: {args.runs}")
+    for label, values in samples.items():
+        summarize(label, values)
+    print(f"\t no-op api calls:         {noop_api_calls}")
+    print("--------------------------------------------------------")
+
+    if args.importtime:
+        show_importtime()
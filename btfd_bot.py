@@ -1,23 +1,40 @@
 #!/usr/bin/env python
 
+import time
+_imports_started = time.perf_counter()
+
 import argparse
-import boto3
 import configparser
 import datetime
-import dateutil
 import decimal
+import heapq
 import json
 import math
-import pytz
+import models
 import sys
-import time
-
-import cbpro
+import threading
+import traceback
+import uuid
 
+from caches import balance_cache, product_cache
 from decimal import Decimal
-from models import Order, create_order_from_json, update_order_from_json
-from utils import convert_datetime_str
+from extreme_tracker import ExtremeTracker, load_tracker, save_tracker
+from journal import cancel_orders, place_order, recover_intents, strategy_lock
+from ladder import build_ladder, diff_ladder
+from metrics import InstrumentedClient, metrics
+from models import (create_tables, db, Order, create_order_from_json, get_date_last_updated,
+                    get_last_done_order, get_ladder_anchor, get_open_ladder_orders,
+                    get_open_order, update_order_from_json)
+from notifications import create_notifier
+from numeric import market_numerics
+from profiles import load_profile
+from reconcile import reconcile_orders
+from reprice import default_reprice_policy, load_reprice_policy
+from signals import load_signals, save_signals, VolatilityTarget
+from strategies import load_strategies
+from utils import utc_timestamp
 
+metrics.observe("btfd_stage_seconds", time.perf_counter() - _imports_started, stage="imports")
 
 
 def get_timestamp():
@@ -32,6 +49,8 @@ def get_timestamp():
 
     This is meant to be run as a crontab to make regular buys/sells on a set schedule.
 """
+SIMULATOR_DATABASE = 'simulator.db'
+
 parser = argparse.ArgumentParser(
     description="""
         This is a basic Coinbase Pro BUY THE FUCKING DIP bot (or optional sell-the-pump).
@@ -46,20 +65,27 @@ parser = argparse.ArgumentParser(
 )
 
 # Required positional arguments
-parser.add_argument('market_name', help="(e.g. BTC-USD, ETH-BTC, etc)")
+#   (optional in --daemon mode; strategies are then read from the config file)
+parser.add_argument('market_name',
+                    nargs="?",
+                    help="(e.g. BTC-USD, ETH-BTC, etc)")
 
 parser.add_argument('order_side',
+                    nargs="?",
                     type=str,
                     choices=["BUY", "SELL"])
 
 parser.add_argument('amount',
+                    nargs="?",
                     type=Decimal,
                     help="The quantity to buy or sell in the amount_currency")
 
 parser.add_argument('amount_currency',
+                    nargs="?",
                     help="The currency the amount is denominated in")
 
 parser.add_argument('percent_diff',
+                    nargs="?",
                     type=Decimal,
                     help="The percentage above or below recent high (e.g. '-10.0' = 10% below")
 
@@ -88,92 +114,177 @@ parser.add_argument('-c', '--config',
                     dest="config_file",
                     help="Override default config file location")
 
+parser.add_argument('-db',
+                    default=None,
+                    dest="database",
+                    help="Override the default sqlite db location (data.db; simulator.db with -simulate)")
 
+parser.add_argument('-account',
+                    default=None,
+                    dest="account",
+                    help="Trade in the [profile:<name>] account instead of [production]/[sandbox] (see runner.py to run many)")
 
-if __name__ == "__main__":
-    args = parser.parse_args()
-    print("%s: STARTED: %s" % (get_timestamp(), args))
+parser.add_argument('-simulate',
+                    action="store_true",
+                    default=False,
+                    dest="simulate_mode",
+                    help="Run against the local SimulatedExchange (generated candles replayed at 60x) instead of Coinbase Pro")
 
-    market_name = args.market_name
-    order_side = args.order_side.lower()
-    amount = args.amount
-    amount_currency = args.amount_currency
-    percent_diff = args.percent_diff
+parser.add_argument('-candle_dir',
+                    default=None,
+                    dest="candle_dir",
+                    help="Cache minute candles in this dir and only fetch the missing range each run")
 
-    sandbox_mode = args.sandbox_mode
-    job_mode = args.job_mode
-    warn_after = args.warn_after
+parser.add_argument('-metrics',
+                    default=None,
+                    dest="metrics_file",
+                    help="Export per-stage timings and API error counts here (*.prom = Prometheus text, else JSON lines)")
 
-    if not sandbox_mode and not job_mode:
-        if sys.version_info[0] < 3:
-            # python2.x compatibility
-            response = raw_input("Production purchase! Confirm [Y]: ")  # noqa: F821
-        else:
-            response = input("Production purchase! Confirm [Y]: ")
-        if response != 'Y':
-            print("Exiting without submitting purchase.")
-            exit()
+parser.add_argument('-profile',
+                    default=None,
+                    dest="profile_file",
+                    help="Write cProfile stats for the whole run to this file")
 
-    # Read settings
-    config = configparser.ConfigParser()
-    config.read(args.config_file)
+parser.add_argument('--daemon',
+                    action="store_true",
+                    default=False,
+                    dest="daemon_mode",
+                    help="Stay resident and run every [strategy:<name>] in the config on its own interval")
+
+parser.add_argument('--async',
+                    action="store_true",
+                    default=False,
+                    dest="async_mode",
+                    help="(--daemon only) Fetch market data for all due strategies concurrently")
+
+parser.add_argument('--stream',
+                    action="store_true",
+                    default=False,
+                    dest="stream_mode",
+                    help="(--daemon only) Use the websocket feed for candles/price and react to new highs/lows immediately")
+
+parser.add_argument('--trigger',
+                    action="store_true",
+                    default=False,
+                    dest="trigger_mode",
+                    help="(--stream only) Don't keep orders resting; place each one only once the price comes within -trigger_band of its target")
+
+parser.add_argument('-trigger_band',
+                    default=Decimal("0.5"),
+                    type=Decimal,
+                    dest="trigger_band",
+                    help="(--trigger only) How close (percent of target_price) the price gets before the order is placed")
+
+parser.add_argument('-ladder',
+                    nargs="+",
+                    type=Decimal,
+                    default=None,
+                    dest="ladder",
+                    help="More percent_diff tiers (e.g. -ladder -15 -20); amount is split across all tiers")
+
+parser.add_argument('-ladder_weights',
+                    nargs="+",
+                    type=Decimal,
+                    default=None,
+                    dest="ladder_weights",
+                    help="(-ladder only) Relative size of each tier incl. percent_diff (default: even split)")
+
+parser.add_argument('-atr_multiple',
+                    default=None,
+                    type=Decimal,
+                    dest="atr_multiple",
+                    help="Scale percent_diff with volatility: target this many ATRs from the recent extreme (percent_diff is the minimum)")
+
+parser.add_argument('-atr_granularity',
+                    default=3600,
+                    type=int,
+                    choices=[60, 300, 3600, 86400],
+                    dest="atr_granularity",
+                    help="(-atr_multiple only) Candle size the ATR is computed on")
+
+parser.add_argument('-max_percent_diff',
+                    default=None,
+                    type=Decimal,
+                    dest="max_percent_diff",
+                    help="(-atr_multiple only) Cap on the scaled percent_diff")
+
+parser.add_argument('-max_workers',
+                    default=16,
+                    action="store",
+                    type=int,
+                    dest="max_workers",
+                    help="(--async only) Max concurrent API requests / pooled connections")
+
+
+
+def create_clients(config, config_section, sandbox_mode=False, pool_size=None):
+    """
+        Builds the (auth_client, public_client) cbpro pair from a settings.conf
+            section (API_KEY, SECRET_KEY, PASSPHRASE, optional API_URL).
+
+        With `pool_size`, both clients share one requests.Session with a connection
+            pool of that size, so a long-lived process keeps its connections alive
+            across runs.
+    """
+    # cbpro pulls in requests, pymongo, and websocket; only import it when we need it
+    import cbpro
 
-    config_section = 'production'
-    if sandbox_mode:
-        config_section = 'sandbox'
     key = config.get(config_section, 'API_KEY')
     passphrase = config.get(config_section, 'PASSPHRASE')
     secret = config.get(config_section, 'SECRET_KEY')
-    aws_access_key_id = config.get(config_section, 'AWS_ACCESS_KEY_ID')
-    aws_secret_access_key = config.get(config_section, 'AWS_SECRET_ACCESS_KEY')
-    sns_topic = config.get(config_section, 'SNS_TOPIC')
 
-    # Instantiate public and auth API clients
-    if not args.sandbox_mode:
-        auth_client = cbpro.AuthenticatedClient(key, secret, passphrase)
+    if not sandbox_mode:
+        api_url = config.get(config_section, 'API_URL', fallback="https://api.pro.coinbase.com")
     else:
         # Use the sandbox API (requires a different set of API access credentials)
-        auth_client = cbpro.AuthenticatedClient(
-            key,
-            secret,
-            passphrase,
-            api_url="https://api-public.sandbox.pro.coinbase.com")
+        api_url = config.get(config_section, 'API_URL', fallback="https://api-public.sandbox.pro.coinbase.com")
+    auth_client = cbpro.AuthenticatedClient(key, secret, passphrase, api_url=api_url)
 
     public_client = cbpro.PublicClient()
 
-    # Retrieve dict list of all trading pairs
-    products = public_client.get_products()
-    base_min_size = None
-    base_increment = None
-    quote_increment = None
-    for product in products:
-        if product.get("id") == market_name:
-            base_currency = product.get("base_currency")
-            quote_currency = product.get("quote_currency")
-            base_min_size = Decimal(product.get("base_min_size")).normalize()
-            base_increment = Decimal(product.get("base_increment")).normalize()
-            quote_increment = Decimal(product.get("quote_increment")).normalize()
-            if amount_currency == product.get("quote_currency"):
-                amount_currency_is_quote_currency = True
-            elif amount_currency == product.get("base_currency"):
-                amount_currency_is_quote_currency = False
-            else:
-                raise Exception("amount_currency %s not in market %s" % (amount_currency,
-                                                                         market_name))
-            # print(json.dumps(product, indent=2))
-
-    # print("base_min_size: %s" % base_min_size)
-    # print("quote_increment: %s" % quote_increment)
-
-    # Prep boto SNS client for email notifications
-    sns = boto3.client(
-        "sns",
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name="us-east-1"     # N. Virginia
+    if pool_size:
+        from requests.adapters import HTTPAdapter
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        auth_client.session.mount("https://", adapter)
+        auth_client.session.mount("http://", adapter)
+        # Auth headers are added per request, so the public client can share the session
+        public_client.session = auth_client.session
+
+    return auth_client, public_client
+
+
+
+def report_finished_order(notifier, order, order_json, amount, amount_currency, percent_diff,
+                          quote_currency):
+    print(json.dumps(order_json, indent=2))
+    if order.status == Order.STATUS__DONE:
+        if percent_diff < 0:
+            subject = "Bought the dip!"
+        else:
+            subject = "Sold the pump!"
+    else:
+        subject = "ERROR:"
+
+    notifier.publish(
+        f"{subject} {order.market_name} {order.side} order of {amount} {amount_currency} {order.status} @ {order.target_price} {quote_currency}",
+        json.dumps(order_json, sort_keys=True, indent=4),
+        digest=order.status == Order.STATUS__DONE
     )
 
-    # Get current balances
+    print("%s: DONE: %s %s order of %s %s %s @ %s %s" % (
+        datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        order.market_name,
+        order.side,
+        amount,
+        amount_currency,
+        order.status,
+        order.target_price,
+        quote_currency))
+
+
+
+def print_balances(auth_client, numerics, base_currency, quote_currency):
+    # Only needed when we're about to place an order; a no-op run skips get_accounts entirely
     """
         {
             'id': '********-****-****-****-************',
@@ -185,17 +296,17 @@ if __name__ == "__main__":
             'trading_enabled': True
         }
     """
+    accounts = balance_cache.get(auth_client)
     base_currency_balance = None
+    base_currency_hold = None
     quote_currency_balance = None
-    for account in auth_client.get_accounts():
-        if account.get("currency") == base_currency:
-            base_currency_balance = Decimal(account.get("balance")).quantize(base_increment)
-            base_currency_hold = Decimal(account.get("hold")).quantize(base_increment)
-        elif account.get("currency") == quote_currency:
-            quote_currency_balance = Decimal(account.get("balance")).quantize(quote_increment)
-            quote_currency_hold = Decimal(account.get("hold")).quantize(quote_increment)
-        if base_currency_balance and quote_currency_balance:
-            break
+    quote_currency_hold = None
+    if base_currency in accounts:
+        base_currency_balance = numerics.format_size(numerics.size_ticks(accounts[base_currency].get("balance")))
+        base_currency_hold = numerics.format_size(numerics.size_ticks(accounts[base_currency].get("hold")))
+    if quote_currency in accounts:
+        quote_currency_balance = numerics.format_price(numerics.price_ticks(accounts[quote_currency].get("balance")))
+        quote_currency_hold = numerics.format_price(numerics.price_ticks(accounts[quote_currency].get("hold")))
     print(f"--------------------------------------------------------")
     print(f"\t base_currency_balance:  {base_currency_balance} {base_currency}")
     print(f"\t base_currency_hold:     {base_currency_hold} {base_currency}")
@@ -203,102 +314,137 @@ if __name__ == "__main__":
     print(f"\t quote_currency_hold:    {quote_currency_hold} {quote_currency}")
     print(f"--------------------------------------------------------")
 
-    # Get the current btfd order
-    date_last_updated = None
-    order = Order.filter(
-        market_name=market_name,
-        status__in=[Order.STATUS__OPEN, Order.STATUS__PENDING],
-        side=order_side
-    ).order_by(Order.created.desc()).first()
-
-    if not order:
-        print("No open order. Creating a new one")
-        order = Order()
 
-    else:
-        print(f"Retrieved order {order.id}: {order.order_id}")
+def submit_order(auth_client, notifier, order, numerics, market_name, order_side, price_ticks,
+                 size_ticks, percent_diff, current_price_ticks, base_currency, quote_currency):
+    """
+        Places the limit order and saves the result into `order`. Returns False if
+            the exchange refused it (`order` is left unsaved).
 
-        # Update the order's status
-        order_json = auth_client.get_order(order.order_id)
-        if not order_json:
-            raise Exception(f"Could not retrieve order {order.order_id}")
+        Prices and sizes are in the market's ticks (see numeric.MarketNumerics) and
+            go out as exact strings.
+    """
+    """
+        {
+            "id": "d0c5340b-6d6c-49d9-b567-48c4bfca13d2",
+            "price": "0.10000000",
+            "size": "0.01000000",
+            "product_id": "BTC-USD",
+            "side": "buy",
+            "stp": "dc",
+            "type": "limit",
+            "time_in_force": "GTC",
+            "post_only": false,
+            "created_at": "2016-12-08T20:02:28.53864Z",
+            "fill_fees": "0.0000000000000000",
+            "filled_size": "0.00000000",
+            "executed_value": "0.0000000000000000",
+            "status": "pending",
+            "settled": false
+        }
+    """
+    print(f"--------------------------------------------------------")
+    print(f"Placing limit order:")
+    print(f"\t market: {market_name}")
+    print(f"\t side:   {order_side}")
+    target_price = numerics.format_price(price_ticks)
+    size = numerics.format_size(size_ticks)
+    value = numerics.price_ticks(numerics.quote_value(price_ticks, size_ticks))
+    print(f"\t price:  {target_price} {quote_currency}")
+    print(f"\t amount: {size} {base_currency}")
+    print(f"\t value:  {numerics.format_price(value)} {quote_currency}")
+    print(f"--------------------------------------------------------")
+    # Journalled with a client_oid; also saves `order` if it was placed
+    result = place_order(auth_client, order, market_name, order_side, target_price, size,
+                         percent_diff)
+    balance_cache.invalidate(auth_client)
 
-        if order_json.get("message") == "NotFound":
-            # Order was probably manually cancelled
-            order.status = Order.STATUS__CANCELLED
-            order.save()
+    print(json.dumps(result, sort_keys=True, indent=4))
 
-            order = Order()
+    if "message" in result and "Post only mode" in result.get("message"):
+        # Price moved away from valid order
+        print("Post only mode at %s %s" % (target_price, quote_currency))
 
-        else:
-            date_last_updated = order.created
-            update_order_from_json(order, order_json, percent_diff)
-
-            if order.status not in [Order.STATUS__OPEN, Order.STATUS__PENDING]:
-                # Order status is no longer pending!
-                print(json.dumps(order_json, indent=2))
-                if order.status == Order.STATUS__DONE:
-                    if percent_diff < 0:
-                        subject = "Bought the dip!"
-                    else:
-                        subject = "Sold the pump!"
-                    date_last_updated = order.updated
-                else:
-                    subject = "ERROR:"
+    elif "message" in result:
+        # Something went wrong if there's a 'message' field in response
+        notifier.publish(
+            "Could not place %s %s order for %s %s" % (market_name,
+                                                       order_side,
+                                                       size,
+                                                       base_currency),
+            json.dumps(result, sort_keys=True, indent=4)
+        )
+        return False
 
-                sns.publish(
-                    TopicArn=sns_topic,
-                    Subject=f"{subject} {market_name} {order_side} order of {amount} {amount_currency} {order.status} @ {order.target_price} {quote_currency}",
-                    Message=json.dumps(order_json, sort_keys=True, indent=4)
-                )
+    if result and "status" in result and result["status"] == Order.STATUS__REJECTED:
+        # Rejected - usually because price was above lowest sell offer. Try
+        #   again in the next loop.
+        print("%s: %s Order rejected @ %s %s" % (get_timestamp(),
+                                                 market_name,
+                                                 numerics.format_price(current_price_ticks),
+                                                 quote_currency))
 
-                print("%s: DONE: %s %s order of %s %s %s @ %s %s" % (
-                    datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    market_name,
-                    order_side,
-                    amount,
-                    amount_currency,
-                    order.status,
-                    order.target_price,
-                    quote_currency))
+    return "message" not in result
 
-                # Now we'll need to prep a new order, starting from the previous one's fill date.
-                order = Order()
 
-    if not date_last_updated:
-        # We're creating a new order, but try to pick up where the last one left off.
-        prev_order = Order.filter(
-            market_name=market_name,
-            status=Order.STATUS__DONE,
-            side=order_side
-        ).order_by(Order.created.desc()).first()
-        if prev_order:
-            print(f"Using order {prev_order.id}'s created: {prev_order.created}")
-            date_last_updated = prev_order.created
-
-    if date_last_updated:
-        print(f"date_last_updated: {date_last_updated} ({int(pytz.utc.localize(date_last_updated).timestamp())})")
+def find_recent_extreme(public_client, market_name, order_side, percent_diff, date_last_updated,
+                        numerics, prefetched, candle_dir=None, signals=None):
+    """
+        The high (BUY, percent_diff < 0) or low (SELL) since `date_last_updated`,
+            along with the current price. Returns (recent_extreme, current_price),
+            both in `numerics` price ticks.
 
+        `signals` (a signals.MarketSignals) is fed any new candles along the way.
+    """
     """
         We'll retrieve the most recent 300 1-minute candles so this must be run at least
         every 5hrs (more likely we'll run this every 5min).
 
         [ time, low, high, open, close, volume ]
     """
-    market_data = public_client.get_product_historic_rates(
-        market_name,
-        granularity=60    # minute candles
-    )
+    market_data = prefetched.get("market_data")
+    tracker = load_tracker(market_name, order_side, ExtremeTracker.MAX if percent_diff < 0 else ExtremeTracker.MIN)
+    if candle_dir:
+        with metrics.timer("candle_store", market_name):
+            # Only the missing time range comes from the API; the rest is served locally
+            from candle_store import CandleStore
+            candle_store = CandleStore(candle_dir, market_name, granularity=60)
+            if market_data:
+                candle_store.merge(market_data)
+            else:
+                candle_store.sync(public_client)
+            since = None
+            if date_last_updated:
+                since = int(utc_timestamp(date_last_updated))
+                if tracker.last_ts and tracker.anchor <= since:
+                    # The tracker (and signals) already saw everything up to their
+                    #   last_ts; only copy out the candles after that (plus the
+                    #   tracker's newest, which may have still been open)
+                    seen = tracker.last_ts - 1
+                    if signals is not None:
+                        seen = min(seen, signals.last_ts)
+                    since = max(since, seen)
+            market_data = candle_store.market_data(since=since)
+
+    elif market_data is None:
+        market_data = public_client.get_product_historic_rates(
+            market_name,
+            granularity=60    # minute candles
+        )
 
     # Scan for new recent_extreme from...
     if date_last_updated:
         # ...last check
         #   (dates from the db have no TZ; must force to utc to avoid local TZ shift assumptions)
-        recent_extreme_from_date = int(pytz.utc.localize(date_last_updated).timestamp())
+        recent_extreme_from_date = int(utc_timestamp(date_last_updated))
     else:
         # ...or across the whole range of market_data
         recent_extreme_from_date = market_data[-1][0]
 
+    if signals is not None:
+        with metrics.timer("signals", market_name):
+            signals.absorb(market_data)
+
     print(f"recent_extreme_from_date: {recent_extreme_from_date}")
     # print(f" market_data[0][0]: {market_data[0][0]}")
     # print(f"market_data[-1][0]: {market_data[-1][0]}")
@@ -314,119 +460,765 @@ if __name__ == "__main__":
             "volume_30day": "1019451.11188405"
         }
     """
-    stats = public_client.get_product_24hr_stats(market_name)
-    current_price = Decimal(stats.get("last")).quantize(quote_increment)
+    stats = prefetched.get("stats") or public_client.get_product_24hr_stats(market_name)
+    current_price = numerics.price_ticks(stats.get("last"))
+
+    # Only the candles newer than what the persisted tracker has already seen get scanned
+    with metrics.timer("extreme", market_name):
+        if not tracker.set_anchor(recent_extreme_from_date):
+            tracker.reset(recent_extreme_from_date)
+        if tracker.last_ts and market_data and market_data[-1][0] > tracker.last_ts + 60:
+            print(f"WARNING: candles missing between {tracker.last_ts} and {market_data[-1][0]}")
+        tracker.absorb(market_data)
+        save_tracker(market_name, order_side, tracker)
 
-    if market_data[0][0] < recent_extreme_from_date:
+    if tracker.extreme() is None:
         # The last order was just recently completed within the ~5min lag time of the market_data candles.
         #   Use the current_price as a good-enough stand in for our new recent_extreme.
         recent_extreme = current_price
         print("Last order just closed; have to use current price for recent_extreme")
     else:
+        recent_extreme = numerics.price_ticks(tracker.extreme())
         if percent_diff < 0:
             # BUY THE F'N DIP! Identify recent high
-            recent_extreme = Decimal(max([d[2] for d in market_data if d[0] > recent_extreme_from_date])).quantize(quote_increment)
             if current_price > recent_extreme:
                 # Price has moved further in the ~5min lag time
                 recent_extreme = current_price
         else:
-            recent_extreme = Decimal(min([d[1] for d in market_data if d[0] > recent_extreme_from_date])).quantize(quote_increment)
             if current_price < recent_extreme:
                 # Price has moved further in the ~5min lag time
                 recent_extreme = current_price
 
-    target_price = (recent_extreme*(Decimal('100.0') + percent_diff)/Decimal('100.0')).quantize(quote_increment)
+    return recent_extreme, current_price
+
+
+def run_strategy(auth_client, public_client, notifier, market_name, order_side,
+                 amount, amount_currency, percent_diff, prefetched=None, candle_dir=None,
+                 ladder=None, ladder_weights=None, reprice_policy=None, place_new=True,
+                 volatility_target=None):
+    """
+        Runs one pass of the BTFD (or sell-the-pump) logic for a single market/side:
+        update the status of the current order, find the recent extreme, and
+        (re)place the limit order if the target_price has moved in our favor.
+
+        `prefetched` is an optional AsyncEngine snapshot of the read-only API
+            results (market_data, stats, orders) for this market.
+
+        `candle_dir` enables the local CandleStore cache of minute candles.
+
+        With `ladder` (more percent_diff tiers) this runs run_ladder instead.
+
+        `reprice_policy` (default: reprice.default_reprice_policy) can hold back
+            small or too-frequent re-prices.
+
+        `volatility_target` (a signals.VolatilityTarget) widens percent_diff when the
+            market is more volatile.
+
+        With `place_new` False, resting orders are still updated and re-priced but no
+            new order is placed (--trigger mode, until the TriggerEngine fires).
+
+        Only one run per market/side happens at a time (see journal.strategy_lock),
+            and any placement/cancellation a previous run left unresolved is
+            sorted out first (journal.recover_intents).
+    """
+    reprice_policy = reprice_policy or default_reprice_policy
+    with strategy_lock(market_name, order_side) as locked:
+        if not locked:
+            print(f"{market_name} {order_side} is already being run elsewhere; skipping")
+            return None
+
+        recover_intents(auth_client, market_name, order_side)
+
+        if ladder:
+            return run_ladder(auth_client, public_client, notifier, market_name, order_side,
+                              amount, amount_currency, [percent_diff] + list(ladder),
+                              ladder_weights, prefetched=prefetched, candle_dir=candle_dir,
+                              reprice_policy=reprice_policy, place_new=place_new,
+                              volatility_target=volatility_target)
+
+        return run_single_order(auth_client, public_client, notifier, market_name, order_side,
+                                amount, amount_currency, percent_diff, prefetched=prefetched,
+                                candle_dir=candle_dir, reprice_policy=reprice_policy,
+                                place_new=place_new, volatility_target=volatility_target)
+
+
+def run_single_order(auth_client, public_client, notifier, market_name, order_side,
+                     amount, amount_currency, percent_diff, prefetched=None, candle_dir=None,
+                     reprice_policy=None, place_new=True, volatility_target=None):
+    """ The one-limit-order-per-market/side mode of run_strategy """
+    reprice_policy = reprice_policy or default_reprice_policy
+    order_side = order_side.lower()
+    if prefetched is None:
+        prefetched = {}
+
+    # Product increments almost never change; served from the product metadata cache
+    product = product_cache.get(public_client, market_name)
+    if not product:
+        raise Exception(f"Market {market_name} not found")
+
+    base_currency = product.get("base_currency")
+    quote_currency = product.get("quote_currency")
+    numerics = market_numerics(product)
+    if amount_currency == quote_currency:
+        amount_currency_is_quote_currency = True
+    elif amount_currency == base_currency:
+        amount_currency_is_quote_currency = False
+    else:
+        raise Exception("amount_currency %s not in market %s" % (amount_currency,
+                                                                 market_name))
+    # print(json.dumps(product, indent=2))
+
+    # print("base_min_size: %s" % numerics.format_size(numerics.base_min_size))
+    # print("quote_increment: %s" % numerics.quote_increment)
+
+
+    # Get the current btfd order
+    date_last_updated = None
+    with metrics.timer("db_open_order", market_name):
+        order = get_open_order(market_name, order_side)
+
+    if not order:
+        print("No open order. Creating a new one")
+        order = Order()
+
+    else:
+        print(f"Retrieved order {order.id}: {order.order_id}")
+
+        # Update the order's status
+        order_json = prefetched.get("orders", {}).get(order.order_id)
+        if order_json is None:
+            order_json = auth_client.get_order(order.order_id)
+        if not order_json:
+            raise Exception(f"Could not retrieve order {order.order_id}")
+
+        if order_json.get("message") == "NotFound":
+            # Order was probably manually cancelled
+            order.status = Order.STATUS__CANCELLED
+            order.save()
+
+            order = Order()
+
+        else:
+            date_last_updated = order.created
+            update_order_from_json(order, order_json, percent_diff)
+
+            if order.status not in [Order.STATUS__OPEN, Order.STATUS__PENDING]:
+                # Order status is no longer pending!
+                report_finished_order(notifier, order, order_json, amount, amount_currency,
+                                      percent_diff, quote_currency)
+                if order.status == Order.STATUS__DONE:
+                    date_last_updated = order.updated
+
+                # Now we'll need to prep a new order, starting from the previous one's fill date.
+                order = Order()
+
+    if not date_last_updated:
+        # We're creating a new order, but try to pick up where the last one left off.
+        with metrics.timer("db_prev_order", market_name):
+            prev_order = get_last_done_order(market_name, order_side)
+        if prev_order:
+            # Start from its fill (e.g. a reconcile sweep already marked it DONE), not
+            #   from when it was placed, or we'd pick up the peak we just bought from
+            date_last_updated = prev_order.updated or prev_order.created
+            print(f"Using order {prev_order.id}'s fill date: {date_last_updated}")
+
+    if date_last_updated:
+        print(f"date_last_updated: {date_last_updated} ({int(utc_timestamp(date_last_updated))})")
+
+    signals = load_signals(market_name) if volatility_target else None
+    recent_extreme, current_price = find_recent_extreme(
+        public_client, market_name, order_side, percent_diff, date_last_updated,
+        numerics, prefetched=prefetched, candle_dir=candle_dir, signals=signals
+    )
+    if volatility_target:
+        save_signals(market_name, signals)
+        percent_diff = volatility_target.percent_diff(percent_diff, signals,
+                                                      numerics.price(recent_extreme))
+
+    # All price math from here is exact int math in quote_increment ticks
+    target_price = numerics.target_ticks(recent_extreme, percent_diff)
+    current_move = (Decimal(current_price * 100) / recent_extreme).quantize(Decimal('0.1')) - Decimal('100.')
     print(f"--------------------------------------------------------")
-    print(f"\t recent_extreme: {recent_extreme} {quote_currency}")
-    print(f"\t target_price:   {target_price} {quote_currency} ({percent_diff}%)")
-    print(f"\t current_price:  {current_price} {quote_currency} ({(current_price/recent_extreme*Decimal('100')).quantize(Decimal('0.1')) - Decimal('100.')}%)")
+    print(f"\t recent_extreme: {numerics.format_price(recent_extreme)} {quote_currency}")
+    print(f"\t target_price:   {numerics.format_price(target_price)} {quote_currency} ({percent_diff}%)")
+    print(f"\t current_price:  {numerics.format_price(current_price)} {quote_currency} ({current_move}%)")
+    order_price = None
     if order.order_id:
-        print(f"\t current_order:  {order.target_price.quantize(quote_increment)} {quote_currency}")
+        order_price = numerics.price_ticks(order.target_price)
+        print(f"\t current_order:  {numerics.format_price(order_price)} {quote_currency}")
     print(f"--------------------------------------------------------")
 
     # If we're buying the dip, follow the target_price up as needed; if we're selling the
     #   pump, follow the target_price down.
-    if order.order_id and ((percent_diff < 0 and target_price <= order.target_price) or (percent_diff > 0 and target_price >= order.target_price)):
+    if order.order_id and ((percent_diff < 0 and target_price <= order_price) or (percent_diff > 0 and target_price >= order_price)):
         # The current order's btfd order was set from a higher prior peak, thus a higher
         #   target_price than what we found here. Therefore we let the existing order
         #   ride and keep waiting for it.
         # Or vice versa for a sell the pump.
         print("No order changes required")
+    elif order.order_id and not reprice_policy.should_reprice(order, numerics.price(target_price)):
+        # Better, but not by enough (or too soon) to be worth losing our place in the book
+        print("No order changes required")
+    elif not order.order_id and not place_new:
+        # --trigger mode: the TriggerEngine decides when a new order goes out
+        print("Not placing an order until the price comes within the trigger band")
     else:
         if order.order_id:
             # Cancel the current order and post a new one at the new price
-            print(f"Cancelling order {order.order_id}")
-            result = auth_client.cancel_order(order.order_id)
-            print(result)
+            cancelled = cancel_orders(auth_client, [order])
+            balance_cache.invalidate(auth_client)
+            if order.order_id not in cancelled:
+                # Still resting (or just filled); replacing it could leave two orders out
+                print("Could not confirm the cancel; not placing a replacement")
+                return order
+            order = Order()
 
         if amount_currency_is_quote_currency:
             # Convert 'amount' of the quote_currency to equivalent in base_currency
-            base_currency_amount = (amount / target_price).quantize(base_increment)
+            base_currency_amount = numerics.size_for_quote(amount, target_price)
         else:
             # Already in base_currency
-            base_currency_amount = amount.quantize(base_increment)
-
-        print("base_currency_amount: %s %s" % (base_currency_amount, base_currency))
-
-        """
-            {
-                "id": "d0c5340b-6d6c-49d9-b567-48c4bfca13d2",
-                "price": "0.10000000",
-                "size": "0.01000000",
-                "product_id": "BTC-USD",
-                "side": "buy",
-                "stp": "dc",
-                "type": "limit",
-                "time_in_force": "GTC",
-                "post_only": false,
-                "created_at": "2016-12-08T20:02:28.53864Z",
-                "fill_fees": "0.0000000000000000",
-                "filled_size": "0.00000000",
-                "executed_value": "0.0000000000000000",
-                "status": "pending",
-                "settled": false
-            }
-        """
-        print(f"--------------------------------------------------------")
-        print(f"Placing limit order:")
-        print(f"\t market: {market_name}")
-        print(f"\t side:   {order_side}")
-        print(f"\t price:  {target_price} {quote_currency}")
-        print(f"\t amount: {base_currency_amount} {base_currency}")
-        print(f"\t value:  {(base_currency_amount * target_price).quantize(quote_increment)} {quote_currency}")
-        print(f"--------------------------------------------------------")
-        result = auth_client.place_limit_order(
-            product_id=market_name,
-            side=order_side,
-            price=float(target_price),          # price in quote_currency
-            size=float(base_currency_amount)    # quantity of base_currency to buy   
-        )
+            base_currency_amount = numerics.size_ticks(amount)
+
+        print("base_currency_amount: %s %s" % (numerics.format_size(base_currency_amount), base_currency))
+
+        print_balances(auth_client, numerics, base_currency, quote_currency)
+
+        submit_order(auth_client, notifier, order, numerics, market_name, order_side, target_price,
+                     base_currency_amount, percent_diff, current_price, base_currency,
+                     quote_currency)
+
+    return order
+
+
+
+def run_ladder(auth_client, public_client, notifier, market_name, order_side, amount,
+               amount_currency, percent_diffs, weights=None, prefetched=None, candle_dir=None,
+               reprice_policy=None, place_new=True, volatility_target=None):
+    """
+        Ladder mode: one limit order per percent_diff tier, all priced off the same
+            recent extreme, with `amount` split across the tiers by `weights`.
+
+        The tiers are tracked as a group (Order.ladder_id/tier). When the extreme
+            moves, only the tiers whose price should improve are cancelled and
+            re-placed (see ladder.diff_ladder). A filled tier is re-placed relative
+            to the price since the fill.
+
+        Returns the ladder's OPEN/PENDING Orders.
+    """
+    order_side = order_side.lower()
+    reprice_policy = reprice_policy or default_reprice_policy
+    if prefetched is None:
+        prefetched = {}
+
+    product = product_cache.get(public_client, market_name)
+    if not product:
+        raise Exception(f"Market {market_name} not found")
+
+    base_currency = product.get("base_currency")
+    quote_currency = product.get("quote_currency")
+    numerics = market_numerics(product)
+    if amount_currency == quote_currency:
+        amount_currency_is_quote_currency = True
+    elif amount_currency == base_currency:
+        amount_currency_is_quote_currency = False
+    else:
+        raise Exception("amount_currency %s not in market %s" % (amount_currency,
+                                                                 market_name))
+
+    # Update the status of every open tier
+    with metrics.timer("db_open_order", market_name):
+        open_orders = get_open_ladder_orders(market_name, order_side)
+    ladder_id = open_orders[0].ladder_id if open_orders else uuid.uuid4().hex
+    still_open = []
+    for order in open_orders:
+        order_json = prefetched.get("orders", {}).get(order.order_id)
+        if order_json is None:
+            order_json = auth_client.get_order(order.order_id)
+        if not order_json:
+            raise Exception(f"Could not retrieve order {order.order_id}")
+
+        if order_json.get("message") == "NotFound":
+            # Order was probably manually cancelled
+            order.status = Order.STATUS__CANCELLED
+            order.save()
+            continue
+
+        update_order_from_json(order, order_json, order.percent_diff)
+        if order.status in [Order.STATUS__OPEN, Order.STATUS__PENDING]:
+            still_open.append(order)
+        else:
+            report_finished_order(notifier, order, order_json, amount, amount_currency,
+                                  order.percent_diff, quote_currency)
+
+    with metrics.timer("db_prev_order", market_name):
+        date_last_updated = get_ladder_anchor(market_name, order_side)
+    if date_last_updated:
+        print(f"date_last_updated: {date_last_updated} ({int(utc_timestamp(date_last_updated))})")
+
+    signals = load_signals(market_name) if volatility_target else None
+    recent_extreme, current_price = find_recent_extreme(
+        public_client, market_name, order_side, percent_diffs[0], date_last_updated,
+        numerics, prefetched=prefetched, candle_dir=candle_dir, signals=signals
+    )
+    if volatility_target:
+        save_signals(market_name, signals)
+        # Every tier keeps its spacing relative to the first one
+        scaled = volatility_target.percent_diff(percent_diffs[0], signals,
+                                                numerics.price(recent_extreme))
+        percent_diffs = [(p * scaled / percent_diffs[0]).quantize(Decimal('0.01')) for p in percent_diffs]
+
+    desired = build_ladder(recent_extreme, percent_diffs, weights, amount,
+                           amount_currency_is_quote_currency, numerics)
+    keep, cancel, place = diff_ladder(still_open, desired, buy=percent_diffs[0] < 0,
+                                      reprice_policy=reprice_policy)
+    if not place_new:
+        # --trigger mode: only re-price tiers that are already resting
+        requoted = {order.tier for order in cancel}
+        place = [tier for tier in place if tier.tier in requoted]
+
+    open_by_tier = {order.tier: order for order in still_open}
+    print(f"--------------------------------------------------------")
+    print(f"\t recent_extreme: {numerics.format_price(recent_extreme)} {quote_currency}")
+    print(f"\t current_price:  {numerics.format_price(current_price)} {quote_currency}")
+    for tier in desired:
+        current = open_by_tier.get(tier.tier)
+        current_str = f" (current: {numerics.format_price(numerics.price_ticks(current.target_price))})" if current else ""
+        print(f"\t tier {tier.tier}: {tier.size} {base_currency} @ {tier.price} {quote_currency} ({tier.percent_diff}%){current_str}")
+    print(f"--------------------------------------------------------")
+
+    if not cancel and not place:
+        print("No order changes required")
+        return keep
+
+    if cancel:
+        # Anything else we have open on this market (e.g. the other side) rules out cancel_all
+        other_open_orders = Order.filter(
+            market_name=market_name,
+            status__in=[Order.STATUS__OPEN, Order.STATUS__PENDING]
+        ).count() - len(cancel)
+        cancelled = reprice_policy.cancel_orders(auth_client, market_name, cancel, other_open_orders)
+        balance_cache.invalidate(auth_client)
+        not_cancelled = [order for order in cancel if order.order_id not in cancelled]
+        if not_cancelled:
+            # Still resting (or just filled); don't put a second order out for those tiers
+            print(f"Could not confirm the cancel of tiers {[order.tier for order in not_cancelled]}; not replacing them")
+            skip_tiers = {order.tier for order in not_cancelled}
+            place = [tier for tier in place if tier.tier not in skip_tiers]
+            keep = keep + not_cancelled
+
+    if place:
+        print_balances(auth_client, numerics, base_currency, quote_currency)
+
+    placed = []
+    for tier in place:
+        if tier.size_ticks < numerics.base_min_size:
+            print(f"Skipping tier {tier.tier}: {tier.size} {base_currency} is below base_min_size {numerics.format_size(numerics.base_min_size)}")
+            continue
+        order = Order(ladder_id=ladder_id, tier=tier.tier)
+        if submit_order(auth_client, notifier, order, numerics, market_name, order_side,
+                        tier.price_ticks, tier.size_ticks, tier.percent_diff, current_price,
+                        base_currency, quote_currency):
+            placed.append(order)
+
+    return keep + [order for order in placed
+                   if order.status in [Order.STATUS__OPEN, Order.STATUS__PENDING]]
+
+
+
+def run_batch(auth_client, public_client, notifier, strategies, due, engine=None, feed=None,
+              candle_dir=None, placing=None):
+    """
+        One pass over the `due` strategies (a subset of `strategies`): reconcile
+            every tracked order, optionally prefetch the read-only API results, then
+            run each strategy. Shared by run_daemon and runner.py's workers.
+
+        `placing` (--trigger mode) is the names of the strategies allowed to place a
+            new order; the rest only update the orders they already have.
+    """
+    # One open-orders sweep updates every tracked order instead of a
+    #   get_order call per strategy
+    order_jsons = {}
+    finished_orders = []
+    try:
+        with metrics.timer("reconcile"):
+            finished_orders = reconcile_orders(auth_client, order_jsons=order_jsons)
+    except Exception:
+        # e.g. a 429/5xx; each strategy falls back to looking up its own orders
+        metrics.inc("btfd_reconcile_errors_total")
+        traceback.print_exc()
+        order_jsons = {}
+    for order, order_json in finished_orders:
+        strategy = next((s for s in strategies if s.market_name == order.market_name
+                         and s.order_side == order.side), None)
+        if strategy:
+            product = product_cache.get(public_client, order.market_name)
+            report_finished_order(notifier, order, order_json, strategy.amount,
+                                  strategy.amount_currency, strategy.percent_diff,
+                                  product.get("quote_currency"))
 
-        print(json.dumps(result, sort_keys=True, indent=4))
-
-        if "message" in result and "Post only mode" in result.get("message"):
-            # Price moved away from valid order
-            print("Post only mode at %f %s" % (offer_price, quote_currency))
-
-        elif "message" in result:
-            # Something went wrong if there's a 'message' field in response
-            sns.publish(
-                TopicArn=sns_topic,
-                Subject="Could not place %s %s order for %s %s" % (market_name,
-                                                                   order_side,
-                                                                   amount,
-                                                                   amount_currency),
-                Message=json.dumps(result, sort_keys=True, indent=4)
-            )
+    snapshots = {}
+    if engine:
+        accounts = None
+        try:
+            with metrics.timer("prefetch"):
+                # Only the tracked orders the sweep didn't already cover (i.e. if it failed)
+                due_markets = [s.market_name for s in due]
+                snapshots, accounts = engine.prefetch(
+                    market_names=due_markets,
+                    order_ids=[order.order_id for order in Order.filter(
+                        market_name__in=due_markets,
+                        status__in=[Order.STATUS__OPEN, Order.STATUS__PENDING]
+                    ) if order.order_id not in order_jsons]
+                )
+        except Exception:
+            # e.g. a requests ConnectionError/Timeout; the strategies do their own reads
+            metrics.inc("btfd_prefetch_errors_total")
+            traceback.print_exc()
+            snapshots = {}
+        if isinstance(accounts, list):
+            balance_cache.update(auth_client, accounts)
+        elif accounts is not None:
+            # e.g. a rate limit error; the strategies fetch their own balances instead
+            print("%s: Could not prefetch accounts: %s" % (get_timestamp(), accounts))
+
+    for strategy in due:
+        print("%s: RUNNING: %s" % (get_timestamp(), strategy))
+        prefetched = dict(snapshots.get(strategy.market_name, {}))
+        prefetched["orders"] = {**order_jsons, **prefetched.get("orders", {})}
+        if feed:
+            prefetched.update(feed.snapshot(strategy.market_name))
+        try:
+            with metrics.timer("strategy", strategy.market_name):
+                run_strategy(
+                    auth_client,
+                    public_client,
+                    notifier,
+                    market_name=strategy.market_name,
+                    order_side=strategy.order_side,
+                    amount=strategy.amount,
+                    amount_currency=strategy.amount_currency,
+                    percent_diff=strategy.percent_diff,
+                    prefetched=prefetched,
+                    candle_dir=candle_dir,
+                    ladder=strategy.ladder,
+                    ladder_weights=strategy.ladder_weights,
+                    reprice_policy=strategy.reprice_policy,
+                    place_new=placing is None or strategy.name in placing,
+                    volatility_target=strategy.volatility_target
+                )
+        except Exception:
+            # One bad market shouldn't take down the rest of the strategies
+            metrics.inc("btfd_strategy_errors_total", market=strategy.market_name)
+            traceback.print_exc()
+
+        if feed:
+            date_last_updated = get_date_last_updated(strategy.market_name, strategy.order_side)
+            since = 0
+            if date_last_updated:
+                since = int(utc_timestamp(date_last_updated))
+            feed.set_anchor(strategy.market_name, strategy.order_side, since)
+
+
+
+def has_open_orders(strategy):
+    if strategy.ladder:
+        return bool(get_open_ladder_orders(strategy.market_name, strategy.order_side))
+    return get_open_order(strategy.market_name, strategy.order_side) is not None
+
+
+def arm_trigger(trigger, public_client, feed, strategy):
+    """ Watch `strategy` from the feed's high/low since its anchor (see run_batch) """
+    numerics = market_numerics(product_cache.get(public_client, strategy.market_name))
+    extreme = feed.get_extreme(strategy.market_name, strategy.order_side)
+    price = None
+    if extreme:
+        price = extreme.high if strategy.percent_diff < 0 else extreme.low
+    level = trigger.arm(strategy, numerics, price)
+    print("%s: ARMED: %s" % (get_timestamp(), level))
+
+
+
+def run_daemon(auth_client, public_client, notifier, strategies, engine=None,
+               feed=None, feed_min_interval=5, candle_dir=None, metrics_file=None,
+               trigger=None):
+    """
+        Runs every strategy on its own interval inside one long-lived process. The
+            API clients, notifier, and DB connection are only set up once.
+
+        Order statuses are reconciled for every strategy at once (see
+            reconcile.reconcile_orders) before each batch of due strategies is run.
+
+        With an AsyncEngine, the read-only API calls for every strategy that is due
+            are fetched concurrently before the strategies are run.
+
+        With a MarketFeed, candles and the last price come from the websocket stream
+            and a strategy is run immediately (at most every `feed_min_interval`
+            secs) when a trade sets a new high (BUY) or low (SELL) since its
+            date_last_updated.
+
+        With a TriggerEngine (needs the MarketFeed) a strategy with nothing resting
+            isn't run at all; it's armed as a price level instead. When a trade comes
+            within the band of its target_price it's run right away and places its
+            order, which is then handled as usual until it's done and the level is
+            re-armed. If it fires but no order is left resting (insufficient funds,
+            rejected, post only...) it isn't re-armed until its next scheduled run,
+            so it can't keep firing (and notifying) on every tick.
+    """
+    db.connect(reuse_if_open=True)
+
+    # Sort out anything a previous process left half-done before starting
+    recover_intents(auth_client)
+
+    # (next_run, index, strategy) min-heap; index breaks ties between equal next_runs
+    schedule = [(time.time(), i, strategy) for i, strategy in enumerate(strategies)]
+    heapq.heapify(schedule)
+
+    wake = threading.Event()
+    trigger_lock = threading.Lock()
+    triggered = set()
+    fired = set()
+    last_run = {}
+    rearm_after = {}    # strategy name -> next_run it can be re-armed at after a failed fire
+    if feed:
+        def on_new_extreme(market_name, side, price):
+            if trigger is not None and all(trigger.is_armed(s.name) for s in strategies
+                               if s.market_name == market_name and s.order_side == side):
+                # Nothing resting to re-price; the TriggerEngine tracks the new extreme
+                return
+            with trigger_lock:
+                triggered.add((market_name, side))
+            wake.set()
+        feed.add_listener(on_new_extreme)
+
+        if trigger is not None:
+            def on_tick(market_name, price):
+                strategies_fired = trigger.on_tick(market_name, price)
+                if strategies_fired:
+                    with trigger_lock:
+                        fired.update(s.name for s in strategies_fired)
+                    wake.set()
+            feed.add_tick_listener(on_tick)
+        for market_name in set(s.market_name for s in strategies):
+            feed.seed(market_name, public_client.get_product_historic_rates(market_name, granularity=60))
+        feed.start()
+
+    try:
+        while True:
+            wait = schedule[0][0] - time.time()
+            if wait > 0:
+                wake.wait(wait)
+
+            fired_now = set()
+            if triggered or fired:
+                # Pull forward any strategy whose market just made a new extreme, or
+                #   whose trigger just fired
+                wake.clear()
+                now = time.time()
+                with trigger_lock:
+                    keys = set(triggered)
+                    triggered.clear()
+                    fired_now = set(fired)
+                    fired.clear()
+                schedule = [
+                    (now, i, s) if s.name in fired_now or ((s.market_name, s.order_side) in keys
+                    and now - last_run.get(i, 0) >= feed_min_interval) else (n, i, s)
+                    for n, i, s in schedule
+                ]
+                heapq.heapify(schedule)
+
+            # Run everything that's due as one batch
+            now = time.time()
+            batch = []
+            while schedule and schedule[0][0] <= now:
+                batch.append(heapq.heappop(schedule))
+
+            due = [strategy for next_run, i, strategy in batch]
+            if trigger is not None:
+                # Armed strategies have nothing resting to update; they wait for their trigger
+                due = [s for s in due if s.name in fired_now or not trigger.is_armed(s.name)]
+            if due:
+                run_batch(auth_client, public_client, notifier, strategies, due,
+                          engine=engine, feed=feed, candle_dir=candle_dir,
+                          placing=fired_now if trigger is not None else None)
+            backing_off = set()
+            if trigger is not None:
+                for strategy in due:
+                    if has_open_orders(strategy):
+                        continue
+                    if strategy.name in fired_now:
+                        backing_off.add(strategy.name)
+                        print("%s: NOT RE-ARMED until next run: %s" % (get_timestamp(), strategy))
+                    elif now >= rearm_after.get(strategy.name, 0):
+                        arm_trigger(trigger, public_client, feed, strategy)
+
+            for next_run, i, strategy in batch:
+                last_run[i] = time.time()
+
+                # Schedule off the intended start so runs don't drift
+                next_run += strategy.interval
+                if next_run < time.time():
+                    next_run = time.time() + strategy.interval
+                heapq.heappush(schedule, (next_run, i, strategy))
+                if strategy.name in backing_off:
+                    rearm_after[strategy.name] = next_run
+
+            if metrics_file:
+                metrics.export(metrics_file)
+
+    except KeyboardInterrupt:
+        print("%s: STOPPED" % get_timestamp())
+
+    finally:
+        if engine:
+            engine.close()
+        if feed:
+            feed.stop()
+        db.close()
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print("%s: STARTED: %s" % (get_timestamp(), args))
+
+    sandbox_mode = args.sandbox_mode
+    job_mode = args.job_mode
+    warn_after = args.warn_after
+
+    if not args.daemon_mode and args.percent_diff is None:
+        parser.error("market_name, order_side, amount, amount_currency, and percent_diff "
+                     "are required unless running in --daemon mode")
+
+    if args.trigger_mode and not (args.daemon_mode and args.stream_mode):
+        parser.error("--trigger needs --daemon and --stream")
+
+    if args.ladder:
+        if args.percent_diff is not None and any((p < 0) != (args.percent_diff < 0) for p in args.ladder):
+            parser.error("-ladder tiers must all be on the same side of zero as percent_diff")
+        if args.ladder_weights and len(args.ladder_weights) != len(args.ladder) + 1:
+            parser.error("-ladder_weights needs one weight per tier (percent_diff plus each -ladder tier)")
+
+    # Read settings
+    config = configparser.ConfigParser()
+    config.read(args.config_file)
+
+    profile = None
+    if args.account:
+        profile = load_profile(config, args.account)
+        sandbox_mode = sandbox_mode or profile.sandbox
+
+    database = args.database or (SIMULATOR_DATABASE if args.simulate_mode else
+                                 profile.database if profile else models.DATABASE)
+    if database != models.DATABASE:
+        db.init(database, pragmas=models.PRAGMAS, timeout=10)
+
+    # Adds any tables that are new since the db was created
+    create_tables()
+
+    if not sandbox_mode and not job_mode and not args.simulate_mode:
+        if sys.version_info[0] < 3:
+            # python2.x compatibility
+            response = raw_input("Production purchase! Confirm [Y]: ")  # noqa: F821
+        else:
+            response = input("Production purchase! Confirm [Y]: ")
+        if response != 'Y':
+            print("Exiting without submitting purchase.")
             exit()
 
-        if result and "status" in result and result["status"] == Order.STATUS__REJECTED:
-            # Rejected - usually because price was above lowest sell offer. Try
-            #   again in the next loop.
-            print("%s: %s Order rejected @ %f %s" % (get_timestamp(),
-                                                     market_name,
-                                                     current_price,
-                                                     quote_currency))
+    product_cache.ttl = config.getint('cache', 'PRODUCT_TTL', fallback=product_cache.ttl)
+    balance_cache.ttl = config.getint('cache', 'BALANCE_TTL', fallback=balance_cache.ttl)
+    models.RAW_DATA_SIDE_TABLE = config.getboolean('database', 'RAW_DATA_SIDE_TABLE', fallback=False)
+
+    config_section = 'production'
+    if profile:
+        config_section = profile.section
+    elif sandbox_mode or args.simulate_mode:
+        config_section = 'sandbox'
+
+    # Instantiate public and auth API clients
+    if args.simulate_mode:
+        from simulator import SimulatedExchange, load_candles
+        if args.daemon_mode:
+            market_names = [s.market_name for s in load_strategies(config, profile=args.account)]
+        else:
+            market_names = [args.market_name]
+        auth_client = public_client = SimulatedExchange(load_candles(market_names), speed=60)
+
+        # Don't mix simulated candles into the real candle cache
+        args.candle_dir = None
+
+    else:
+        auth_client, public_client = create_clients(config, config_section, sandbox_mode)
+
+    # Time every API call and count error responses
+    if public_client is auth_client:
+        auth_client = public_client = InstrumentedClient(auth_client)
+    else:
+        auth_client = InstrumentedClient(auth_client)
+        public_client = InstrumentedClient(public_client)
+
+    # Notifications go out from a background thread (SNS email by default)
+    notifier = create_notifier(config, config_section)
+
+    profiler = None
+    if args.profile_file:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        if args.daemon_mode:
+            strategies = load_strategies(config, profile=args.account)
+            if not strategies:
+                raise Exception(f"No [strategy:<name>] sections found in {args.config_file}")
+            engine = None
+            if args.async_mode:
+                from async_engine import AsyncEngine
+                engine = AsyncEngine(auth_client, public_client, max_workers=args.max_workers)
+            feed = None
+            if args.stream_mode:
+                from market_feed import MarketFeed
+                feed = MarketFeed([s.market_name for s in strategies])
+            trigger = None
+            if args.trigger_mode:
+                if any(s.volatility_target for s in strategies):
+                    # Trigger levels are armed from the unscaled percent_diff
+                    raise Exception("--trigger can't be used with atr_multiple strategies")
+                from trigger_engine import TriggerEngine
+                trigger = TriggerEngine(band=args.trigger_band)
+            run_daemon(auth_client, public_client, notifier, strategies, engine=engine,
+                       feed=feed, candle_dir=args.candle_dir, metrics_file=args.metrics_file,
+                       trigger=trigger)
+
+        else:
+            with metrics.timer("strategy", args.market_name):
+                run_strategy(
+                    auth_client,
+                    public_client,
+                    notifier,
+                    market_name=args.market_name,
+                    order_side=args.order_side,
+                    amount=args.amount,
+                    amount_currency=args.amount_currency,
+                    percent_diff=args.percent_diff,
+                    candle_dir=args.candle_dir,
+                    ladder=args.ladder,
+                    ladder_weights=args.ladder_weights,
+                    reprice_policy=load_reprice_policy(config),
+                    volatility_target=VolatilityTarget(args.atr_multiple, args.atr_granularity,
+                                                       args.max_percent_diff) if args.atr_multiple else None
+                )
+
+    finally:
+        # Flush any pending digest before exiting
+        with metrics.timer("notifier_close"):
+            notifier.close()
 
-        update_order_from_json(order, result, percent_diff=percent_diff)
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile_file)
+            print(f"cProfile stats written to {args.profile_file} (view with: python -m pstats {args.profile_file})")
 
+        if args.metrics_file:
+            metrics.export(args.metrics_file)
@@ -0,0 +1,94 @@
+import datetime
+import time
+
+from models import ProductCache
+from peewee import chunked
+
+
+
+class ProductMetadataCache(object):
+    """
+        get_products() results indexed by product id. Persisted in the ProductCache
+            table so a fresh cron run doesn't need to hit the API; the whole product
+            list is re-fetched at most once per `ttl` secs.
+    """
+    def __init__(self, ttl=86400):
+        self.ttl = ttl
+        self.products = {}
+        self.fetched = None     # unix ts of the oldest entry in self.products
+        self.loaded_from_db = False
+
+    def _is_fresh(self):
+        return self.fetched is not None and time.time() - self.fetched < self.ttl
+
+    def _load_from_db(self):
+        self.loaded_from_db = True
+        rows = list(ProductCache.select())
+        if rows:
+            self.products = {row.product_id: row.data for row in rows}
+            self.fetched = min(row.fetched for row in rows).replace(
+                tzinfo=datetime.timezone.utc).timestamp()
+
+    def update(self, products):
+        """ Replace the index with a fresh get_products() result """
+        now = datetime.datetime.utcnow()
+        self.products = {product.get("id"): product for product in products}
+        self.fetched = now.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+        rows = [
+            {"product_id": product_id, "data": product, "fetched": now}
+            for product_id, product in self.products.items()
+        ]
+        with ProductCache._meta.database.atomic():
+            ProductCache.delete().execute()
+            # SQLite < 3.32 allows at most 999 bound variables per query (3 per row)
+            for batch in chunked(rows, 100):
+                ProductCache.insert_many(batch).execute()
+
+    def get(self, public_client, product_id):
+        if not self.loaded_from_db:
+            self._load_from_db()
+        if not self._is_fresh() or product_id not in self.products:
+            # Stale or a brand new market; one get_products call refreshes everything
+            products = public_client.get_products()
+            if not isinstance(products, list):
+                raise Exception(f"Could not retrieve products: {products}")
+            self.update(products)
+        return self.products.get(product_id)
+
+
+
+class BalanceCache(object):
+    """
+        get_accounts() results indexed by currency, kept for a few secs so multiple
+            strategies in the same cycle share one call. Must be invalidated whenever
+            we place or cancel an order since that changes the holds.
+    """
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.accounts = {}      # id(auth_client) -> (fetched, {currency: account})
+
+    def update(self, auth_client, accounts):
+        self.accounts[id(auth_client)] = (
+            time.time(),
+            {account.get("currency"): account for account in accounts}
+        )
+
+    def get(self, auth_client):
+        entry = self.accounts.get(id(auth_client))
+        if not entry or time.time() - entry[0] >= self.ttl:
+            accounts = auth_client.get_accounts()
+            if not isinstance(accounts, list):
+                raise Exception(f"Could not retrieve accounts: {accounts}")
+            self.update(auth_client, accounts)
+            entry = self.accounts[id(auth_client)]
+        return entry[1]
+
+    def invalidate(self, auth_client):
+        self.accounts.pop(id(auth_client), None)
+
+
+
+# Shared by every strategy in the process
+product_cache = ProductMetadataCache()
+balance_cache = BalanceCache()
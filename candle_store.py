@@ -0,0 +1,227 @@
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+
+
+class CandleStore(object):
+    """
+        Local cache of one market's candles at one granularity, stored as one
+            memory-mapped .npy file per column:
+
+            <root>/<market_name>_<granularity>/{time,low,high,open,close,volume}.npy
+
+        Rows are kept sorted by time (oldest first). The files are preallocated and
+            grown by doubling; meta.json records how many rows are in use.
+    """
+    COLUMNS = ["time", "low", "high", "open", "close", "volume"]
+    MAX_CANDLES_PER_REQUEST = 300
+    INITIAL_CAPACITY = 4096
+    PAGE_DELAY = 0.35       # secs between paged requests; stay under the public rate limit
+
+    def __init__(self, root, market_name, granularity=60):
+        self.market_name = market_name
+        self.granularity = granularity
+        self.path = os.path.join(root, f"{market_name}_{granularity}")
+        os.makedirs(self.path, exist_ok=True)
+
+        self.count = 0
+        self.arrays = {}
+        meta_file = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                self.count = json.load(f)["count"]
+            for column in self.COLUMNS:
+                self.arrays[column] = np.load(self._column_file(column), mmap_mode="r+")
+        else:
+            self._allocate(self.INITIAL_CAPACITY)
+
+    def _column_file(self, column):
+        return os.path.join(self.path, f"{column}.npy")
+
+    def _allocate(self, capacity, keep=0):
+        """ (Re)create every column file with room for `capacity` rows, keeping the first `keep` """
+        for column in self.COLUMNS:
+            dtype = np.int64 if column == "time" else np.float64
+            tmp_file = self._column_file(column) + ".tmp"
+            new_array = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=dtype, shape=(capacity,))
+            if keep:
+                new_array[:keep] = self.arrays[column][:keep]
+            new_array.flush()
+            del new_array
+            os.replace(tmp_file, self._column_file(column))
+            self.arrays[column] = np.load(self._column_file(column), mmap_mode="r+")
+
+    def _save_meta(self):
+        for column in self.COLUMNS:
+            self.arrays[column].flush()
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"count": self.count, "granularity": self.granularity}, f)
+
+    @property
+    def capacity(self):
+        return len(self.arrays["time"])
+
+    def first_time(self):
+        return int(self.arrays["time"][0]) if self.count else None
+
+    def last_time(self):
+        return int(self.arrays["time"][self.count - 1]) if self.count else None
+
+    def columns(self, since=None):
+        """
+            Zero-copy views of every column for the candles newer than `since`
+                (or all of them).
+        """
+        start = 0
+        if since is not None:
+            start = int(np.searchsorted(self.arrays["time"][:self.count], since, side="right"))
+        return {column: self.arrays[column][start:self.count] for column in self.COLUMNS}
+
+    def market_data(self, since=None, limit=MAX_CANDLES_PER_REQUEST):
+        """
+            Candles in the get_product_historic_rates format (newest first):
+
+                [ time, low, high, open, close, volume ]
+
+            Everything newer than `since` or else the most recent `limit` candles.
+        """
+        if since is not None:
+            cols = self.columns(since)
+        else:
+            start = max(0, self.count - limit)
+            cols = {column: self.arrays[column][start:self.count] for column in self.COLUMNS}
+        rows = zip(*[cols[column][::-1].tolist() for column in self.COLUMNS])
+        return [list(row) for row in rows]
+
+    def merge(self, market_data):
+        """
+            Add candles (any order; API format) to the store. A candle that's already
+                stored is overwritten since it may have still been open when we got it.
+        """
+        if not market_data:
+            return
+        new = np.array(market_data, dtype=np.float64).reshape(-1, 6)
+        new = new[np.argsort(new[:, 0], kind="stable")]
+
+        last_time = self.last_time()
+        if last_time is None or new[0, 0] >= last_time:
+            # Fast path: appending newer candles
+            start = self.count
+            if last_time is not None and new[0, 0] == last_time:
+                start -= 1
+            new = _dedupe(new)
+            end = start + len(new)
+            if end > self.capacity:
+                self._allocate(max(end, 2 * self.capacity), keep=start)
+            for i, column in enumerate(self.COLUMNS):
+                self.arrays[column][start:end] = new[:, i]
+            self.count = end
+
+        else:
+            # Backfilling older candles; merge and rewrite
+            existing = np.column_stack([self.arrays[c][:self.count].astype(np.float64)
+                                        for c in self.COLUMNS])
+            combined = np.concatenate([existing, new])
+            combined = _dedupe(combined[np.argsort(combined[:, 0], kind="stable")])
+            if len(combined) > self.capacity:
+                self._allocate(max(len(combined), 2 * self.capacity))
+            for i, column in enumerate(self.COLUMNS):
+                self.arrays[column][:len(combined)] = combined[:, i]
+            self.count = len(combined)
+
+        self._save_meta()
+
+    def _fetch(self, public_client, start, end):
+        market_data = public_client.get_product_historic_rates(
+            self.market_name,
+            start=_iso(start),
+            end=_iso(end),
+            granularity=self.granularity
+        )
+        if not isinstance(market_data, list):
+            raise Exception(f"Could not retrieve {self.market_name} candles: {market_data}")
+        return market_data
+
+    def sync(self, public_client, now=None):
+        """
+            Fetch only the candles newer than what's stored, paging backwards from
+                `now` until we reach the last stored candle. An empty store just gets
+                the most recent page.
+        """
+        if now is None:
+            now = time.time()
+        page_span = self.MAX_CANDLES_PER_REQUEST * self.granularity
+        last_time = self.last_time()
+
+        pages = []
+        end = now
+        while True:
+            start = end - page_span
+            if last_time is not None:
+                # Re-fetch the last stored candle; it may have still been open
+                start = max(start, last_time)
+            pages.extend(self._fetch(public_client, start, end))
+            if last_time is None or start <= last_time:
+                break
+            end = start
+            time.sleep(self.PAGE_DELAY)
+
+        self.merge(pages)
+        return len(pages)
+
+    def backfill(self, public_client, since):
+        """ Page backwards from the oldest stored candle until unix ts `since` """
+        if not self.count:
+            self.sync(public_client)
+            if not self.count:
+                return 0
+        page_span = self.MAX_CANDLES_PER_REQUEST * self.granularity
+        end = self.first_time()
+        fetched = 0
+        while end > since:
+            start = max(since, end - page_span)
+            market_data = self._fetch(public_client, start, end)
+            self.merge(market_data)
+            fetched += len(market_data)
+            end = start
+            time.sleep(self.PAGE_DELAY)
+        return fetched
+
+
+
+def _dedupe(rows):
+    """ rows sorted by time; for repeated times keep the last one """
+    if len(rows) < 2:
+        return rows
+    keep = np.append(rows[1:, 0] != rows[:-1, 0], True)
+    return rows[keep]
+
+
+def _iso(ts):
+    return datetime.datetime.utcfromtimestamp(ts).isoformat()
+
+
+
+if __name__ == "__main__":
+    import argparse
+    import cbpro
+
+    parser = argparse.ArgumentParser(description="Sync and backfill the local candle cache")
+    parser.add_argument('market_names', nargs="+", help="(e.g. BTC-USD, ETH-BTC, etc)")
+    parser.add_argument('-dir', default="candles", dest="candle_dir")
+    parser.add_argument('-granularity', default=60, type=int, dest="granularity")
+    parser.add_argument('-days', default=0, type=float, dest="days",
+                        help="Backfill this many days of history")
+    args = parser.parse_args()
+
+    public_client = cbpro.PublicClient()
+    for market_name in args.market_names:
+        store = CandleStore(args.candle_dir, market_name, args.granularity)
+        fetched = store.sync(public_client)
+        if args.days:
+            fetched += store.backfill(public_client, time.time() - args.days * 86400)
+        print(f"{market_name}: fetched {fetched}; {store.count} candles stored")
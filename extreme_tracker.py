@@ -0,0 +1,113 @@
+from collections import deque
+
+from models import ExtremeState
+
+
+
+class ExtremeTracker(object):
+    """
+        Answers "max high (or min low) of every candle since ts T" without rescanning
+            the candles.
+
+        Keeps a monotonic deque of (time, value) candidates: for 'max' the values
+            strictly decrease from front to back, so the extreme of everything after
+            T is the first entry with time > T. New candles pop the dominated
+            candidates off the back (amortized O(1) per candle) and moving the
+            anchor forward drops entries off the front, so the current extreme is
+            always deque[0].
+
+        The candidates are the only state needed to keep answering queries, so it's
+            persisted between runs and a long gap between runs no longer loses the
+            true peak.
+    """
+    MAX = 'max'
+    MIN = 'min'
+
+    def __init__(self, mode, anchor=0, last_ts=0, entries=None):
+        if mode not in [self.MAX, self.MIN]:
+            raise Exception(f"Invalid ExtremeTracker mode {mode}")
+        self.mode = mode
+        self.anchor = anchor
+        self.last_ts = last_ts
+        self.entries = deque(tuple(e) for e in (entries or []))
+
+    def _dominates(self, new_value, old_value):
+        if self.mode == self.MAX:
+            return new_value >= old_value
+        return new_value <= old_value
+
+    def reset(self, anchor):
+        self.anchor = anchor
+        self.last_ts = 0
+        self.entries.clear()
+
+    def set_anchor(self, anchor):
+        """
+            Only consider candles newer than `anchor` from now on. Returns False if the
+                anchor moved backwards; the caller must reset() and re-absorb candles
+                since whatever we already dropped is gone.
+        """
+        if anchor < self.anchor:
+            return False
+        self.anchor = anchor
+        while self.entries and self.entries[0][0] <= anchor:
+            self.entries.popleft()
+        return True
+
+    def add(self, ts, value):
+        # ts == last_ts is the still-open newest candle being updated
+        if ts < self.last_ts:
+            return
+        self.last_ts = ts
+        if ts <= self.anchor:
+            return
+        while self.entries and self._dominates(value, self.entries[-1][1]):
+            self.entries.pop()
+        self.entries.append((ts, value))
+
+    def absorb(self, market_data):
+        """
+            Add any candles newer than what we've already seen (plus the newest one
+                again, since it may still have been open). market_data is
+                newest first, as returned by get_product_historic_rates:
+
+                [ time, low, high, open, close, volume ]
+        """
+        index = 2 if self.mode == self.MAX else 1
+        new_candles = []
+        for candle in market_data:
+            if candle[0] < self.last_ts:
+                break
+            new_candles.append(candle)
+        for candle in reversed(new_candles):
+            self.add(candle[0], candle[index])
+        return len(new_candles)
+
+    def extreme(self):
+        """ Extreme since the anchor (or None if there are no candles since then) """
+        if not self.entries:
+            return None
+        return self.entries[0][1]
+
+
+
+def load_tracker(market_name, side, mode):
+    state = ExtremeState.get_or_none(market_name=market_name, side=side)
+    if not state or state.mode != mode:
+        return ExtremeTracker(mode)
+    return ExtremeTracker(mode, anchor=state.anchor, last_ts=state.last_ts, entries=state.entries)
+
+
+def save_tracker(market_name, side, tracker):
+    ExtremeState.insert(
+        market_name=market_name,
+        side=side,
+        mode=tracker.mode,
+        anchor=tracker.anchor,
+        last_ts=tracker.last_ts,
+        entries=[list(e) for e in tracker.entries]
+    ).on_conflict(
+        conflict_target=[ExtremeState.market_name, ExtremeState.side],
+        preserve=[ExtremeState.mode, ExtremeState.anchor, ExtremeState.last_ts,
+                  ExtremeState.entries]
+    ).execute()
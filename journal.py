@@ -0,0 +1,196 @@
+import contextlib
+import datetime
+import os
+import socket
+import threading
+import uuid
+
+from decimal import Decimal
+from models import acquire_lease, db, Intent, Order, release_lease, update_order_from_json
+
+
+
+def new_client_oid():
+    return str(uuid.uuid4())
+
+
+def record_intent(action, market_name, side, client_oid=None, order_id=None, price=None,
+                  size=None, percent_diff=None, ladder_id=None, tier=None):
+    """ Journal an action before making the API call; commits immediately """
+    return Intent.create(
+        action=action,
+        client_oid=client_oid or new_client_oid(),
+        order_id=order_id,
+        market_name=market_name,
+        side=side.lower(),
+        price=price,
+        size=size,
+        percent_diff=percent_diff,
+        ladder_id=ladder_id,
+        tier=tier,
+    )
+
+
+def resolve_intent(intent, status, order_id=None):
+    intent.status = status
+    if order_id:
+        intent.order_id = order_id
+    intent.resolved = datetime.datetime.utcnow()
+    intent.save()
+
+
+def place_order(auth_client, order, market_name, side, price, size, percent_diff):
+    """
+        place_limit_order with a journalled client_oid. `order` (a new Order, with
+            ladder_id/tier set if it's a ladder tier) is saved in the same
+            transaction that resolves the intent.
+
+        `price` and `size` are exact strings (numeric.MarketNumerics.format_price/
+            format_size) and are sent as-is.
+
+        Returns the API result. If the call raises (e.g. a timeout), the intent stays
+            pending and recover_intents() finds out later whether the order exists.
+    """
+    intent = record_intent(Intent.ACTION__PLACE, market_name, side, price=Decimal(price), size=Decimal(size),
+                           percent_diff=percent_diff, ladder_id=order.ladder_id, tier=order.tier)
+    result = auth_client.place_limit_order(
+        product_id=market_name,
+        side=side,
+        price=price,                 # price in quote_currency
+        size=size,                   # quantity of base_currency to buy
+        client_oid=intent.client_oid
+    )
+    if "message" in result:
+        resolve_intent(intent, Intent.STATUS__FAILED)
+    else:
+        with db.atomic():
+            update_order_from_json(order, result, percent_diff=percent_diff)
+            resolve_intent(intent, Intent.STATUS__DONE, order_id=order.order_id)
+    return result
+
+
+def cancel_orders(auth_client, orders, market_name=None):
+    """
+        Journalled cancel_order for each of `orders`, or one cancel_all(market_name)
+            for all of them if `market_name` is given. Returns the order_ids the
+            exchange confirmed cancelled; only those may be replaced.
+
+        A confirmed order is marked CANCELLED, with its fill columns brought up to
+            date (it may have partially filled before the cancel). Anything else
+            (a rate limit error, it filled first) leaves its intent pending, so the
+            next run's recover_intents() refreshes it from the exchange.
+    """
+    intents = [record_intent(Intent.ACTION__CANCEL, order.market_name, order.side,
+                             order_id=order.order_id) for order in orders]
+    if market_name:
+        result = auth_client.cancel_all(product_id=market_name)
+        print(result)
+        cancelled = set(result) if isinstance(result, list) else set()
+    else:
+        cancelled = set()
+        for order in orders:
+            print(f"Cancelling order {order.order_id}")
+            result = auth_client.cancel_order(order.order_id)
+            print(result)
+            if isinstance(result, list):
+                cancelled.update(result)
+            elif isinstance(result, str):
+                cancelled.add(result)
+
+    confirmed = set()
+    for order, intent in zip(orders, intents):
+        if order.order_id not in cancelled:
+            print(f"Cancel of order {order.order_id} not confirmed; leaving it to the next run")
+            continue
+        order_json = auth_client.get_order(order.order_id)
+        if not order_json or ("message" in order_json and order_json["message"] != "NotFound"):
+            # Cancelled, but we can't see its final fills yet; recover_intents() will
+            print(f"Could not retrieve cancelled order {order.order_id}: {order_json}")
+            order.status = Order.STATUS__CANCELLED
+            order.save()
+            confirmed.add(order.order_id)
+            continue
+        with db.atomic():
+            if order_json.get("message") != "NotFound":
+                # Done/canceled with a partial fill; keep its final fill columns
+                update_order_from_json(order, order_json, order.percent_diff)
+            order.status = Order.STATUS__CANCELLED
+            order.save()
+            resolve_intent(intent, Intent.STATUS__DONE)
+        confirmed.add(order.order_id)
+    return confirmed
+
+
+def recover_intents(auth_client, market_name=None, side=None):
+    """
+        Resolves every still-pending intent (a previous run died or timed out
+            mid-call), optionally just for one market/side:
+
+            place:  look the order up by client_oid; save it if it exists, or
+                    mark the intent failed if it never made it to the exchange
+            cancel: refresh the order's status from the exchange
+
+        Returns the number of intents resolved.
+    """
+    query = Intent.filter(status=Intent.STATUS__PENDING)
+    if market_name:
+        query = query.filter(market_name=market_name, side=side.lower())
+
+    resolved = 0
+    for intent in query:
+        if intent.action == Intent.ACTION__PLACE:
+            order_json = auth_client.get_order(f"client:{intent.client_oid}")
+            if not order_json or ("message" in order_json and order_json["message"] != "NotFound"):
+                # Can't tell yet; try again next time
+                print(f"Could not look up client_oid {intent.client_oid}: {order_json}")
+                continue
+            if order_json.get("message") == "NotFound":
+                print(f"Recovered: {intent.market_name} {intent.side} order {intent.client_oid} was never placed")
+                resolve_intent(intent, Intent.STATUS__FAILED)
+            else:
+                print(f"Recovered: {intent.market_name} {intent.side} order {order_json['id']} was placed")
+                with db.atomic():
+                    order = Order.get_or_none(order_id=order_json["id"]) or \
+                        Order(ladder_id=intent.ladder_id, tier=intent.tier)
+                    update_order_from_json(order, order_json, percent_diff=intent.percent_diff)
+                    resolve_intent(intent, Intent.STATUS__DONE, order_id=order.order_id)
+
+        elif intent.action == Intent.ACTION__CANCEL:
+            order = Order.get_or_none(order_id=intent.order_id)
+            order_json = auth_client.get_order(intent.order_id)
+            if not order_json or ("message" in order_json and order_json["message"] != "NotFound"):
+                print(f"Could not look up order {intent.order_id}: {order_json}")
+                continue
+            with db.atomic():
+                if order and order_json.get("message") == "NotFound":
+                    order.status = Order.STATUS__CANCELLED
+                    order.save()
+                elif order:
+                    update_order_from_json(order, order_json, order.percent_diff)
+                    if order_json.get("done_reason") == "canceled":
+                        # Partially filled, then cancelled
+                        order.status = Order.STATUS__CANCELLED
+                        order.save()
+                resolve_intent(intent, Intent.STATUS__DONE)
+            print(f"Recovered: cancel of order {intent.order_id}")
+        resolved += 1
+
+    return resolved
+
+
+@contextlib.contextmanager
+def strategy_lock(market_name, side, ttl=300):
+    """
+        Only one run at a time per market/side, across threads, processes, and
+            (with a shared db) hosts. Yields False if someone else holds it. A
+            crashed holder's lock expires after `ttl` secs.
+    """
+    name = f"strategy:{market_name}:{side.lower()}"
+    owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    if not acquire_lease(name, owner, ttl):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        release_lease(name, owner)
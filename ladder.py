@@ -0,0 +1,100 @@
+from decimal import Decimal
+
+
+
+class LadderTier(object):
+    """
+        One rung of a ladder: the limit order we'd want resting at `percent_diff`
+            from the recent extreme. `price_ticks`/`size_ticks` are in the market's
+            ticks (see numeric.MarketNumerics); `price`/`size` are the same as
+            Decimals.
+    """
+    def __init__(self, tier, percent_diff, price_ticks, size_ticks, numerics):
+        self.tier = tier
+        self.percent_diff = percent_diff
+        self.price_ticks = price_ticks
+        self.size_ticks = size_ticks
+        self.price = numerics.price(price_ticks)
+        self.size = numerics.size(size_ticks)
+
+    def __repr__(self):
+        return f"LadderTier({self.tier}: {self.size} @ {self.price} ({self.percent_diff}%))"
+
+
+def normalize_weights(percent_diffs, weights=None):
+    """
+        Returns each tier's fraction of the total amount. Weights default to an even
+            split.
+    """
+    if not weights:
+        weights = [Decimal("1")] * len(percent_diffs)
+    if len(weights) != len(percent_diffs):
+        raise Exception(f"Got {len(weights)} ladder_weights for {len(percent_diffs)} ladder tiers")
+    weights = [Decimal(w) for w in weights]
+    if any(w <= 0 for w in weights):
+        raise Exception(f"ladder_weights must be positive: {weights}")
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def build_ladder(recent_extreme, percent_diffs, weights, amount, amount_currency_is_quote_currency,
+                 numerics):
+    """
+        The desired LadderTier for every percent_diff. `amount` is the total across
+            the whole ladder and is split according to `weights`. `recent_extreme`
+            is in `numerics` price ticks.
+    """
+    tiers = []
+    for tier, (percent_diff, fraction) in enumerate(zip(percent_diffs, normalize_weights(percent_diffs, weights))):
+        price = numerics.target_ticks(recent_extreme, percent_diff)
+        tier_amount = amount * fraction
+        if amount_currency_is_quote_currency:
+            size = numerics.size_for_quote(tier_amount, price)
+        else:
+            size = numerics.size_ticks(tier_amount)
+        tiers.append(LadderTier(tier, percent_diff, price, size, numerics))
+    return tiers
+
+
+def diff_ladder(open_orders, desired, buy, reprice_policy=None):
+    """
+        Works out the fewest cancels/places to go from the open tier orders to the
+            desired ladder. Matching is by tier. A tier is left alone if its new
+            price is no better for us than the resting one. That means it doesn't
+            rise when buying the dip, and it doesn't fall when selling the pump.
+            This is the same ratchet the single-order mode uses.
+
+        A tier that did improve can still be held back by the `reprice_policy`
+            (see reprice.RepricePolicy).
+
+        `open_orders` is a list of OPEN/PENDING Orders with a `tier`. Any that no
+            longer match a desired tier (the ladder got shorter, or a duplicate
+            tier) are cancelled.
+
+        Returns (keep, cancel, place): keep/cancel are Orders, place are LadderTiers.
+    """
+    by_tier = {}
+    cancel = []
+    for order in sorted(open_orders, key=lambda o: o.created, reverse=True):
+        if order.tier in by_tier:
+            # Keep the newest order for a tier; shouldn't normally happen
+            cancel.append(order)
+        else:
+            by_tier[order.tier] = order
+
+    keep = []
+    place = []
+    for tier in desired:
+        order = by_tier.pop(tier.tier, None)
+        if order is None:
+            place.append(tier)
+        elif (buy and tier.price <= order.target_price) or (not buy and tier.price >= order.target_price):
+            keep.append(order)
+        elif reprice_policy and not reprice_policy.should_reprice(order, tier.price):
+            keep.append(order)
+        else:
+            cancel.append(order)
+            place.append(tier)
+
+    cancel.extend(by_tier.values())
+    return keep, cancel, place
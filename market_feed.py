@@ -0,0 +1,245 @@
+import json
+import threading
+import time
+import traceback
+
+from collections import deque
+from decimal import Decimal
+
+from utils import convert_datetime_str, utc_timestamp
+
+from websocket import create_connection, WebSocketConnectionClosedException
+
+
+
+class CandleBuilder(object):
+    """
+        Builds candles incrementally from trade matches. Candles use the same
+            layout (and newest-first ordering) as get_product_historic_rates:
+
+            [ time, low, high, open, close, volume ]
+    """
+    def __init__(self, granularity=60, max_candles=300):
+        self.granularity = granularity
+        self.candles = deque(maxlen=max_candles)    # oldest first; last one is still open
+
+    def seed(self, market_data):
+        # REST candles are newest first
+        for candle in reversed(market_data):
+            if not self.candles or candle[0] > self.candles[-1][0]:
+                self.candles.append(list(candle))
+
+    def add_trade(self, timestamp, price, size):
+        bucket = int(timestamp) - int(timestamp) % self.granularity
+        if self.candles and self.candles[-1][0] == bucket:
+            candle = self.candles[-1]
+            candle[1] = min(candle[1], price)
+            candle[2] = max(candle[2], price)
+            candle[4] = price
+            candle[5] += size
+        elif not self.candles or bucket > self.candles[-1][0]:
+            self.candles.append([bucket, price, price, price, price, size])
+        # else: out of order trade from an older candle; ignore it
+
+    def market_data(self):
+        return [list(candle) for candle in reversed(self.candles)]
+
+
+
+class RunningExtreme(object):
+    """
+        High and low trade prices since `since` (unix ts) for one market/side.
+    """
+    def __init__(self, since, high=None, low=None):
+        self.since = since
+        self.high = high
+        self.low = low
+
+    def update(self, price):
+        """ Returns True if `price` set a new high or low """
+        changed = False
+        if self.high is None or price > self.high:
+            self.high = price
+            changed = True
+        if self.low is None or price < self.low:
+            self.low = price
+            changed = True
+        return changed
+
+
+
+class MarketFeed(object):
+    """
+        Streams the Coinbase Pro websocket 'ticker' and 'matches' channels on a
+            background thread, building 1-minute candles in memory and keeping a
+            running high/low since each strategy's date_last_updated.
+
+        Listeners are called from the feed thread as fn(market_name, side, price)
+            whenever a trade sets a new high (for 'buy' anchors) or low (for 'sell'
+            anchors). Tick listeners get fn(market_name, price) for every price
+            update. A listener that raises is logged and skipped.
+
+        A market's snapshot() goes stale (empty, so callers fall back to REST) if
+            it hasn't had a price update in `stale_after` secs, e.g. while the feed
+            is reconnecting.
+    """
+    URL = "wss://ws-feed.pro.coinbase.com"
+    RECONNECT_DELAY = 5
+
+    def __init__(self, market_names, url=URL, granularity=60, max_candles=300, stale_after=60):
+        self.market_names = list(dict.fromkeys(market_names))
+        self.url = url
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+        self.builders = {m: CandleBuilder(granularity, max_candles) for m in self.market_names}
+        self.last_price = {}
+        self.last_update = {}   # market_name -> time.monotonic() of its last price update
+        self.anchors = {}       # (market_name, side) -> RunningExtreme
+        self.listeners = []
+        self.tick_listeners = []
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.ws = None
+
+    def add_listener(self, fn):
+        self.listeners.append(fn)
+
+    def add_tick_listener(self, fn):
+        self.tick_listeners.append(fn)
+
+    def seed(self, market_name, market_data):
+        """ Backfill the in-memory candles with a REST get_product_historic_rates result """
+        with self.lock:
+            self.builders[market_name].seed(market_data)
+
+    def set_anchor(self, market_name, side, since):
+        """
+            (Re)start the running high/low for this market/side from unix ts `since`,
+                picking up whatever the in-memory candles already cover.
+        """
+        with self.lock:
+            candles = [c for c in self.builders[market_name].candles if c[0] > since]
+            extreme = RunningExtreme(since)
+            if candles:
+                extreme.high = max(c[2] for c in candles)
+                extreme.low = min(c[1] for c in candles)
+            self.anchors[(market_name, side)] = extreme
+
+    def get_extreme(self, market_name, side):
+        with self.lock:
+            return self.anchors.get((market_name, side))
+
+    def snapshot(self, market_name):
+        """
+            Candles and last price in the same shape as the REST results so it can
+                be passed to run_strategy(prefetched=...). Returns {} if the feed
+                hasn't seen a trade in this market yet, or not for `stale_after` secs.
+        """
+        with self.lock:
+            if market_name not in self.last_price:
+                return {}
+            if time.monotonic() - self.last_update[market_name] > self.stale_after:
+                return {}
+            return {
+                "market_data": self.builders[market_name].market_data(),
+                "stats": {"last": str(self.last_price[market_name])},
+            }
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="MarketFeed", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.ws:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.ws = create_connection(self.url)
+                self.ws.send(json.dumps({
+                    "type": "subscribe",
+                    "product_ids": self.market_names,
+                    "channels": ["ticker", "matches"],
+                }))
+                while not self.stop_event.is_set():
+                    message = self.ws.recv()
+                    if not message:
+                        # recv() returns '' for a close frame instead of raising
+                        raise WebSocketConnectionClosedException("Connection closed by server")
+                    try:
+                        self._on_message(json.loads(message))
+                    except Exception:
+                        # One bad message shouldn't take down the feed
+                        traceback.print_exc()
+
+            except Exception as e:
+                if self.stop_event.is_set():
+                    break
+                if not isinstance(e, (WebSocketConnectionClosedException, ConnectionError, OSError)):
+                    traceback.print_exc()
+                print(f"MarketFeed disconnected ({e}); reconnecting in {self.RECONNECT_DELAY}s")
+                try:
+                    self.ws.close()
+                except Exception:
+                    pass
+                self.stop_event.wait(self.RECONNECT_DELAY)
+
+    def _on_message(self, msg):
+        """
+            match:
+            {
+                "type": "match",
+                "trade_id": 10,
+                "sequence": 50,
+                "maker_order_id": "ac928c66-ca53-498f-9c13-a110027a60e8",
+                "taker_order_id": "132fb6ae-456b-4654-b4e0-d681ac05cea1",
+                "time": "2014-11-07T08:19:27.028459Z",
+                "product_id": "BTC-USD",
+                "size": "5.23512",
+                "price": "400.23",
+                "side": "sell"
+            }
+        """
+        msg_type = msg.get("type")
+        market_name = msg.get("product_id")
+        if market_name not in self.builders or "price" not in msg:
+            return
+
+        price = Decimal(msg["price"])
+        notify = []
+        with self.lock:
+            self.last_price[market_name] = price
+            self.last_update[market_name] = time.monotonic()
+
+            if msg_type in ["match", "last_match"]:
+                # Feed times are utc; convert_datetime_str strips the TZ
+                ts = utc_timestamp(convert_datetime_str(msg["time"]))
+                self.builders[market_name].add_trade(ts, float(price), float(msg["size"]))
+
+            for side in ["buy", "sell"]:
+                extreme = self.anchors.get((market_name, side))
+                if not extreme:
+                    continue
+                prev_high, prev_low = extreme.high, extreme.low
+                extreme.update(float(price))
+                if (side == "buy" and extreme.high != prev_high) or \
+                        (side == "sell" and extreme.low != prev_low):
+                    notify.append(side)
+
+        for listener in self.tick_listeners:
+            try:
+                listener(market_name, price)
+            except Exception:
+                traceback.print_exc()
+
+        for side in notify:
+            for listener in self.listeners:
+                try:
+                    listener(market_name, side, price)
+                except Exception:
+                    traceback.print_exc()
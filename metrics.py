@@ -0,0 +1,180 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import types
+
+
+
+class Histogram(object):
+    # secs; cumulative upper bounds like Prometheus' le buckets
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+
+class Metrics(object):
+    """
+        Per-stage timing histograms and counters, labelled by stage/market/API call.
+            Exported as Prometheus text (*.prom; overwritten) or JSON lines (anything
+            else; one line appended per export).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}    # (name, labels) -> Histogram
+        self.counters = {}      # (name, labels) -> int
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((k, v) for k, v in labels.items() if v is not None)))
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, stage, market_name=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("btfd_stage_seconds", time.perf_counter() - start,
+                         stage=stage, market=market_name)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def prometheus_text(self):
+        def fmt_labels(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+        lines = []
+        with self.lock:
+            for name in sorted(set(k[0] for k in self.histograms)):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), histogram in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(Histogram.BUCKETS, histogram.cumulative_counts()):
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{fmt_labels(labels, [('le', le)])} {count}")
+                    lines.append(f"{name}_sum{fmt_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{fmt_labels(labels)} {histogram.count}")
+            for name in sorted(set(k[0] for k in self.counters)):
+                lines.append(f"# TYPE {name} counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{fmt_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        with self.lock:
+            return {
+                "ts": time.time(),
+                "histograms": [
+                    {"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum,
+                     "buckets": dict(zip([str(b) for b in Histogram.BUCKETS], h.cumulative_counts()))}
+                    for (name, labels), h in self.histograms.items()
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+            }
+
+    def export(self, path):
+        if path.endswith(".prom"):
+            # Atomic replace so a node_exporter textfile collector never sees a partial file
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, path)
+        else:
+            with open(path, "a") as f:
+                f.write(json.dumps(self.to_json()) + "\n")
+
+
+
+class InstrumentedClient(object):
+    """
+        Wraps a cbpro client (or SimulatedExchange) so every API call is timed and
+            error responses/exceptions are counted, labelled by method name.
+    """
+    def __init__(self, client, registry=None):
+        self._client = client
+        self._registry = registry or metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        registry = self._registry
+
+        def record(start, result=None, error=False):
+            registry.observe("btfd_api_seconds", time.perf_counter() - start, call=name)
+            registry.inc("btfd_api_calls_total", call=name)
+            if error or (isinstance(result, dict) and "message" in result and result["message"] != "NotFound"):
+                registry.inc("btfd_api_errors_total", call=name)
+
+        def timed_generator(start, generator):
+            # Paginated calls (get_orders, get_fills) do their requests while iterating
+            error = False
+            try:
+                yield from generator
+            except Exception:
+                error = True
+                raise
+            finally:
+                record(start, error=error)
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                record(start, error=True)
+                raise
+            if isinstance(result, types.GeneratorType):
+                return timed_generator(start, result)
+            record(start, result)
+            return result
+
+        return wrapper
+
+
+
+# Shared by every strategy in the process
+metrics = Metrics()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import argparse
+
+from playhouse.migrate import SqliteMigrator, migrate
+
+import models
+from models import (add_order_columns, create_tables, db, get_raw_data, Order, OrderRawData,
+                    set_fill_columns)
+
+
+
+parser = argparse.ArgumentParser(
+    description="""
+        Brings an existing data.db up to the current schema:
+            * creates any new tables and missing indexes
+            * switches the db to WAL mode
+            * makes Order.raw_data nullable
+            * adds the Order.ladder_id/tier and filled_size/executed_value/fill_fees
+              columns (and fills in the latter from each order's raw_data)
+
+        Optionally moves every order's raw_data json into the OrderRawData side table
+            (then set RAW_DATA_SIDE_TABLE = true in the [database] config section).
+    """,
+    formatter_class=argparse.RawTextHelpFormatter
+)
+
+parser.add_argument('-db',
+                    default=models.DATABASE,
+                    dest="database",
+                    help="Path to the sqlite db")
+
+parser.add_argument('--split-raw-data',
+                    action="store_true",
+                    default=False,
+                    dest="split_raw_data",
+                    help="Move Order.raw_data into the OrderRawData side table")
+
+parser.add_argument('-batch_size',
+                    default=500,
+                    type=int,
+                    dest="batch_size")
+
+
+
+def make_raw_data_nullable():
+    columns = {c.name: c for c in db.get_columns(Order._meta.table_name)}
+    if not columns["raw_data"].null:
+        print("Making order.raw_data nullable")
+        # sqlite rebuilds the table; don't let the DROP cascade into OrderRawData
+        db.foreign_keys = 0
+        migrate(SqliteMigrator(db).drop_not_null(Order._meta.table_name, "raw_data"))
+        db.foreign_keys = 1
+
+
+def backfill_fill_columns(batch_size):
+    """ Copies filled_size/executed_value/fill_fees out of the raw_data json """
+    updated = 0
+    last_id = 0
+    while True:
+        orders = list(Order.select()
+                      .where(Order.filled_size.is_null(), Order.id > last_id)
+                      .order_by(Order.id)
+                      .limit(batch_size))
+        if not orders:
+            break
+        last_id = orders[-1].id
+        for order in orders:
+            set_fill_columns(order, get_raw_data(order) or {})
+        with db.atomic():
+            Order.bulk_update(orders, fields=[Order.filled_size, Order.executed_value, Order.fill_fees])
+        updated += len(orders)
+        print(f"Backfilled fill columns for {updated} orders")
+    return updated
+
+
+def split_raw_data(batch_size):
+    moved = 0
+    while True:
+        with db.atomic():
+            orders = list(Order.select(Order.id, Order.raw_data)
+                          .where(Order.raw_data.is_null(False))
+                          .limit(batch_size))
+            if not orders:
+                break
+            OrderRawData.insert_many(
+                [{"order": order.id, "data": order.raw_data} for order in orders]
+            ).on_conflict_replace().execute()
+            Order.update(raw_data=None).where(Order.id.in_([o.id for o in orders])).execute()
+        moved += len(orders)
+        print(f"Moved raw_data for {moved} orders")
+    return moved
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    db.init(args.database, pragmas=models.PRAGMAS, timeout=10)
+
+    db.connect()
+    print(f"journal_mode: {db.journal_mode}")
+    if Order.table_exists():
+        make_raw_data_nullable()
+        add_order_columns()
+    db.close()
+
+    # New tables plus any indexes missing from the existing ones
+    create_tables()
+
+    db.connect()
+
+    backfill_fill_columns(args.batch_size)
+
+    if args.split_raw_data:
+        if split_raw_data(args.batch_size):
+            # Reclaim the space the json was taking up in the order table
+            db.execute_sql("VACUUM")
+
+    db.execute_sql("ANALYZE")
+    db.close()
+    print("Done")
@@ -1,5 +1,4 @@
 import datetime
-import dateutil
 import utils
 
 from decimal import Decimal
@@ -10,13 +9,56 @@ from playhouse.sqlite_ext import JSONField
 
 DATABASE = 'data.db'
 
+# WAL lets readers and a writer work concurrently and needs far fewer fsyncs;
+#	'normal' sync is still crash-safe in WAL mode.
+PRAGMAS = {
+	'journal_mode': 'wal',
+	'synchronous': 'normal',
+	'cache_size': -16 * 1024,	# 16MB
+	'temp_store': 'memory',
+	'foreign_keys': 1,
+}
+
+# Store new orders' raw_data json in the OrderRawData side table instead of the
+#	Order row (see migrate.py --split-raw-data)
+RAW_DATA_SIDE_TABLE = False
+
 # Create a database instance that will manage the connection and
 # execute queries
-db = SqliteDatabase(DATABASE)
+db = SqliteDatabase(DATABASE, pragmas=PRAGMAS, timeout=10)
 
 def create_tables():
-	with db:
-		db.create_tables([Order])
+	if db.is_closed():
+		with db:
+			return create_tables()
+
+	# (Leaves an already open connection open; a ":memory:" db is gone once it's closed)
+	if Order.table_exists():
+		add_order_columns()
+	# safe=True also adds any indexes missing from existing tables
+	db.create_tables([Order, OrderRawData, ExtremeState, SignalState, ProductCache, Lease,
+					  Intent])
+
+
+def add_order_columns():
+	"""
+		Adds the Order columns that are newer than an existing order table (all
+		nullable, so no data changes). migrate.py does the rest of an upgrade.
+	"""
+	columns = [c.name for c in db.get_columns(Order._meta.table_name)]
+	fields = [field for field in [Order.ladder_id, Order.tier, Order.filled_size,
+								  Order.executed_value, Order.fill_fees]
+			  if field.column_name not in columns]
+	if not fields:
+		return
+
+	from playhouse.migrate import SqliteMigrator, migrate
+	migrator = SqliteMigrator(db)
+	for field in fields:
+		print(f"Adding order.{field.column_name}")
+	migrate(*[migrator.add_column(Order._meta.table_name, field.column_name, field) for field in fields])
+	if Order.filled_size in fields:
+		print("Run migrate.py to fill in filled_size/executed_value/fill_fees for existing orders")
 
 
 # Create a base-class all our models will inherit, which defines
@@ -46,7 +88,107 @@ class Order(BaseModel):
 	done_reason = CharField(null=True)
 	created = DateTimeField()
 	updated = DateTimeField(null=True)
-	raw_data = JSONField()
+	raw_data = JSONField(null=True)
+	ladder_id = CharField(null=True)	# shared by every tier of a ladder (see ladder.py)
+	tier = IntegerField(null=True)
+
+	# Copied out of the raw_data json so reports (see report.py) can aggregate them in sql
+	filled_size = DecimalField(null=True)
+	executed_value = DecimalField(null=True)
+	fill_fees = DecimalField(null=True)
+
+	class Meta:
+		indexes = (
+			# open order and previous DONE order lookups (ordered by created desc)
+			(('market_name', 'side', 'status', 'created'), False),
+			# reconcile_orders()
+			(('status',), False),
+		)
+
+
+class OrderRawData(BaseModel):
+	"""
+		Keeps the full order json out of the hot Order rows
+	"""
+	order = ForeignKeyField(Order, unique=True, backref='raw_data_rows', on_delete='CASCADE')
+	data = JSONField()
+
+
+class ExtremeState(BaseModel):
+	"""
+		Persisted ExtremeTracker candidates for each market/side
+	"""
+	market_name = CharField()
+	side = CharField()
+	mode = CharField()		# max, min
+	anchor = IntegerField()
+	last_ts = IntegerField()
+	entries = JSONField()
+
+	class Meta:
+		indexes = (
+			(('market_name', 'side'), True),
+		)
+
+
+class SignalState(BaseModel):
+	"""
+		Persisted signals.MarketSignals indicators for each market
+	"""
+	market_name = CharField(unique=True)
+	last_ts = IntegerField()
+	data = JSONField()
+
+
+class ProductCache(BaseModel):
+	"""
+		Cached get_products() results; see caches.ProductMetadataCache
+	"""
+	product_id = CharField(unique=True)
+	data = JSONField()
+	fetched = DateTimeField()
+
+
+class Lease(BaseModel):
+	"""
+		Which runner.py process (`owner`) is running a profile, until `expires`
+	"""
+	name = CharField(unique=True)
+	owner = CharField()
+	expires = DateTimeField()
+
+
+class Intent(BaseModel):
+	"""
+		Write-ahead journal of order placements/cancellations (see journal.py). Saved
+			before the API call and resolved after, so a crash or timeout in between
+			can be sorted out on the next run instead of guessed at.
+	"""
+	ACTION__PLACE = 'place'
+	ACTION__CANCEL = 'cancel'
+
+	STATUS__PENDING = 'pending'
+	STATUS__DONE = 'done'
+	STATUS__FAILED = 'failed'
+
+	action = CharField()
+	status = CharField(default=STATUS__PENDING)
+	client_oid = CharField(unique=True)		# sent with place_limit_order
+	order_id = CharField(null=True)			# the order being cancelled, or the one placed
+	market_name = CharField()
+	side = CharField()
+	price = DecimalField(null=True)
+	size = DecimalField(null=True)
+	percent_diff = DecimalField(null=True)
+	ladder_id = CharField(null=True)
+	tier = IntegerField(null=True)
+	created = DateTimeField(default=datetime.datetime.utcnow)
+	resolved = DateTimeField(null=True)
+
+	class Meta:
+		indexes = (
+			(('status', 'market_name', 'side'), False),
+		)
 
 
 def update_order_from_json(order, raw_json, percent_diff=None):
@@ -80,20 +222,133 @@ def update_order_from_json(order, raw_json, percent_diff=None):
 		order.side = raw_json.get("side")
 		order.status = raw_json.get("status")
 		order.created = utils.convert_datetime_str(raw_json.get("created_at"))
-		order.raw_data = raw_json
+		order.raw_data = None if RAW_DATA_SIDE_TABLE else raw_json
+		set_fill_columns(order, raw_json)
 		if raw_json.get("done_at"):
 			order.updated = utils.convert_datetime_str(raw_json.get("done_at"))
 			order.done_reason = raw_json.get("done_reason")
 		order.save()
+		if RAW_DATA_SIDE_TABLE:
+			OrderRawData.insert(order=order, data=raw_json).on_conflict(
+				conflict_target=[OrderRawData.order],
+				preserve=[OrderRawData.data]
+			).execute()
 	except Exception as e:
 		print(raw_json)
 		raise e
 
 
+def set_fill_columns(order, raw_json):
+	for column in ["filled_size", "executed_value", "fill_fees"]:
+		if raw_json.get(column) is not None:
+			setattr(order, column, Decimal(raw_json.get(column)))
+
+
+def get_raw_data(order):
+	if order.raw_data is not None:
+		return order.raw_data
+	row = OrderRawData.get_or_none(order=order)
+	return row.data if row else None
+
+
+def get_open_order(market_name, side):
+	"""
+		The most recent OPEN/PENDING single (non-ladder) order for this market/side (or None)
+	"""
+	return Order.filter(
+		market_name=market_name,
+		status__in=[Order.STATUS__OPEN, Order.STATUS__PENDING],
+		side=side
+	).where(Order.ladder_id.is_null()).order_by(Order.created.desc()).first()
+
+
+def get_last_done_order(market_name, side):
+	return Order.filter(
+		market_name=market_name,
+		status=Order.STATUS__DONE,
+		side=side
+	).where(Order.ladder_id.is_null()).order_by(Order.created.desc()).first()
+
+
+def get_open_ladder_orders(market_name, side):
+	"""
+		Every OPEN/PENDING ladder tier order for this market/side
+	"""
+	return list(Order.filter(
+		market_name=market_name,
+		status__in=[Order.STATUS__OPEN, Order.STATUS__PENDING],
+		side=side
+	).where(Order.ladder_id.is_null(False)).order_by(Order.tier))
+
+
+def get_last_done_ladder_order(market_name, side):
+	"""
+		The most recently filled ladder tier for this market/side (or None)
+	"""
+	return Order.filter(
+		market_name=market_name,
+		status=Order.STATUS__DONE,
+		side=side
+	).where(Order.ladder_id.is_null(False)).order_by(Order.updated.desc()).first()
+
+
+def get_date_last_updated(market_name, side):
+	"""
+		Where the next recent_extreme scan starts from: the current open order's
+		created date or else the last completed order's fill date.
+	"""
+	order = get_open_order(market_name, side)
+	if order:
+		return order.created
+	order = get_last_done_order(market_name, side)
+	if order:
+		return order.updated or order.created
+	return get_ladder_anchor(market_name, side)
+
+
+def get_ladder_anchor(market_name, side):
+	"""
+		A ladder's recent_extreme scan starts from the later of its oldest open tier's
+			created date and its most recent fill. So after a fill, the tiers get
+			re-placed relative to the price since then, not the old peak.
+	"""
+	dates = []
+	open_orders = get_open_ladder_orders(market_name, side)
+	if open_orders:
+		dates.append(min(order.created for order in open_orders))
+	last_done = get_last_done_ladder_order(market_name, side)
+	if last_done:
+		dates.append(last_done.updated or last_done.created)
+	return max(dates) if dates else None
+
+
 def create_order_from_json(raw_json, percent_diff=None):
 	order = Order()
 	update_order_from_json(order, raw_json, percent_diff)
 	return order
 
 
+def acquire_lease(name, owner, ttl):
+	"""
+		Takes (or renews) the lease on `name` for `ttl` secs. Returns False if some
+			other owner holds an unexpired lease.
+	"""
+	now = datetime.datetime.utcnow()
+	# IMMEDIATE takes the write lock up front so two runners can't both see it free
+	with db.atomic('IMMEDIATE'):
+		lease = Lease.get_or_none(name=name)
+		if lease and lease.owner != owner and lease.expires > now:
+			return False
+		Lease.insert(
+			name=name,
+			owner=owner,
+			expires=now + datetime.timedelta(seconds=ttl)
+		).on_conflict(
+			conflict_target=[Lease.name],
+			preserve=[Lease.owner, Lease.expires]
+		).execute()
+	return True
+
 
+def release_lease(name, owner):
+	Lease.delete().where(Lease.name == name, Lease.owner == owner).execute()
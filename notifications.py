@@ -0,0 +1,207 @@
+import datetime
+import queue
+import threading
+import time
+
+
+
+class NotificationBackend(object):
+    def send(self, subject, message):
+        raise NotImplementedError()
+
+
+
+class SNSBackend(NotificationBackend):
+    """
+        AWS SNS topic (e.g. with an email subscription). The boto3 client is only
+            built the first time something is actually sent.
+    """
+    MAX_SUBJECT_LENGTH = 100
+
+    def __init__(self, topic_arn, aws_access_key_id, aws_secret_access_key,
+                 region_name="us-east-1"):   # N. Virginia
+        self.topic_arn = topic_arn
+        self.aws_access_key_id = aws_access_key_id
+        self.aws_secret_access_key = aws_secret_access_key
+        self.region_name = region_name
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client(
+                "sns",
+                aws_access_key_id=self.aws_access_key_id,
+                aws_secret_access_key=self.aws_secret_access_key,
+                region_name=self.region_name
+            )
+        return self._client
+
+    def send(self, subject, message):
+        self.client.publish(
+            TopicArn=self.topic_arn,
+            Subject=subject[:self.MAX_SUBJECT_LENGTH],
+            Message=message
+        )
+
+
+
+class FileBackend(NotificationBackend):
+    """ Appends notifications to a local file; handy for testing """
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, subject, message):
+        with open(self.path, "a") as f:
+            f.write(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {subject}\n")
+            f.write(f"{message}\n\n")
+
+
+
+class SMTPBackend(NotificationBackend):
+    def __init__(self, host, port, from_address, to_address, username=None, password=None):
+        self.host = host
+        self.port = port
+        self.from_address = from_address
+        self.to_address = to_address
+        self.username = username
+        self.password = password
+
+    def send(self, subject, message):
+        # The email package is slow to import and most runs never send anything
+        import smtplib
+        from email.message import EmailMessage
+
+        email = EmailMessage()
+        email["Subject"] = subject
+        email["From"] = self.from_address
+        email["To"] = self.to_address
+        email.set_content(message)
+        with smtplib.SMTP(self.host, self.port) as smtp:
+            if self.username:
+                smtp.starttls()
+                smtp.login(self.username, self.password)
+            smtp.send_message(email)
+
+
+
+class Notifier(object):
+    """
+        Sends notifications from a background thread so a slow backend never blocks
+            the trading loop. Failed sends are retried with exponential backoff.
+
+        publish(..., digest=True) messages (e.g. fills) are held for `digest_window`
+            secs and any others that arrive in the meantime are combined into one
+            message. close() sends whatever is still pending.
+    """
+    _STOP = object()
+
+    def __init__(self, backend, digest_window=60, max_retries=3, backoff=1.0):
+        self.backend = backend
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def publish(self, subject, message, digest=False):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="Notifier", daemon=True)
+            self.thread.start()
+        self.queue.put((subject, message, digest))
+
+    def close(self, timeout=30):
+        if self.thread is None:
+            return
+        self.queue.put(self._STOP)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                self._send_digest(pending)
+                break
+
+            if item is not None:
+                subject, message, digest = item
+                if digest and self.digest_window > 0:
+                    pending.append((subject, message))
+                    if deadline is None:
+                        deadline = time.time() + self.digest_window
+                else:
+                    self._send(subject, message)
+
+            if deadline is not None and time.time() >= deadline:
+                self._send_digest(pending)
+                pending = []
+                deadline = None
+
+    def _send_digest(self, pending):
+        if not pending:
+            return
+        if len(pending) == 1:
+            self._send(*pending[0])
+            return
+        subject = f"{len(pending)} updates: " + "; ".join(subject for subject, message in pending)
+        message = "\n\n".join(f"{subject}\n{message}" for subject, message in pending)
+        self._send(subject, message)
+
+    def _send(self, subject, message):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.backend.send(subject, message)
+                return
+            except Exception as e:
+                print(f"Notification failed ({attempt + 1}/{self.max_retries + 1}): {e}")
+                if attempt < self.max_retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        print(f"Gave up sending notification: {subject}")
+
+
+
+def create_notifier(config, config_section):
+    """
+        Builds the Notifier from the settings.conf section:
+
+            NOTIFY_BACKEND = sns            (sns, file, smtp; default sns)
+            NOTIFY_DIGEST_WINDOW = 60       (secs to batch fill notifications)
+            NOTIFY_FILE = notifications.log
+            SMTP_HOST, SMTP_PORT, SMTP_FROM, SMTP_TO, SMTP_USERNAME, SMTP_PASSWORD
+    """
+    backend_name = config.get(config_section, 'NOTIFY_BACKEND', fallback='sns').lower()
+    if backend_name == 'sns':
+        backend = SNSBackend(
+            topic_arn=config.get(config_section, 'SNS_TOPIC'),
+            aws_access_key_id=config.get(config_section, 'AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=config.get(config_section, 'AWS_SECRET_ACCESS_KEY')
+        )
+    elif backend_name == 'file':
+        backend = FileBackend(config.get(config_section, 'NOTIFY_FILE', fallback='notifications.log'))
+    elif backend_name == 'smtp':
+        backend = SMTPBackend(
+            host=config.get(config_section, 'SMTP_HOST'),
+            port=config.getint(config_section, 'SMTP_PORT', fallback=25),
+            from_address=config.get(config_section, 'SMTP_FROM'),
+            to_address=config.get(config_section, 'SMTP_TO'),
+            username=config.get(config_section, 'SMTP_USERNAME', fallback=None),
+            password=config.get(config_section, 'SMTP_PASSWORD', fallback=None)
+        )
+    else:
+        raise Exception(f"Unknown NOTIFY_BACKEND {backend_name}")
+
+    return Notifier(
+        backend,
+        digest_window=config.getint(config_section, 'NOTIFY_DIGEST_WINDOW', fallback=60)
+    )
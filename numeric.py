@@ -0,0 +1,158 @@
+import math
+
+from decimal import Decimal
+
+
+
+# Floats represent every int up to 2**53 exactly; stay well inside that
+_FLOAT_EXACT = 2 ** 52
+
+
+def _round_div(n, d):
+    """ n / d rounded half-even (like Decimal.quantize's default), for ints with d > 0 """
+    q, r = divmod(n, d)
+    twice = 2 * r
+    if twice > d or (twice == d and q % 2):
+        q += 1
+    return q
+
+
+def _ratio(value):
+    """ Exact (numerator, denominator) of an int, float, Decimal, or numeric string """
+    if isinstance(value, int):
+        return value, 1
+    if isinstance(value, str):
+        # Fast path for the plain "123.45000000" strings the API returns
+        whole, dot, frac = value.partition(".")
+        digits = whole + frac
+        if digits.lstrip("-").isdigit() and whole not in ["", "-"]:
+            return int(digits), 10 ** len(frac)
+        value = Decimal(value)
+    return value.as_integer_ratio()
+
+
+
+class MarketNumerics(object):
+    """
+        A market's price and size math as integer ticks (multiples of
+            quote_increment / base_increment), with the scaling worked out once:
+
+            ticks = value / increment, rounded half-even (same as .quantize())
+
+        Tick math is exact. Percent moves, quote -> size conversions, and
+            comparisons are plain int ops. Prices and sizes go back out as exact
+            strings, so an order payload never passes through a float.
+    """
+    def __init__(self, quote_increment, base_increment, base_min_size=None):
+        self.quote_increment = Decimal(quote_increment).normalize()
+        self.base_increment = Decimal(base_increment).normalize()
+        self.quote_places, self.quote_unit = self._scale(self.quote_increment)
+        self.base_places, self.base_unit = self._scale(self.base_increment)
+        self.quote_pow = 10 ** self.quote_places
+        self.base_pow = 10 ** self.base_places
+        # value * scale == ticks, for the float fast path
+        self.quote_scale = self.quote_pow / self.quote_unit
+        self.base_scale = self.base_pow / self.base_unit
+        # percent_diffs and amounts repeat on every call; their ratios are cached
+        self._ratios = {}
+        self.base_min_size = None
+        if base_min_size is not None:
+            self.base_min_size = self.size_ticks(base_min_size)
+
+    @staticmethod
+    def _scale(increment):
+        """ increment == unit * 10**-places """
+        sign, digits, exponent = increment.as_tuple()
+        places = max(0, -exponent)
+        return places, int(increment.scaleb(places))
+
+    def _remember_ratio(self, value):
+        ratio = self._ratios[value] = _ratio(value)
+        return ratio
+
+    def price_ticks(self, value):
+        if value.__class__ is float or value.__class__ is str:
+            # Candle floats and API strings. The float math is off by a few ulps at
+            #   most, so unless the value lands within that of a half tick,
+            #   rounding it gives the exact answer. Otherwise do it the slow way.
+            scaled = float(value) * self.quote_scale
+            if abs(scaled - math.floor(scaled) - 0.5) > 1e-9 * (abs(scaled) + 1) and abs(scaled) < _FLOAT_EXACT:
+                return round(scaled)
+        n, d = _ratio(value)
+        return _round_div(n * self.quote_pow, d * self.quote_unit)
+
+    def size_ticks(self, value):
+        # Same as price_ticks; kept separate (not a shared helper) since it's per-candle hot
+        if value.__class__ is float or value.__class__ is str:
+            scaled = float(value) * self.base_scale
+            if abs(scaled - math.floor(scaled) - 0.5) > 1e-9 * (abs(scaled) + 1) and abs(scaled) < _FLOAT_EXACT:
+                return round(scaled)
+        n, d = _ratio(value)
+        return _round_div(n * self.base_pow, d * self.base_unit)
+
+    def target_ticks(self, extreme_ticks, percent_diff):
+        """ extreme * (100 + percent_diff) / 100, in price ticks """
+        n, d = self._ratios.get(percent_diff) or self._remember_ratio(percent_diff)
+        return _round_div(extreme_ticks * (100 * d + n), 100 * d)
+
+    def size_for_quote(self, amount, price_ticks):
+        """ How much base `amount` of the quote currency buys at `price_ticks`, in size ticks """
+        n, d = self._ratios.get(amount) or self._remember_ratio(amount)
+        # amount / (price_ticks * quote_unit / quote_pow) / (base_unit / base_pow)
+        return _round_div(n * self.quote_pow * self.base_pow,
+                          d * price_ticks * self.quote_unit * self.base_unit)
+
+    def quote_value(self, price_ticks, size_ticks):
+        """ price * size as an exact Decimal """
+        return (Decimal(price_ticks * self.quote_unit * size_ticks * self.base_unit)
+                .scaleb(-(self.quote_places + self.base_places)))
+
+    @staticmethod
+    def _format(value, places):
+        """ The int `value` * 10**-places as a plain decimal string """
+        if not places:
+            return str(value)
+        if value < 0:
+            return "-" + MarketNumerics._format(-value, places)
+        digits = str(value)
+        if len(digits) <= places:
+            digits = digits.rjust(places + 1, "0")
+        return digits[:-places] + "." + digits[-places:]
+
+    def format_price(self, ticks):
+        places = self.quote_places
+        if ticks > 0 and ticks * self.quote_unit >= self.quote_pow:
+            # Common case: at least one whole unit
+            digits = str(ticks * self.quote_unit)
+            return digits[:-places] + "." + digits[-places:] if places else digits
+        return self._format(ticks * self.quote_unit, places)
+
+    def format_size(self, ticks):
+        places = self.base_places
+        if ticks > 0 and ticks * self.base_unit >= self.base_pow:
+            digits = str(ticks * self.base_unit)
+            return digits[:-places] + "." + digits[-places:] if places else digits
+        return self._format(ticks * self.base_unit, places)
+
+    def price(self, ticks):
+        """ Decimal price (e.g. for the db), quantized like quote_increment """
+        return Decimal(self.format_price(ticks))
+
+    def size(self, ticks):
+        return Decimal(self.format_size(ticks))
+
+
+
+_numerics = {}
+
+
+def market_numerics(product):
+    """ The MarketNumerics for a get_products() entry; built once per market/increments """
+    key = (product.get("id"), product.get("quote_increment"), product.get("base_increment"),
+           product.get("base_min_size"))
+    numerics = _numerics.get(key)
+    if numerics is None:
+        numerics = _numerics[key] = MarketNumerics(product.get("quote_increment"),
+                                                   product.get("base_increment"),
+                                                   product.get("base_min_size"))
+    return numerics
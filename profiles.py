@@ -0,0 +1,36 @@
+class Profile(object):
+    """
+        One Coinbase Pro account/portfolio from a [profile:<name>] settings.conf
+            section. It has the same keys as [production]/[sandbox] plus:
+
+            SANDBOX = false             (use the sandbox API)
+            DATABASE = data_<name>.db   (each profile keeps its orders in its own db)
+
+        Strategies opt in with `profile = <name>` in their [strategy:<name>] section.
+    """
+    def __init__(self, name, section, sandbox=False, database=None):
+        self.name = name
+        self.section = section
+        self.sandbox = sandbox
+        self.database = database or f"data_{name}.db"
+
+    def __repr__(self):
+        return f"Profile({self.name}{' sandbox' if self.sandbox else ''}: {self.database})"
+
+
+def load_profile(config, name):
+    section = f"profile:{name}"
+    if not config.has_section(section):
+        raise Exception(f"No [{section}] section in the config file")
+    return Profile(
+        name=name,
+        section=section,
+        sandbox=config.getboolean(section, 'SANDBOX', fallback=False),
+        database=config.get(section, 'DATABASE', fallback=None),
+    )
+
+
+def load_profiles(config):
+    """ Every [profile:<name>] section """
+    return [load_profile(config, section[len("profile:"):])
+            for section in config.sections() if section.startswith("profile:")]
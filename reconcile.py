@@ -0,0 +1,59 @@
+from models import db, get_raw_data, Order, update_order_from_json
+
+
+
+def reconcile_orders(auth_client, order_jsons=None):
+    """
+        Brings every OPEN/PENDING order in the db up to date with one paginated
+            get_orders sweep of the exchange's open orders instead of a get_order
+            call per order. Only the orders that have dropped off the open list
+            (filled, cancelled, etc) need their own get_order lookup.
+
+        All status changes (including partial fills on still-open orders) are saved
+            in one transaction. Returns [(order, order_json)] for each order that is
+            no longer OPEN/PENDING and wasn't just cancelled out from under us.
+
+        Pass an `order_jsons` dict to also get the fresh json of every order checked
+            ({order_id: order_json}); hand it to run_strategy as prefetched["orders"]
+            so it doesn't get_order them all over again.
+    """
+    local_orders = list(Order.filter(status__in=[Order.STATUS__OPEN, Order.STATUS__PENDING]))
+    if not local_orders:
+        return []
+
+    remote_orders = {}
+    for order_json in auth_client.get_orders(status=[Order.STATUS__OPEN, Order.STATUS__PENDING]):
+        if not isinstance(order_json, dict) or "id" not in order_json:
+            raise Exception(f"Could not retrieve open orders: {order_json}")
+        remote_orders[order_json["id"]] = order_json
+
+    # Fetch the ones that are no longer open before opening the transaction
+    for order in local_orders:
+        if order.order_id not in remote_orders:
+            order_json = auth_client.get_order(order.order_id)
+            if not order_json or ("message" in order_json and order_json["message"] != "NotFound"):
+                raise Exception(f"Could not retrieve order {order.order_id}: {order_json}")
+            remote_orders[order.order_id] = order_json
+
+    if order_jsons is not None:
+        order_jsons.update(remote_orders)
+
+    finished = []
+    with db.atomic():
+        for order in local_orders:
+            order_json = remote_orders[order.order_id]
+            if order_json.get("message") == "NotFound":
+                # Order was probably manually cancelled
+                print(f"Order {order.order_id} not found; marking cancelled")
+                order.status = Order.STATUS__CANCELLED
+                order.save()
+                continue
+
+            if order_json == get_raw_data(order):
+                continue
+
+            update_order_from_json(order, order_json, order.percent_diff)
+            if order.status not in [Order.STATUS__OPEN, Order.STATUS__PENDING]:
+                finished.append((order, order_json))
+
+    return finished
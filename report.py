@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import os
+
+import numpy as np
+
+from peewee import fn
+
+import models
+from models import db, Order
+
+
+"""
+    Fill analytics over the orders in the db, per market/side:
+
+    * fills, size, quote spent (BUY) or received (SELL), and fees
+    * cost basis: avg price paid incl. fees (BUY) or received net of fees (SELL)
+    * vs. a plain periodic buy/sell of the same total over the same time span, at the
+        candle close every `-period_hours` (needs a -candle_dir CandleStore covering
+        that span; see candle_store.py)
+    * mark-to-market P&L of what was bought, at the latest cached candle close
+
+    Every fill is loaded with one query straight into numpy arrays (the typed
+        filled_size/executed_value/fill_fees columns, not the raw_data json) and
+        aggregated with bincount/reduceat. No per-row Python work, so tens of
+        thousands of fills take milliseconds.
+
+    ex:
+        python report.py
+        python report.py BTC-USD -candle_dir candles -period_hours 24
+        python report.py -export fills.npz      (compact columnar copy of every fill)
+"""
+parser = argparse.ArgumentParser(
+    description="Per-market cost basis, fees, and DCA vs. periodic buy performance",
+    formatter_class=argparse.RawTextHelpFormatter
+)
+
+parser.add_argument('market_names',
+                    nargs="*",
+                    help="Only these markets (default: all)")
+
+parser.add_argument('-side',
+                    choices=["BUY", "SELL"],
+                    default=None,
+                    dest="side")
+
+parser.add_argument('-db',
+                    default=models.DATABASE,
+                    dest="database",
+                    help="Path to the sqlite db")
+
+parser.add_argument('-candle_dir',
+                    default=None,
+                    dest="candle_dir",
+                    help="CandleStore root for the periodic buy comparison and mark-to-market")
+
+parser.add_argument('-period_hours',
+                    default=24,
+                    type=float,
+                    dest="period_hours",
+                    help="Interval of the periodic buy/sell benchmark")
+
+parser.add_argument('-fee_rate',
+                    default=0.005,
+                    type=float,
+                    dest="fee_rate",
+                    help="Taker fee for the periodic benchmark's market orders")
+
+parser.add_argument('-export',
+                    default=None,
+                    dest="export_file",
+                    help="Also save every fill as numpy arrays (.npz)")
+
+
+
+def load_fills(market_names=None, side=None):
+    """
+        Every order with a non-zero fill (incl. partially filled then cancelled) as
+            numpy arrays: market, side, time (epoch secs of the fill), size,
+            value, fees.
+    """
+    fill_time = fn.COALESCE(Order.updated, Order.created)
+    query = (Order
+             .select(Order.market_name,
+                     Order.side,
+                     fn.strftime('%s', fill_time).cast('INTEGER'),
+                     Order.filled_size.cast('REAL'),
+                     Order.executed_value.cast('REAL'),
+                     fn.COALESCE(Order.fill_fees, 0).cast('REAL'))
+             .where(Order.filled_size > 0)
+             .order_by(fill_time))
+    if market_names:
+        query = query.where(Order.market_name.in_(market_names))
+    if side:
+        query = query.where(Order.side == side.lower())
+
+    # Raw cursor rows; skips peewee's per-value Decimal conversion
+    rows = db.execute(query).fetchall()
+    columns = list(zip(*rows)) if rows else [[]] * 6
+    return {
+        "market": np.array(columns[0], dtype=str),
+        "side": np.array(columns[1], dtype=str),
+        "time": np.array(columns[2], dtype=np.int64),
+        "size": np.array(columns[3], dtype=np.float64),
+        "value": np.array(columns[4], dtype=np.float64),
+        "fees": np.array(columns[5], dtype=np.float64),
+    }
+
+
+def summarize(fills):
+    """ Per market/side totals; returns (group keys, {column: per-group array}) """
+    keys, inverse = np.unique(np.char.add(np.char.add(fills["market"], " "), fills["side"]),
+                              return_inverse=True)
+    totals = {
+        "fills": np.bincount(inverse, minlength=len(keys)),
+        "size": np.bincount(inverse, weights=fills["size"], minlength=len(keys)),
+        "value": np.bincount(inverse, weights=fills["value"], minlength=len(keys)),
+        "fees": np.bincount(inverse, weights=fills["fees"], minlength=len(keys)),
+    }
+
+    # fills are sorted by time, so a stable sort by group keeps each group in time order
+    order = np.argsort(inverse, kind="stable")
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(inverse[order])) + 1])
+    times = fills["time"][order]
+    totals["first"] = times[starts]
+    totals["last"] = np.maximum.reduceat(times, starts)
+    return keys, totals
+
+
+def load_closes(candle_dir, market_name):
+    """ (times, closes) from the market's minute CandleStore, or None """
+    if not candle_dir or not os.path.exists(os.path.join(candle_dir, f"{market_name}_60", "meta.json")):
+        return None
+    from candle_store import CandleStore
+    columns = CandleStore(candle_dir, market_name, granularity=60).columns()
+    if not len(columns["time"]):
+        return None
+    return columns["time"], columns["close"]
+
+
+def periodic_benchmark(times, closes, first, last, period, total, buy, fee_rate):
+    """
+        Avg price of spending (BUY) `total` quote, or selling (SELL) `total` base, in
+            equal parts at the candle close every `period` secs from `first` to
+            `last`. Returns None if the candles don't cover that span.
+    """
+    if times[0] > first or times[-1] < last:
+        return None
+    schedule = np.arange(first, last + 1, period)
+    prices = closes[np.searchsorted(times, schedule, side="right") - 1]
+    part = total / len(schedule)
+    if buy:
+        # Spend `part` incl. the fee each time
+        base = (part / (1 + fee_rate) / prices).sum()
+        return total / base
+    proceeds = (part * prices * (1 - fee_rate)).sum()
+    return proceeds / total
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    db.init(args.database, pragmas=models.PRAGMAS, timeout=10)
+    db.connect()
+
+    fills = load_fills(args.market_names, args.side)
+    db.close()
+
+    if args.export_file:
+        np.savez_compressed(args.export_file, **fills)
+        print(f"Exported {len(fills['time'])} fills to {args.export_file}")
+
+    if not len(fills["time"]):
+        print("No fills found")
+        exit()
+
+    keys, totals = summarize(fills)
+    period = int(args.period_hours * 3600)
+
+    print(f"{'market':<10} {'side':<4} {'fills':>6} {'size':>14} {'quote':>14} {'fees':>10} "
+          f"{'avg price':>12} {'periodic':>12} {'vs periodic':>11} {'mtm p&l':>12}")
+    for i, key in enumerate(keys):
+        market_name, side = key.split(" ")
+        buy = side == "buy"
+        size = totals["size"][i]
+        value = totals["value"][i]
+        fees = totals["fees"][i]
+        if buy:
+            # Cost basis incl. fees
+            quote = value + fees
+        else:
+            # Net proceeds
+            quote = value - fees
+        avg_price = quote / size
+
+        benchmark_str = vs_str = mtm_str = "n/a"
+        candles = load_closes(args.candle_dir, market_name)
+        if candles:
+            times, closes = candles
+            benchmark = periodic_benchmark(times, closes, totals["first"][i], totals["last"][i],
+                                           period, quote if buy else size, buy, args.fee_rate)
+            if benchmark:
+                # Positive: the bot got a better price than the periodic buy/sell
+                vs = (benchmark - avg_price) / benchmark if buy else (avg_price - benchmark) / benchmark
+                benchmark_str = f"{benchmark:.2f}"
+                vs_str = f"{vs * 100:+.2f}%"
+            if buy:
+                mtm_str = f"{size * closes[-1] - quote:.2f}"
+
+        print(f"{market_name:<10} {side:<4} {totals['fills'][i]:>6} {size:>14.8f} {quote:>14.2f} "
+              f"{fees:>10.2f} {avg_price:>12.2f} {benchmark_str:>12} {vs_str:>11} {mtm_str:>12}")
+
+    first = datetime.datetime.utcfromtimestamp(int(fills["time"].min()))
+    last = datetime.datetime.utcfromtimestamp(int(fills["time"].max()))
+    print(f"{len(fills['time'])} fills from {first} to {last} UTC; total fees {fills['fees'].sum():.2f}")
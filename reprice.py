@@ -0,0 +1,120 @@
+import datetime
+
+from decimal import Decimal
+
+from journal import cancel_orders
+from metrics import metrics
+
+
+
+class RepricePolicy(object):
+    """
+        Decides whether an open order whose target_price has improved is actually
+            worth a cancel + place (two API calls, and the order loses its queue
+            priority):
+
+            min_move        skip unless the price moves at least this many percent
+            min_interval    skip unless the order has been resting this many secs
+            batch_cancel    cancel several orders for a market with one cancel_all
+                            call when they're every order open there (checked
+                            against the exchange, so manual or other bots' orders
+                            are never caught up in it)
+
+        Every skipped or batched call is counted in the metrics registry
+            (btfd_requotes_skipped_total, btfd_api_calls_saved_total by reason), so
+            the savings of each setting show up next to btfd_requotes_total.
+    """
+    def __init__(self, min_move=0, min_interval=0, batch_cancel=False):
+        self.min_move = Decimal(min_move)
+        self.min_interval = int(min_interval)
+        self.batch_cancel = batch_cancel
+
+    def __repr__(self):
+        return (f"RepricePolicy(min_move={self.min_move}%, min_interval={self.min_interval}s, "
+                f"batch_cancel={self.batch_cancel})")
+
+    def should_reprice(self, order, new_price, now=None):
+        """
+            `order` is the resting Order and `new_price` its (already more favorable)
+                new target_price.
+        """
+        reason = None
+        move = abs(new_price - order.target_price) / order.target_price * Decimal('100')
+        if move < self.min_move:
+            reason = "min_move"
+            print(f"Re-price skipped: {order.target_price} -> {new_price} is only {move.quantize(Decimal('0.001'))}% (min_move {self.min_move}%)")
+        elif self.min_interval and order.created:
+            age = ((now or datetime.datetime.utcnow()) - order.created).total_seconds()
+            if age < self.min_interval:
+                reason = "min_interval"
+                print(f"Re-price skipped: order is only {int(age)}s old (min_interval {self.min_interval}s)")
+
+        if reason:
+            metrics.inc("btfd_requotes_skipped_total", market=order.market_name, reason=reason)
+            # Each skipped requote is a cancel_order + place_limit_order we didn't make
+            metrics.inc("btfd_api_calls_saved_total", 2, market=order.market_name, reason=reason)
+            return False
+
+        metrics.inc("btfd_requotes_total", market=order.market_name)
+        return True
+
+    def cancel_orders(self, auth_client, market_name, orders, other_open_orders=0):
+        """
+            Cancels `orders` (journalled; see journal.cancel_orders). If batch_cancel
+                is on and they're all of our open orders for the market
+                (`other_open_orders` == 0), one get_orders call checks that they're
+                also all of the exchange's open orders for it; if so, a single
+                cancel_all(product_id) is used instead of one cancel_order each.
+                It takes the two calls, so it's only worth it for 3+ orders.
+
+            Returns the order_ids the exchange confirmed cancelled.
+        """
+        if self.batch_cancel and len(orders) > 2 and other_open_orders == 0:
+            if self._only_open_orders(auth_client, market_name, orders):
+                print(f"Cancelling {len(orders)} {market_name} orders: {[o.order_id for o in orders]}")
+                cancelled = cancel_orders(auth_client, orders, market_name=market_name)
+                metrics.inc("btfd_api_calls_saved_total", len(orders) - 2, market=market_name, reason="batch_cancel")
+                return cancelled
+            print(f"Other {market_name} orders are open; cancelling one at a time")
+            metrics.inc("btfd_batch_cancel_fallbacks_total", market=market_name)
+
+        return cancel_orders(auth_client, orders)
+
+    @staticmethod
+    def _only_open_orders(auth_client, market_name, orders):
+        """ True if `orders` are exactly the exchange's open orders for the market """
+        open_ids = set()
+        for order_json in auth_client.get_orders(product_id=market_name, status=["open", "pending"]):
+            if not isinstance(order_json, dict) or "id" not in order_json:
+                # Couldn't tell; play it safe
+                print(f"Could not retrieve open {market_name} orders: {order_json}")
+                return False
+            open_ids.add(order_json["id"])
+        return open_ids == {order.order_id for order in orders}
+
+
+def load_reprice_policy(config, section='reprice', defaults=None, prefix=''):
+    """
+        Reads a RepricePolicy from the settings.conf ConfigParser:
+
+            [reprice]
+            MIN_MOVE = 0.5          (percent)
+            MIN_INTERVAL = 900      (secs)
+            BATCH_CANCEL = false
+
+        A [strategy:<name>] section can override these with reprice_min_move,
+            reprice_min_interval, and reprice_batch_cancel (prefix='reprice_').
+    """
+    defaults = defaults or RepricePolicy()
+    if not config.has_section(section):
+        return defaults
+    return RepricePolicy(
+        min_move=config.get(section, f'{prefix}MIN_MOVE', fallback=str(defaults.min_move)),
+        min_interval=config.getint(section, f'{prefix}MIN_INTERVAL', fallback=defaults.min_interval),
+        batch_cancel=config.getboolean(section, f'{prefix}BATCH_CANCEL', fallback=defaults.batch_cancel),
+    )
+
+
+
+# Used when no policy is passed in: re-price on any improvement, like before
+default_reprice_policy = RepricePolicy()
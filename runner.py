@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+import argparse
+import configparser
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import models
+
+from btfd_bot import create_clients, get_timestamp, run_batch
+from caches import balance_cache, product_cache
+from journal import recover_intents
+from metrics import InstrumentedClient, metrics
+from models import acquire_lease, create_tables, db, release_lease
+from notifications import create_notifier
+from profiles import load_profiles
+from strategies import load_strategies
+
+
+"""
+    Runs the strategies of every [profile:<name>] account (see profiles.py) in
+        --daemon style, with each profile isolated in its own worker process. A
+        slow or failing account can't stall the others.
+
+    Each worker keeps the profile's API clients (one pooled HTTP session), notifier,
+        and db connection for as long as it runs.
+
+    Profiles are claimed through leases in a shared sqlite db (-lease_db), so several
+        runners (e.g. one per host, with the lease db on shared storage) split the
+        profiles between them. A runner that dies stops renewing its leases, and
+        its profiles are picked up by the others once the leases expire.
+
+    ex:
+        python runner.py
+        python runner.py -max_profiles 4 -lease_db /mnt/shared/leases.db
+"""
+parser = argparse.ArgumentParser(
+    description="Run every [profile:<name>] account's strategies in isolated worker processes",
+    formatter_class=argparse.RawTextHelpFormatter
+)
+
+parser.add_argument('-c',
+                    default="settings.conf",
+                    dest="config_file",
+                    help="Override default config file location")
+
+parser.add_argument('-profiles',
+                    nargs="*",
+                    default=None,
+                    dest="profiles",
+                    help="Only run these profiles (default: every [profile:<name>] section)")
+
+parser.add_argument('-max_profiles',
+                    default=None,
+                    type=int,
+                    dest="max_profiles",
+                    help="Max profiles this runner will claim (default: all of them)")
+
+parser.add_argument('-lease_db',
+                    default="leases.db",
+                    dest="lease_db",
+                    help="sqlite db shared by every runner for profile leases")
+
+parser.add_argument('-lease_ttl',
+                    default=60,
+                    type=int,
+                    dest="lease_ttl",
+                    help="Secs a lease lasts without being renewed")
+
+parser.add_argument('-pool_size',
+                    default=4,
+                    type=int,
+                    dest="pool_size",
+                    help="HTTP connections kept open per profile")
+
+parser.add_argument('-candle_dir',
+                    default=None,
+                    dest="candle_dir",
+                    help="Local candle cache; each profile gets its own subdir")
+
+parser.add_argument('-metrics_dir',
+                    default=None,
+                    dest="metrics_dir",
+                    help="Write each profile's metrics to <dir>/<profile>.prom after every batch")
+
+
+
+# ---------------------------------------------------------------- worker process
+# Everything a worker needs between batches; set up once by init_worker
+_worker = {}
+
+
+def init_worker(config_file, profile_name, pool_size, candle_dir, metrics_dir):
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    profile = next(p for p in load_profiles(config) if p.name == profile_name)
+
+    product_cache.ttl = config.getint('cache', 'PRODUCT_TTL', fallback=product_cache.ttl)
+    balance_cache.ttl = config.getint('cache', 'BALANCE_TTL', fallback=balance_cache.ttl)
+    models.RAW_DATA_SIDE_TABLE = config.getboolean('database', 'RAW_DATA_SIDE_TABLE', fallback=False)
+
+    db.init(profile.database, pragmas=models.PRAGMAS, timeout=10)
+    create_tables()
+    db.connect(reuse_if_open=True)
+
+    auth_client, public_client = create_clients(config, profile.section, profile.sandbox,
+                                                pool_size=pool_size)
+    auth_client = InstrumentedClient(auth_client)
+    public_client = InstrumentedClient(public_client)
+
+    # Sort out anything a previous worker left half-done (see journal.py)
+    recover_intents(auth_client)
+
+    strategies = load_strategies(config, profile=profile.name)
+    _worker.update({
+        "profile": profile,
+        "auth_client": auth_client,
+        "public_client": public_client,
+        "notifier": create_notifier(config, profile.section),
+        "strategies": strategies,
+        "next_run": {s.name: 0 for s in strategies},
+        "candle_dir": os.path.join(candle_dir, profile.name) if candle_dir else None,
+        "metrics_file": os.path.join(metrics_dir, f"{profile.name}.prom") if metrics_dir else None,
+    })
+    print("%s: WORKER STARTED: %s %s" % (get_timestamp(), profile, strategies))
+
+
+def run_due():
+    """ Runs whichever of the profile's strategies are due; returns when the next one is """
+    next_run = _worker["next_run"]
+    now = time.time()
+    due = [s for s in _worker["strategies"] if next_run[s.name] <= now]
+    if due:
+        run_batch(_worker["auth_client"], _worker["public_client"], _worker["notifier"],
+                  _worker["strategies"], due, candle_dir=_worker["candle_dir"])
+        for strategy in due:
+            next_run[strategy.name] = max(next_run[strategy.name] + strategy.interval,
+                                          time.time())
+        if _worker["metrics_file"]:
+            metrics.export(_worker["metrics_file"])
+    return min(next_run.values()) if next_run else time.time() + 60
+
+
+def close_worker():
+    _worker["notifier"].close()
+    db.close()
+
+
+
+# ---------------------------------------------------------------- runner
+class ProfileWorker(object):
+    """
+        The runner's handle on one claimed profile's single-process pool. A worker
+            that dies is restarted with exponential backoff; after MAX_FAILURES in
+            a row with no successful run (e.g. init_worker fails on a profile with
+            no API_KEY) it's given up on.
+    """
+    RESTART_DELAY = 5
+    MAX_RESTART_DELAY = 300
+    MAX_FAILURES = 5
+
+    def __init__(self, profile, args):
+        self.profile = profile
+        self.args = args
+        self.executor = None
+        self.future = None
+        self.next_run = 0
+        self.lease_expires = 0
+        self.failures = 0
+        self.failed = False
+        self.start()
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=1,
+            # Fresh interpreter: no inherited sqlite connections or client sessions
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.args.config_file, self.profile.name, self.args.pool_size,
+                      self.args.candle_dir, self.args.metrics_dir)
+        )
+        self.future = None
+        self.next_run = 0
+
+    def poll(self, now):
+        if self.future is not None and self.future.done():
+            try:
+                self.next_run = self.future.result()
+                self.failures = 0
+            except BrokenProcessPool:
+                self.executor.shutdown(wait=False)
+                self.failures += 1
+                if self.failures >= self.MAX_FAILURES:
+                    print("%s: WORKER FAILED %d times in a row: %s; giving up" % (
+                        get_timestamp(), self.failures, self.profile.name))
+                    self.failed = True
+                else:
+                    delay = min(self.RESTART_DELAY * 2 ** (self.failures - 1), self.MAX_RESTART_DELAY)
+                    print("%s: WORKER DIED: %s; restarting in %ds" % (get_timestamp(), self.profile.name, delay))
+                    self.start()
+                    self.next_run = now + delay
+            except Exception:
+                traceback.print_exc()
+                self.next_run = now + 60
+            self.future = None
+
+        if self.failed:
+            return
+        if self.future is None and self.next_run <= now:
+            self.future = self.executor.submit(run_due)
+
+    def stop(self, timeout=30):
+        if self.failed:
+            # Its pool is already shut down
+            return
+        try:
+            if self.future is not None:
+                self.future.result(timeout)
+            self.executor.submit(close_worker).result(timeout)
+        except Exception:
+            traceback.print_exc()
+        self.executor.shutdown(wait=False)
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    print("%s: STARTED: %s" % (get_timestamp(), args))
+
+    config = configparser.ConfigParser()
+    config.read(args.config_file)
+    profiles = [p for p in load_profiles(config) if args.profiles is None or p.name in args.profiles]
+    if not profiles:
+        raise Exception(f"No [profile:<name>] sections found in {args.config_file}")
+
+    db.init(args.lease_db, pragmas=models.PRAGMAS, timeout=10)
+    db.connect()
+    db.create_tables([models.Lease])
+
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    max_profiles = args.max_profiles or len(profiles)
+    workers = {}
+    try:
+        while True:
+            now = time.time()
+            for profile in profiles:
+                worker = workers.get(profile.name)
+                if worker is None and len(workers) >= max_profiles:
+                    continue
+                if worker is None or worker.lease_expires - now < args.lease_ttl / 2:
+                    # Claim or renew
+                    if acquire_lease(profile.name, owner, args.lease_ttl):
+                        if worker is None:
+                            print("%s: CLAIMED: %s" % (get_timestamp(), profile))
+                            worker = workers[profile.name] = ProfileWorker(profile, args)
+                        worker.lease_expires = now + args.lease_ttl
+                    elif worker is not None:
+                        print("%s: LOST LEASE: %s" % (get_timestamp(), profile.name))
+                        worker.stop()
+                        del workers[profile.name]
+                        continue
+
+                if worker is not None:
+                    worker.poll(now)
+
+            time.sleep(1)
+
+    except KeyboardInterrupt:
+        print("%s: STOPPING" % get_timestamp())
+
+    finally:
+        for name, worker in workers.items():
+            worker.stop()
+            release_lease(name, owner)
+        db.close()
@@ -0,0 +1,307 @@
+import math
+
+from collections import deque
+from decimal import Decimal
+
+from models import SignalState
+
+
+
+class RollingExtremes(object):
+    """
+        High and low of the candles in the last `window` secs. Same monotonic deque
+            trick as ExtremeTracker: amortized O(1) per candle, and the answer is
+            always the front entry.
+    """
+    def __init__(self, window, highs=None, lows=None):
+        self.window = window
+        self.highs = deque(tuple(e) for e in (highs or []))
+        self.lows = deque(tuple(e) for e in (lows or []))
+
+    def add(self, ts, high, low):
+        while self.highs and self.highs[-1][1] <= high:
+            self.highs.pop()
+        self.highs.append((ts, high))
+        while self.lows and self.lows[-1][1] >= low:
+            self.lows.pop()
+        self.lows.append((ts, low))
+
+        cutoff = ts - self.window
+        while self.highs[0][0] <= cutoff:
+            self.highs.popleft()
+        while self.lows[0][0] <= cutoff:
+            self.lows.popleft()
+
+    def high(self):
+        return self.highs[0][1] if self.highs else None
+
+    def low(self):
+        return self.lows[0][1] if self.lows else None
+
+
+
+class AverageTrueRange(object):
+    """
+        Wilder's ATR over `period` candles, seeded with the plain average of the
+            first `period` true ranges. None until then.
+    """
+    def __init__(self, period=14, value=None, count=0, total=0.0, prev_close=None):
+        self.period = period
+        self.value = value
+        self.count = count
+        self.total = total
+        self.prev_close = prev_close
+
+    def add(self, high, low, close):
+        true_range = high - low
+        if self.prev_close is not None:
+            true_range = max(true_range, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+
+        if self.count < self.period:
+            self.count += 1
+            self.total += true_range
+            if self.count == self.period:
+                self.value = self.total / self.period
+        else:
+            self.value = (self.value * (self.period - 1) + true_range) / self.period
+
+
+
+class RollingVolatility(object):
+    """
+        Std dev of the close-to-close log returns of the last `period` candles. Running
+            sums make each update O(1). None until there are `period` returns.
+    """
+    def __init__(self, period=20, returns=None, prev_close=None):
+        self.period = period
+        self.returns = deque(returns or [])
+        self.prev_close = prev_close
+        # Re-summed on load so float error can't build up across runs
+        self.total = sum(self.returns)
+        self.total_sq = sum(r * r for r in self.returns)
+
+    def add(self, close):
+        if self.prev_close and close > 0:
+            r = math.log(close / self.prev_close)
+            self.returns.append(r)
+            self.total += r
+            self.total_sq += r * r
+            if len(self.returns) > self.period:
+                old = self.returns.popleft()
+                self.total -= old
+                self.total_sq -= old * old
+        self.prev_close = close
+
+    @property
+    def value(self):
+        n = len(self.returns)
+        if n < self.period or n < 2:
+            return None
+        mean = self.total / n
+        return math.sqrt(max(0.0, (self.total_sq - n * mean * mean) / (n - 1)))
+
+
+
+class CandleAggregator(object):
+    """
+        Rolls minute candles up into `granularity` candles, same layout:
+
+            [ time, low, high, open, close, volume ]
+
+        add() returns the finished candle once a candle from the next bucket arrives.
+    """
+    def __init__(self, granularity, current=None):
+        self.granularity = granularity
+        self.current = current
+
+    def add(self, candle):
+        bucket = candle[0] - candle[0] % self.granularity
+        current = self.current
+        if current and current[0] == bucket:
+            current[1] = min(current[1], candle[1])
+            current[2] = max(current[2], candle[2])
+            current[4] = candle[4]
+            current[5] += candle[5]
+            return None
+        self.current = [bucket, candle[1], candle[2], candle[3], candle[4], candle[5]]
+        return current
+
+
+
+class MarketSignals(object):
+    """
+        Rolling indicators for one market, updated incrementally (O(1) per new minute
+            candle) so they stay cheap across many markets:
+
+            * high/low over each of WINDOWS (secs)
+            * ATR and close-to-close volatility on each of GRANULARITIES; the 5m, 1h,
+                and 1d candles are built from the minute candles, not fetched
+
+        Only closed minute candles are used. The newest candle of a
+            get_product_historic_rates result is still open, so it's picked up on
+            the next run instead. The state is persisted between runs
+            (load_signals/save_signals), so the longer granularities warm up over
+            time.
+    """
+    GRANULARITIES = [60, 300, 3600, 86400]
+    WINDOWS = [3600, 4 * 3600, 86400]
+
+    def __init__(self, atr_period=14, volatility_period=20, last_ts=0):
+        self.atr_period = atr_period
+        self.volatility_period = volatility_period
+        self.last_ts = last_ts
+        self.extremes = {w: RollingExtremes(w) for w in self.WINDOWS}
+        self.aggregators = {g: CandleAggregator(g) for g in self.GRANULARITIES if g != 60}
+        self.atrs = {g: AverageTrueRange(atr_period) for g in self.GRANULARITIES}
+        self.volatilities = {g: RollingVolatility(volatility_period) for g in self.GRANULARITIES}
+
+    def add_candle(self, candle):
+        """ One closed minute candle: [ time, low, high, open, close, volume ] """
+        ts, low, high = candle[0], candle[1], candle[2]
+        self.last_ts = ts
+        for extremes in self.extremes.values():
+            extremes.add(ts, high, low)
+        self._add(60, candle)
+        for granularity, aggregator in self.aggregators.items():
+            finished = aggregator.add(candle)
+            if finished:
+                self._add(granularity, finished)
+
+    def _add(self, granularity, candle):
+        self.atrs[granularity].add(candle[2], candle[1], candle[4])
+        self.volatilities[granularity].add(candle[4])
+
+    def absorb(self, market_data):
+        """
+            Adds the closed candles we haven't seen yet from a newest-first
+                get_product_historic_rates result. Returns how many were added.
+        """
+        new_candles = []
+        for candle in market_data[1:]:
+            if candle[0] <= self.last_ts:
+                break
+            new_candles.append(candle)
+        for candle in reversed(new_candles):
+            self.add_candle(candle)
+        return len(new_candles)
+
+    def high(self, window):
+        return self.extremes[window].high()
+
+    def low(self, window):
+        return self.extremes[window].low()
+
+    def atr(self, granularity):
+        return self.atrs[granularity].value
+
+    def volatility(self, granularity):
+        return self.volatilities[granularity].value
+
+    def to_json(self):
+        return {
+            "atr_period": self.atr_period,
+            "volatility_period": self.volatility_period,
+            "extremes": {str(w): [list(map(list, e.highs)), list(map(list, e.lows))]
+                         for w, e in self.extremes.items()},
+            "aggregators": {str(g): a.current for g, a in self.aggregators.items()},
+            "atrs": {str(g): [a.value, a.count, a.total, a.prev_close] for g, a in self.atrs.items()},
+            "volatilities": {str(g): [list(v.returns), v.prev_close] for g, v in self.volatilities.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data, last_ts):
+        signals = cls(data["atr_period"], data["volatility_period"], last_ts)
+        for w, (highs, lows) in data["extremes"].items():
+            if int(w) in signals.extremes:
+                signals.extremes[int(w)] = RollingExtremes(int(w), highs, lows)
+        for g, current in data["aggregators"].items():
+            if int(g) in signals.aggregators:
+                signals.aggregators[int(g)].current = current
+        for g, (value, count, total, prev_close) in data["atrs"].items():
+            if int(g) in signals.atrs:
+                signals.atrs[int(g)] = AverageTrueRange(signals.atr_period, value, count, total, prev_close)
+        for g, (returns, prev_close) in data["volatilities"].items():
+            if int(g) in signals.volatilities:
+                signals.volatilities[int(g)] = RollingVolatility(signals.volatility_period, returns, prev_close)
+        return signals
+
+
+
+class VolatilityTarget(object):
+    """
+        Scales a strategy's percent_diff with the market's volatility: the target is
+            `atr_multiple` ATRs (on `granularity` candles) from the recent extreme,
+            but never closer than the strategy's own percent_diff, and never further
+            than `max_percent_diff` if set. A BUY is never scaled past
+            MAX_BUY_PERCENT_DIFF (a -100% target would be a zero price).
+
+        Until there are enough candles for the ATR, the plain percent_diff is used.
+    """
+    MAX_BUY_PERCENT_DIFF = Decimal("90")
+
+    def __init__(self, atr_multiple, granularity=3600, max_percent_diff=None):
+        self.atr_multiple = Decimal(atr_multiple)
+        self.granularity = int(granularity)
+        self.max_percent_diff = abs(Decimal(max_percent_diff)) if max_percent_diff is not None else None
+        if self.granularity not in MarketSignals.GRANULARITIES:
+            raise Exception(f"atr_granularity must be one of {MarketSignals.GRANULARITIES}")
+
+    def __repr__(self):
+        return (f"VolatilityTarget({self.atr_multiple} x ATR({self.granularity}s), "
+                f"max {self.max_percent_diff}%)")
+
+    def percent_diff(self, percent_diff, signals, recent_extreme):
+        """ percent_diff (same sign) for a `recent_extreme` price (Decimal) """
+        atr = signals.atr(self.granularity)
+        if atr is None or not recent_extreme:
+            print(f"Not enough candles yet for ATR({self.granularity}s); using percent_diff {percent_diff}%")
+            return percent_diff
+
+        atr_percent = Decimal(repr(atr)) / recent_extreme * Decimal('100')
+        scaled = max(abs(percent_diff), self.atr_multiple * atr_percent)
+        if self.max_percent_diff is not None:
+            scaled = min(scaled, self.max_percent_diff)
+        if percent_diff < 0 and scaled > self.MAX_BUY_PERCENT_DIFF:
+            scaled = max(abs(percent_diff), self.MAX_BUY_PERCENT_DIFF)
+        scaled = scaled.quantize(Decimal('0.01'))
+        print(f"ATR({self.granularity}s): {atr_percent.quantize(Decimal('0.001'))}% -> percent_diff {'-' if percent_diff < 0 else ''}{scaled}%")
+        return -scaled if percent_diff < 0 else scaled
+
+
+def load_volatility_target(config, section):
+    """
+        A VolatilityTarget from a settings.conf section, or None if it has no
+            atr_multiple:
+
+            atr_multiple = 3            (target is 3 ATRs from the recent extreme...)
+            atr_granularity = 3600      (...on 1h candles; 60, 300, 3600, or 86400)
+            max_percent_diff = 25       (optional cap)
+    """
+    atr_multiple = config.get(section, 'atr_multiple', fallback=None)
+    if not atr_multiple:
+        return None
+    return VolatilityTarget(
+        atr_multiple,
+        granularity=config.getint(section, 'atr_granularity', fallback=3600),
+        max_percent_diff=config.get(section, 'max_percent_diff', fallback=None),
+    )
+
+
+
+def load_signals(market_name):
+    state = SignalState.get_or_none(market_name=market_name)
+    if not state:
+        return MarketSignals()
+    return MarketSignals.from_json(state.data, state.last_ts)
+
+
+def save_signals(market_name, signals):
+    SignalState.insert(
+        market_name=market_name,
+        last_ts=signals.last_ts,
+        data=signals.to_json()
+    ).on_conflict(
+        conflict_target=[SignalState.market_name],
+        preserve=[SignalState.last_ts, SignalState.data]
+    ).execute()
@@ -0,0 +1,585 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import datetime
+import io
+import random
+import statistics
+import threading
+import time
+import uuid
+
+from decimal import Decimal
+
+
+
+"""
+    In-process stand-in for Coinbase Pro that implements the subset of the cbpro
+        PublicClient/AuthenticatedClient interface the bot uses. Limit orders are
+        matched against replayed (or generated) minute candles, and latency, rate
+        limit errors, "Post only mode", and rejected orders can be injected.
+
+    Run it directly for an offline load test of many strategies:
+
+        simulator.py -strategies 200 -markets 20 -cycles 50
+
+    Add --check to use it as a smoke test: it exits with an error if no orders were
+        placed, a strategy failed (with no injected faults), or a batch made more
+        API calls than it should.
+"""
+
+
+
+def generate_candles(count, start_price=100.0, volatility=0.002, start_time=0, granularity=60,
+                     seed=None):
+    """ Random walk minute candles, oldest first: [ time, low, high, open, close, volume ] """
+    rng = random.Random(seed)
+    candles = []
+    price = start_price
+    for i in range(count):
+        open_price = price
+        close_price = open_price * (1 + rng.gauss(0, volatility))
+        high = max(open_price, close_price) * (1 + abs(rng.gauss(0, volatility / 2)))
+        low = min(open_price, close_price) * (1 - abs(rng.gauss(0, volatility / 2)))
+        candles.append([start_time + i * granularity, low, high, open_price, close_price,
+                        rng.uniform(0.1, 10)])
+        price = close_price
+    return candles
+
+
+def _iso(ts):
+    return datetime.datetime.utcfromtimestamp(ts).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _parse_ts(value):
+    if value is None:
+        return None
+    return datetime.datetime.fromisoformat(value.rstrip("Z")).replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+
+class SimulatedExchange(object):
+    """
+        Pass the same instance as both the auth_client and the public_client.
+
+        `candles` is {market_name: [candles oldest first]}. The simulated clock
+            starts `warmup` candles in (so there's history to look back on) and is
+            moved forward a minute at a time with advance(); with `speed` set it
+            instead follows the wall clock (e.g. speed=60 replays a minute candle
+            every second).
+    """
+    def __init__(self, candles, balances=None, quote_increment="0.01", base_increment="0.00000001",
+                 base_min_size="0.0001", warmup=300, speed=None, latency=0.0,
+                 rate_limit_rate=0.0, post_only_rate=0.0, reject_rate=0.0, seed=None):
+        self.candles = candles
+        self.granularity = 60
+        self.cursor = {m: min(warmup, len(c) - 1) for m, c in candles.items()}
+        self.clock = max(c[self.cursor[m]][0] for m, c in candles.items())
+        self.end_time = max(c[-1][0] for c in candles.values())
+        self.speed = speed
+        self.wall_start = time.time()
+        self.clock_start = self.clock
+
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.post_only_rate = post_only_rate
+        self.reject_rate = reject_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+
+        self.products = {}
+        self.balances = {}
+        for market_name in candles:
+            base_currency, quote_currency = market_name.split("-")
+            self.products[market_name] = {
+                "id": market_name,
+                "base_currency": base_currency,
+                "quote_currency": quote_currency,
+                "base_min_size": base_min_size,
+                "base_increment": base_increment,
+                "quote_increment": quote_increment,
+                "status": "online",
+            }
+            for currency in [base_currency, quote_currency]:
+                self.balances[currency] = Decimal((balances or {}).get(currency, "1000000"))
+        self.holds = {currency: Decimal("0") for currency in self.balances}
+
+        self.orders = {}
+        self.fills = []
+        self.call_count = 0
+        self.error_count = 0
+
+    # ---------------------------------------------------------------- clock
+    def now(self):
+        if self.speed:
+            # Follow the wall clock
+            target = self.clock_start + (time.time() - self.wall_start) * self.speed
+            while self.clock + self.granularity <= target and self._step():
+                pass
+        return self.clock
+
+    def _step(self):
+        if self.clock >= self.end_time:
+            return False
+        self.clock += self.granularity
+        for market_name, candles in self.candles.items():
+            # Markets with no trades in a minute have no candle for it
+            while self.cursor[market_name] < len(candles) - 1 and \
+                    candles[self.cursor[market_name] + 1][0] <= self.clock:
+                self.cursor[market_name] += 1
+                self._match(market_name, candles[self.cursor[market_name]])
+        return True
+
+    def advance(self, candles=1):
+        """ Move the simulated clock forward, matching open orders against each new candle """
+        with self.lock:
+            for i in range(candles):
+                if not self._step():
+                    return False
+        return True
+
+    def _current_candle(self, market_name):
+        return self.candles[market_name][self.cursor[market_name]]
+
+    def _current_price(self, market_name):
+        return Decimal(str(self._current_candle(market_name)[4]))
+
+    # ---------------------------------------------------------------- fault injection
+    def _request(self, private=False):
+        """ Returns an error response to inject (or None) """
+        self.call_count += 1
+        if self.latency:
+            time.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+        if self.rate_limit_rate and self.rng.random() < self.rate_limit_rate:
+            self.error_count += 1
+            return {"message": "Private rate limit exceeded" if private else "Public rate limit exceeded"}
+        return None
+
+    # ---------------------------------------------------------------- matching
+    def _match(self, market_name, candle):
+        for order in list(self.orders.values()):
+            if order["product_id"] != market_name or order["status"] != "open":
+                continue
+            price = Decimal(order["price"])
+            if (order["side"] == "buy" and Decimal(str(candle[1])) <= price) or \
+                    (order["side"] == "sell" and Decimal(str(candle[2])) >= price):
+                self._fill(order, price, candle[0])
+
+    def _fill(self, order, price, ts, liquidity="M"):
+        base_currency, quote_currency = order["product_id"].split("-")
+        size = Decimal(order["size"])
+        value = price * size
+        fee = value * Decimal("0.005")
+        if order["side"] == "buy":
+            self.holds[quote_currency] -= Decimal(order["price"]) * size
+            self.balances[quote_currency] -= value + fee
+            self.balances[base_currency] += size
+        else:
+            self.holds[base_currency] -= size
+            self.balances[base_currency] -= size
+            self.balances[quote_currency] += value - fee
+
+        order.update({
+            "status": "done",
+            "done_at": _iso(ts + self.granularity - 1),
+            "done_reason": "filled",
+            "filled_size": str(size),
+            "executed_value": str(value),
+            "fill_fees": str(fee),
+            "settled": True,
+        })
+        self.fills.append({
+            "trade_id": len(self.fills) + 1,
+            "order_id": order["id"],
+            "product_id": order["product_id"],
+            "price": str(price),
+            "size": str(size),
+            "fee": str(fee),
+            "side": order["side"],
+            "liquidity": liquidity,
+            "created_at": order["done_at"],
+            "settled": True,
+        })
+
+    # ---------------------------------------------------------------- PublicClient
+    def get_products(self):
+        error = self._request()
+        if error:
+            return error
+        return [dict(p) for p in self.products.values()]
+
+    def get_product_historic_rates(self, product_id, start=None, end=None, granularity=None):
+        error = self._request()
+        if error:
+            return error
+        with self.lock:
+            self.now()
+            candles = self.candles[product_id][:self.cursor[product_id] + 1]
+            start, end = _parse_ts(start), _parse_ts(end)
+            if start is not None:
+                candles = [c for c in candles if c[0] >= start]
+            if end is not None:
+                candles = [c for c in candles if c[0] <= end]
+            return [list(c) for c in reversed(candles[-300:])]
+
+    def get_product_24hr_stats(self, product_id):
+        error = self._request()
+        if error:
+            return error
+        with self.lock:
+            self.now()
+            cursor = self.cursor[product_id]
+            day = self.candles[product_id][max(0, cursor - 1439):cursor + 1]
+            return {
+                "open": str(day[0][3]),
+                "high": str(max(c[2] for c in day)),
+                "low": str(min(c[1] for c in day)),
+                "volume": str(sum(c[5] for c in day)),
+                "last": str(day[-1][4]),
+            }
+
+    # ---------------------------------------------------------------- AuthenticatedClient
+    def get_accounts(self):
+        error = self._request(private=True)
+        if error:
+            return error
+        with self.lock:
+            return [{
+                "id": currency,
+                "currency": currency,
+                "balance": str(balance),
+                "hold": str(self.holds[currency]),
+                "available": str(balance - self.holds[currency]),
+                "profile_id": "simulator",
+                "trading_enabled": True,
+            } for currency, balance in self.balances.items()]
+
+    def place_limit_order(self, product_id, side, price, size, client_oid=None, post_only=False,
+                          **kwargs):
+        error = self._request(private=True)
+        if error:
+            return error
+        with self.lock:
+            now = self.now()
+            if self.post_only_rate and self.rng.random() < self.post_only_rate:
+                return {"message": "Post only mode"}
+
+            price = Decimal(str(price))
+            size = Decimal(str(size))
+            order = {
+                "id": str(uuid.uuid4()),
+                "price": str(price),
+                "size": str(size),
+                "product_id": product_id,
+                "profile_id": "simulator",
+                "side": side,
+                "type": "limit",
+                "time_in_force": "GTC",
+                "post_only": post_only,
+                "created_at": _iso(now),
+                "fill_fees": "0",
+                "filled_size": "0",
+                "executed_value": "0",
+                "status": "open",
+                "settled": False,
+            }
+            if client_oid:
+                order["client_oid"] = client_oid
+
+            current_price = self._current_price(product_id)
+            crosses = (side == "buy" and price >= current_price) or \
+                (side == "sell" and price <= current_price)
+            if (self.reject_rate and self.rng.random() < self.reject_rate) or (crosses and post_only):
+                order["status"] = "rejected"
+                order["reject_reason"] = "post only"
+                self.orders[order["id"]] = order
+                return dict(order)
+
+            base_currency, quote_currency = product_id.split("-")
+            if side == "buy":
+                self.holds[quote_currency] += price * size
+            else:
+                self.holds[base_currency] += size
+            self.orders[order["id"]] = order
+
+            if crosses:
+                # Taker fill at the current price
+                self._fill(order, current_price, now, liquidity="T")
+            return dict(order)
+
+    def get_order(self, order_id):
+        error = self._request(private=True)
+        if error:
+            return error
+        with self.lock:
+            self.now()
+            if order_id.startswith("client:"):
+                client_oid = order_id[len("client:"):]
+                order = next((o for o in self.orders.values() if o.get("client_oid") == client_oid), None)
+            else:
+                order = self.orders.get(order_id)
+            if not order or order["status"] == "cancelled":
+                return {"message": "NotFound"}
+            return dict(order)
+
+    def get_orders(self, product_id=None, status=None, **kwargs):
+        error = self._request(private=True)
+        if error:
+            # cbpro's paginated generator iterates the error dict
+            yield from error
+            return
+        if isinstance(status, str):
+            status = [status]
+        with self.lock:
+            self.now()
+            orders = sorted(self.orders.values(), key=lambda o: o["created_at"], reverse=True)
+            orders = [dict(o) for o in orders
+                      if (product_id is None or o["product_id"] == product_id)
+                      and (status is None or "all" in status or o["status"] in status)]
+        yield from orders
+
+    def get_fills(self, product_id=None, order_id=None, **kwargs):
+        error = self._request(private=True)
+        if error:
+            yield from error
+            return
+        with self.lock:
+            fills = [dict(f) for f in reversed(self.fills)
+                     if (product_id is None or f["product_id"] == product_id)
+                     and (order_id is None or f["order_id"] == order_id)]
+        yield from fills
+
+    def _cancel(self, order):
+        base_currency, quote_currency = order["product_id"].split("-")
+        if order["side"] == "buy":
+            self.holds[quote_currency] -= Decimal(order["price"]) * Decimal(order["size"])
+        else:
+            self.holds[base_currency] -= Decimal(order["size"])
+        order["status"] = "cancelled"
+
+    def cancel_order(self, order_id):
+        error = self._request(private=True)
+        if error:
+            return error
+        with self.lock:
+            order = self.orders.get(order_id)
+            if not order or order["status"] == "cancelled":
+                return {"message": "NotFound"}
+            if order["status"] != "open":
+                return {"message": "Order already done"}
+            self._cancel(order)
+            return [order_id]
+
+    def cancel_all(self, product_id=None):
+        error = self._request(private=True)
+        if error:
+            return error
+        with self.lock:
+            cancelled = []
+            for order in self.orders.values():
+                if order["status"] == "open" and product_id in [None, order["product_id"]]:
+                    self._cancel(order)
+                    cancelled.append(order["id"])
+            return cancelled
+
+
+
+def load_candles(market_names, candle_dir=None, count=10000, seed=None):
+    """ Replay cached CandleStore candles if available, otherwise generate them """
+    candles = {}
+    for i, market_name in enumerate(market_names):
+        if candle_dir:
+            from candle_store import CandleStore
+            store = CandleStore(candle_dir, market_name, granularity=60)
+            candles[market_name] = store.market_data(limit=count)[::-1]
+        else:
+            candles[market_name] = generate_candles(
+                count,
+                start_price=random.Random(i).uniform(1, 50000),
+                start_time=1600000000,
+                seed=None if seed is None else seed + i)
+    return candles
+
+
+
+parser = argparse.ArgumentParser(
+    description="Offline load test: run many strategies against the SimulatedExchange",
+    formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument('-strategies', default=100, type=int, dest="num_strategies")
+parser.add_argument('-markets', default=10, type=int, dest="num_markets")
+parser.add_argument('-cycles', default=20, type=int, dest="cycles")
+parser.add_argument('-candles_per_cycle', default=5, type=int, dest="candles_per_cycle",
+                    help="Simulated minutes between cycles")
+parser.add_argument('-candle_dir', default=None, dest="candle_dir",
+                    help="Replay these CandleStore markets instead of generated candles")
+parser.add_argument('-market_names', nargs="*", default=None, dest="market_names")
+parser.add_argument('-latency', default=0.0, type=float, dest="latency",
+                    help="Avg secs of injected latency per API call")
+parser.add_argument('-rate_limit_rate', default=0.0, type=float, dest="rate_limit_rate")
+parser.add_argument('-post_only_rate', default=0.0, type=float, dest="post_only_rate")
+parser.add_argument('-reject_rate', default=0.0, type=float, dest="reject_rate")
+parser.add_argument('-min_move', default="0", dest="min_move",
+                    help="RepricePolicy min_move percent (see reprice.py)")
+parser.add_argument('-ladder', nargs="*", default=None, dest="ladder",
+                    help="Extra percent_diff tiers (sign follows each strategy's side)")
+parser.add_argument('--batch_cancel', action="store_true", default=False, dest="batch_cancel")
+parser.add_argument('-db', default=":memory:", dest="database")
+parser.add_argument('-seed', default=1, type=int, dest="seed")
+parser.add_argument('-metrics', default=None, dest="metrics_file",
+                    help="Export per-stage timings here (*.prom = Prometheus text, else JSON lines)")
+parser.add_argument('--verbose', action="store_true", default=False, dest="verbose")
+parser.add_argument('--check', action="store_true", default=False, dest="check",
+                    help="Smoke test: exit with an error if no orders were placed, a strategy\n"
+                         "failed, or a batch made more API calls than it should")
+
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    import models
+    from btfd_bot import run_batch
+    from metrics import InstrumentedClient, metrics
+    from notifications import NotificationBackend, Notifier
+    from reprice import RepricePolicy
+    from strategies import Strategy
+
+    class CountingBackend(NotificationBackend):
+        def __init__(self):
+            self.sent = 0
+
+        def send(self, subject, message):
+            self.sent += 1
+
+    models.db.init(args.database, pragmas=models.PRAGMAS, timeout=10)
+    # Connect first so the (default) ":memory:" db outlives create_tables()
+    models.db.connect()
+    models.create_tables()
+
+    market_names = args.market_names or [f"SIM{i}-USD" for i in range(args.num_markets)]
+    exchange = SimulatedExchange(
+        load_candles(market_names, args.candle_dir,
+                     count=300 + args.cycles * args.candles_per_cycle, seed=args.seed),
+        latency=args.latency,
+        rate_limit_rate=args.rate_limit_rate,
+        post_only_rate=args.post_only_rate,
+        reject_rate=args.reject_rate,
+        seed=args.seed
+    )
+
+    client = InstrumentedClient(exchange)
+
+    policy = RepricePolicy(min_move=args.min_move, batch_cancel=args.batch_cancel)
+
+    rng = random.Random(args.seed)
+    strategies = []
+    for i in range(args.num_strategies):
+        market_name = market_names[i % len(market_names)]
+        buy = i % 2 == 0
+        sign = -1 if buy else 1
+        strategies.append(Strategy(
+            name=f"sim{i}",
+            market_name=market_name,
+            order_side="BUY" if buy else "SELL",
+            amount=Decimal("10"),
+            amount_currency="USD",
+            percent_diff=Decimal(str(round(rng.uniform(0.5, 5.0), 1))) * sign,
+            ladder=[abs(Decimal(p)) * sign for p in args.ladder or []],
+            reprice_policy=policy,
+        ))
+    # The bot tracks one order per market/side
+    strategies = list({(s.market_name, s.order_side): s for s in strategies}.values())
+
+    backend = CountingBackend()
+    notifier = Notifier(backend, digest_window=0)
+
+    def api_calls(call):
+        return metrics.counters.get(("btfd_api_calls_total", (("call", call),)), 0)
+
+    def cancels():
+        # Each cancelled order gets a final get_order for its fills (see journal.cancel_orders)
+        return models.Intent.filter(action=models.Intent.ACTION__CANCEL).count()
+
+    def batch_cancels():
+        # Each --batch_cancel attempt checks the market's open orders first (see reprice.py)
+        return api_calls("cancel_all") + sum(value for (name, labels), value in metrics.counters.items()
+                                             if name == "btfd_batch_cancel_fallbacks_total")
+
+    cycle_times = []
+    failed_checks = []
+    started = time.time()
+    for cycle in range(args.cycles):
+        # The reconcile sweep should be the only get_orders call (besides the
+        #   --batch_cancel checks), and the only get_order calls should be for the
+        #   tracked orders that have left the exchange's open list since the last
+        #   batch and the ones just cancelled
+        tracked = list(models.Order.filter(status__in=[models.Order.STATUS__OPEN, models.Order.STATUS__PENDING]))
+        gone = sum(1 for order in tracked if exchange.orders.get(order.order_id, {}).get("status") != "open")
+        get_orders_before, get_order_before = api_calls("get_orders"), api_calls("get_order")
+        batch_cancels_before = batch_cancels()
+        cancels_before = cancels()
+
+        cycle_start = time.time()
+        output = None if args.verbose else io.StringIO()
+        with contextlib.redirect_stdout(output) if output else contextlib.nullcontext(), \
+                contextlib.redirect_stderr(output) if output else contextlib.nullcontext():
+            run_batch(client, client, notifier, strategies, strategies)
+        cycle_times.append(time.time() - cycle_start)
+
+        get_orders_calls = api_calls("get_orders") - get_orders_before
+        get_order_calls = api_calls("get_order") - get_order_before
+        batch_cancel_calls = batch_cancels() - batch_cancels_before
+        cancel_calls = cancels() - cancels_before
+        if args.verbose:
+            print(f"cycle {cycle}: {len(tracked)} tracked orders, {gone} gone; "
+                  f"{get_orders_calls} get_orders, {get_order_calls} get_order")
+        if get_orders_calls > (1 if tracked else 0) + batch_cancel_calls or get_order_calls > gone + cancel_calls:
+            failed_checks.append(f"cycle {cycle}: {get_orders_calls} get_orders + {get_order_calls} get_order "
+                                 f"calls for {len(tracked)} tracked orders ({gone} no longer open)")
+        exchange.advance(args.candles_per_cycle)
+
+    notifier.close()
+    errors = sum(value for (name, labels), value in metrics.counters.items()
+                 if name in ["btfd_strategy_errors_total", "btfd_reconcile_errors_total"])
+    elapsed = time.time() - started
+    if args.metrics_file:
+        metrics.export(args.metrics_file)
+    cycle_times.sort()
+    runs = len(strategies) * args.cycles
+    print("--------------------------------------------------------")
+    print(f"\t strategies:      {len(strategies)} over {len(market_names)} markets")
+    print(f"\t cycles:          {args.cycles}")
+    print(f"\t cycle p50:       {statistics.median(cycle_times) * 1000:.1f}ms")
+    print(f"\t cycle p95:       {cycle_times[int(0.95 * (len(cycle_times) - 1))] * 1000:.1f}ms")
+    print(f"\t cycle max:       {cycle_times[-1] * 1000:.1f}ms")
+    print(f"\t throughput:      {runs / elapsed:.1f} strategy runs/sec")
+    print(f"\t api calls:       {exchange.call_count} ({exchange.error_count} injected errors)")
+    print(f"\t strategy errors: {errors}")
+    print(f"\t orders:          {len(exchange.orders)} placed, {len(exchange.fills)} filled")
+    print(f"\t notifications:   {backend.sent}")
+    counters = {}
+    for (name, labels), value in metrics.counters.items():
+        if name in ["btfd_requotes_total", "btfd_requotes_skipped_total", "btfd_api_calls_saved_total",
+                    "btfd_batch_cancel_fallbacks_total"]:
+            key = name + "".join(f" {v}" for k, v in labels if k == "reason")
+            counters[key] = counters.get(key, 0) + value
+    for key, value in sorted(counters.items()):
+        print(f"\t {key}: {value}")
+    print("--------------------------------------------------------")
+
+    if args.check:
+        # Injected errors mean failed runs, retries, and fallback lookups, so only hold
+        #   a clean run to those
+        if exchange.error_count:
+            failed_checks = []
+        elif errors:
+            failed_checks.append(f"{errors} strategy errors")
+        if not exchange.orders:
+            failed_checks.append("no orders were placed")
+        for failed_check in failed_checks:
+            print(f"FAILED: {failed_check}")
+        if failed_checks:
+            exit(1)
@@ -0,0 +1,94 @@
+from decimal import Decimal
+
+from reprice import load_reprice_policy
+from signals import load_volatility_target
+
+
+
+class Strategy(object):
+    """
+        A single BUY/SELL configuration for the bot; equivalent to one set of
+        btfd_bot.py positional args (i.e. one crontab entry).
+    """
+    def __init__(self, name, market_name, order_side, amount, amount_currency,
+                 percent_diff, interval=300, ladder=None, ladder_weights=None,
+                 reprice_policy=None, profile=None, volatility_target=None):
+        self.name = name
+        self.market_name = market_name
+        self.order_side = order_side.lower()
+        self.amount = Decimal(amount)
+        self.amount_currency = amount_currency
+        self.percent_diff = Decimal(percent_diff)
+        self.interval = int(interval)
+
+        # Extra percent_diff tiers beyond `percent_diff`; `amount` is then split across
+        #   all of them according to `ladder_weights` (see ladder.py)
+        self.ladder = [Decimal(p) for p in ladder or []]
+        self.ladder_weights = [Decimal(w) for w in ladder_weights or []]
+        self.reprice_policy = reprice_policy
+        self.profile = profile      # [profile:<name>] account this runs under (see profiles.py)
+        self.volatility_target = volatility_target     # scales percent_diff with the ATR (see signals.py)
+
+        if self.order_side not in ["buy", "sell"]:
+            raise Exception(f"Invalid order_side {order_side} for strategy {name}")
+
+        if any((p < 0) != (self.percent_diff < 0) for p in self.ladder):
+            raise Exception(f"ladder tiers must all be on the same side of zero as percent_diff for strategy {name}")
+
+        if self.ladder_weights and len(self.ladder_weights) != len(self.ladder) + 1:
+            raise Exception(f"Strategy {name} needs one ladder_weight per tier (percent_diff plus each ladder tier)")
+
+    def __repr__(self):
+        percent_diffs = ", ".join(f"{p}%" for p in [self.percent_diff] + self.ladder)
+        return (f"Strategy({self.name}: {self.market_name} {self.order_side.upper()} "
+                f"{self.amount} {self.amount_currency} {percent_diffs} "
+                f"every {self.interval}s)")
+
+
+def _split_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def load_strategies(config, profile=None):
+    """
+        Reads every [strategy:<name>] section from the settings.conf ConfigParser:
+
+            [strategy:btc_dip]
+            market_name = BTC-USD
+            order_side = BUY
+            amount = 14
+            amount_currency = USD
+            percent_diff = -10.0
+            interval = 300          (optional; secs between runs, default 300)
+            ladder = -15, -20       (optional; more tiers, splitting `amount` across all of them)
+            ladder_weights = 1, 2, 3    (optional; one per tier incl. percent_diff, default even)
+            reprice_min_move = 1.0      (optional; overrides the [reprice] section, see reprice.py)
+            profile = alice         (optional; the [profile:<name>] account to trade in)
+            atr_multiple = 3        (optional; see signals.load_volatility_target)
+
+        Only the strategies for `profile` are returned; with no `profile`, only the
+            ones that don't name a profile.
+    """
+    default_policy = load_reprice_policy(config)
+    strategies = []
+    for section in config.sections():
+        if not section.startswith("strategy:"):
+            continue
+        name = section[len("strategy:"):]
+        if config.get(section, 'profile', fallback=None) != profile:
+            continue
+        strategies.append(Strategy(
+            name=name,
+            market_name=config.get(section, 'market_name'),
+            order_side=config.get(section, 'order_side'),
+            amount=config.get(section, 'amount'),
+            amount_currency=config.get(section, 'amount_currency'),
+            percent_diff=config.get(section, 'percent_diff'),
+            interval=config.getint(section, 'interval', fallback=300),
+            ladder=_split_list(config.get(section, 'ladder', fallback="")),
+            ladder_weights=_split_list(config.get(section, 'ladder_weights', fallback="")),
+            reprice_policy=load_reprice_policy(config, section, defaults=default_policy, prefix='reprice_'),
+            profile=profile,
+            volatility_target=load_volatility_target(config, section),
+        ))
+    return strategies
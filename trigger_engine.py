@@ -0,0 +1,176 @@
+import threading
+
+from decimal import Decimal
+
+from sortedcontainers import SortedDict
+
+
+
+class TriggerLevel(object):
+    """
+        One armed strategy: the running high (BUY) or low (SELL) since its anchor,
+            the target_price that implies, and the price that sets it off
+            (`band` percent short of the target). All in the market's price ticks.
+    """
+    def __init__(self, strategy, numerics, band):
+        self.strategy = strategy
+        self.numerics = numerics
+        self.buy = strategy.percent_diff < 0
+        # A BUY fires once price falls to within `band` percent above its target; a SELL
+        #   once it rises to within `band` percent below
+        self.band = Decimal(band) if self.buy else -Decimal(band)
+        self.extreme = None
+        self.target = None
+        self.trigger = None
+
+    def set_extreme(self, extreme):
+        self.extreme = extreme
+        self.target = self.numerics.target_ticks(extreme, self.strategy.percent_diff)
+        self.trigger = self.numerics.target_ticks(self.target, self.band)
+
+    def __repr__(self):
+        format_price = self.numerics.format_price
+        return (f"TriggerLevel({self.strategy.name}: "
+                f"extreme {format_price(self.extreme) if self.extreme is not None else None}, "
+                f"target {format_price(self.target) if self.target is not None else None}, "
+                f"trigger {format_price(self.trigger) if self.trigger is not None else None})")
+
+
+
+class MarketLevels(object):
+    """
+        Every armed level for one market, indexed by price:
+
+            buy_extremes / sell_extremes    which levels a trade makes a new high/low for
+            buy_triggers / sell_triggers    which levels a trade sets off
+
+        Keys are (price ticks, strategy name), so each lookup is a range scan that
+            only touches the levels it returns.
+    """
+    def __init__(self, numerics):
+        self.numerics = numerics
+        self.buy_extremes = SortedDict()
+        self.buy_triggers = SortedDict()
+        self.sell_extremes = SortedDict()
+        self.sell_triggers = SortedDict()
+
+    def add(self, level):
+        name = level.strategy.name
+        if level.buy:
+            # No extreme yet: the first trade sets it
+            self.buy_extremes[(level.extreme if level.extreme is not None else -1, name)] = level
+            if level.trigger is not None:
+                self.buy_triggers[(level.trigger, name)] = level
+        else:
+            self.sell_extremes[(level.extreme if level.extreme is not None else float("inf"), name)] = level
+            if level.trigger is not None:
+                self.sell_triggers[(level.trigger, name)] = level
+
+    def remove(self, level):
+        name = level.strategy.name
+        if level.buy:
+            self.buy_extremes.pop((level.extreme if level.extreme is not None else -1, name), None)
+            self.buy_triggers.pop((level.trigger, name), None)
+        else:
+            self.sell_extremes.pop((level.extreme if level.extreme is not None else float("inf"), name), None)
+            self.sell_triggers.pop((level.trigger, name), None)
+
+    def __len__(self):
+        return len(self.buy_extremes) + len(self.sell_extremes)
+
+
+
+class TriggerEngine(object):
+    """
+        Event-driven alternative to keeping a GTC order resting at every target_price:
+            each armed strategy is just a price level in a per-market sorted index,
+            and every trade tick from the MarketFeed is checked against it in
+            O(log n) (plus the levels it actually moves or sets off).
+
+        A tick that makes a new high (BUY) or low (SELL) since a level's anchor
+            re-prices that level. A tick within `band` percent of a level's
+            target_price fires it: the level is disarmed and its strategy is
+            returned by on_tick so the caller can place the order.
+
+        So one process can watch hundreds of dip/pump levels across markets with no
+            resting orders and no polling.
+    """
+    def __init__(self, band=Decimal("0.5")):
+        self.band = Decimal(band)
+        self.lock = threading.Lock()
+        self.markets = {}       # market_name -> MarketLevels
+        self.levels = {}        # strategy name -> TriggerLevel
+
+    def arm(self, strategy, numerics, extreme=None):
+        """
+            Start watching `strategy` (replacing any level it already has).
+                `extreme` is the high (BUY) or low (SELL) since its anchor so far,
+                as a price string/Decimal/float; None to start from the next trade.
+        """
+        level = TriggerLevel(strategy, numerics, self.band)
+        if extreme is not None:
+            level.set_extreme(numerics.price_ticks(extreme))
+        with self.lock:
+            self._remove(strategy.name)
+            book = self.markets.get(strategy.market_name)
+            if book is None:
+                book = self.markets[strategy.market_name] = MarketLevels(numerics)
+            book.add(level)
+            self.levels[strategy.name] = level
+        return level
+
+    def disarm(self, strategy_name):
+        with self.lock:
+            return self._remove(strategy_name)
+
+    def _remove(self, strategy_name):
+        level = self.levels.pop(strategy_name, None)
+        if level:
+            self.markets[level.strategy.market_name].remove(level)
+        return level
+
+    def is_armed(self, strategy_name):
+        return strategy_name in self.levels
+
+    def on_tick(self, market_name, price):
+        """
+            Checks one trade price against the market's levels. Returns the
+                strategies whose levels fired (now disarmed).
+        """
+        book = self.markets.get(market_name)
+        if not book:
+            return []
+
+        fired = []
+        with self.lock:
+            ticks = book.numerics.price_ticks(price)
+
+            # New highs: every BUY level whose extreme is below this trade
+            for key in list(book.buy_extremes.irange(maximum=(ticks,), inclusive=(True, False))):
+                level = book.buy_extremes[key]
+                book.remove(level)
+                level.set_extreme(ticks)
+                book.add(level)
+
+            # New lows: every SELL level whose extreme is above this trade
+            for key in list(book.sell_extremes.irange(minimum=(ticks + 1,))):
+                level = book.sell_extremes[key]
+                book.remove(level)
+                level.set_extreme(ticks)
+                book.add(level)
+
+            # BUYs fire at or below their trigger; SELLs at or above
+            for key in list(book.buy_triggers.irange(minimum=(ticks,))):
+                fired.append(book.buy_triggers[key])
+            for key in list(book.sell_triggers.irange(maximum=(ticks + 1,), inclusive=(True, False))):
+                fired.append(book.sell_triggers[key])
+
+            for level in fired:
+                self._remove(level.strategy.name)
+
+        for level in fired:
+            print(f"TRIGGERED: {level} @ {book.numerics.format_price(ticks)}")
+        return [level.strategy for level in fired]
+
+    def __len__(self):
+        return len(self.levels)
@@ -1,6 +1,33 @@
 import datetime
-import dateutil
+
 
 
 def convert_datetime_str(datetime_str):
+	"""
+		Coinbase timestamps are almost always plain ISO-8601 UTC ("...T20:02:28.53864Z"),
+			which the stdlib can parse without importing dateutil. Anything unusual
+			falls back to dateutil.
+	"""
+	value = datetime_str
+	if value.endswith("Z"):
+		value = value[:-1]
+	if "." in value:
+		# fromisoformat only takes exactly 3 or 6 fractional digits
+		value, fraction = value.split(".", 1)
+		if fraction.isdigit():
+			value = f"{value}.{fraction[:6].ljust(6, '0')}"
+		else:
+			value = None
+	if value:
+		try:
+			return datetime.datetime.fromisoformat(value).replace(tzinfo=None)
+		except ValueError:
+			pass
+
+	import dateutil.parser
 	return dateutil.parser.parse(datetime_str).replace(tzinfo=None)
+
+
+def utc_timestamp(naive_datetime):
+	""" Epoch secs for a tz-naive datetime from the db (which is always UTC) """
+	return naive_datetime.replace(tzinfo=datetime.timezone.utc).timestamp()